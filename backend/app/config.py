@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pydantic import BaseSettings
 from typing import Optional
 
@@ -6,6 +7,9 @@ class Settings(BaseSettings):
     # Database settings - Connection URL approach
     _DATABASE_URL: Optional[str] = os.getenv("DATABASE_URL", None)
     
+    # "postgres", or "sqlite" for single-node/edge boxes without a database server
+    DB_ENGINE: str = os.getenv("DB_ENGINE", "postgres").lower()
+    
     # Database settings - Individual credentials approach
     DB_USERNAME: str = os.getenv("DB_USERNAME", "postgres")
     DB_PASSWORD: str = os.getenv("DB_PASSWORD", "postgres")
@@ -14,6 +18,32 @@ class Settings(BaseSettings):
     DB_DATABASE: str = os.getenv("DB_DATABASE", "drs_app")
     DB_SSL: bool = os.getenv("DB_SSL", "false").lower() == "true"
     
+    # Connection pool settings (asyncpg)
+    DB_POOL_MIN_SIZE: int = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+    DB_POOL_MAX_SIZE: int = int(os.getenv("DB_POOL_MAX_SIZE", 5))
+    DB_POOL_MAX_QUERIES: int = int(os.getenv("DB_POOL_MAX_QUERIES", 50000))  # recycle a connection after this many queries
+    DB_POOL_MAX_IDLE_SECONDS: float = float(os.getenv("DB_POOL_MAX_IDLE_SECONDS", 300))
+    DB_POOL_MAX_LIFETIME_SECONDS: float = float(os.getenv("DB_POOL_MAX_LIFETIME_SECONDS", 0))  # 0 = never recycle by age
+    DB_STATEMENT_CACHE_SIZE: int = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))  # 0 behind pgbouncer in transaction mode
+    
+    # Optional read replica for GET handlers; unset host disables it
+    DB_REPLICA_HOST: str = os.getenv("DB_REPLICA_HOST", "")
+    DB_REPLICA_PORT: str = os.getenv("DB_REPLICA_PORT", os.getenv("DB_PORT", "5432"))
+    DB_REPLICA_USERNAME: str = os.getenv("DB_REPLICA_USERNAME", os.getenv("DB_USERNAME", "postgres"))
+    DB_REPLICA_PASSWORD: str = os.getenv("DB_REPLICA_PASSWORD", os.getenv("DB_PASSWORD", "postgres"))
+    DB_REPLICA_POOL_MIN_SIZE: int = int(os.getenv("DB_REPLICA_POOL_MIN_SIZE", os.getenv("DB_POOL_MIN_SIZE", 1)))
+    DB_REPLICA_POOL_MAX_SIZE: int = int(os.getenv("DB_REPLICA_POOL_MAX_SIZE", os.getenv("DB_POOL_MAX_SIZE", 5)))
+    DB_REPLICA_RETRY_SECONDS: float = float(os.getenv("DB_REPLICA_RETRY_SECONDS", 30))
+    DB_REPLICA_STICKY_SECONDS: float = float(os.getenv("DB_REPLICA_STICKY_SECONDS", 5))  # read your own writes from the primary
+    
+    # Embedded SQLite (DB_ENGINE=sqlite); the schema is created at startup, migrations are Postgres-only
+    SQLITE_PATH: str = os.getenv("SQLITE_PATH", "drs_app.sqlite3")
+    SQLITE_SYNCHRONOUS: str = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # FULL also survives power loss, at a write latency cost
+    SQLITE_MMAP_SIZE: int = int(os.getenv("SQLITE_MMAP_SIZE", 268435456))  # bytes of the file read through mmap
+    SQLITE_CACHE_SIZE_KB: int = int(os.getenv("SQLITE_CACHE_SIZE_KB", 65536))  # page cache per connection
+    SQLITE_BUSY_TIMEOUT_MS: int = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+    SQLITE_READ_CONNECTION: bool = os.getenv("SQLITE_READ_CONNECTION", "true").lower() == "true"
+    
     @property
     def DATABASE_URL(self) -> str:
         # Build the connection URL from individual credentials
@@ -21,22 +51,79 @@ class Settings(BaseSettings):
         print(f"Using database URL: postgres://{self.DB_USERNAME}:****@{self.DB_HOST}:{self.DB_PORT}/{self.DB_DATABASE}")
         return db_url
     
+    @property
+    def database_pool_options(self) -> dict:
+        """asyncpg pool and connection options shared by the primary and the replica."""
+        return {
+            "max_queries": self.DB_POOL_MAX_QUERIES,
+            "max_inactive_connection_lifetime": self.DB_POOL_MAX_IDLE_SECONDS,
+            "statement_cache_size": self.DB_STATEMENT_CACHE_SIZE,
+        }
+    
+    @property
+    def sqlite_pragmas(self) -> dict:
+        """PRAGMAs run on every SQLite connection. WAL lets readers run while the writer commits."""
+        return {
+            "journal_mode": "WAL",
+            "synchronous": self.SQLITE_SYNCHRONOUS,
+            "mmap_size": self.SQLITE_MMAP_SIZE,
+            "cache_size": -self.SQLITE_CACHE_SIZE_KB,  # negative means KiB rather than pages
+            "busy_timeout": self.SQLITE_BUSY_TIMEOUT_MS,
+            "temp_store": "MEMORY",
+            "foreign_keys": "ON",
+            "journal_size_limit": 67108864,
+        }
+    
+    @property
+    def replica_credentials(self) -> Optional[dict]:
+        """Credentials for the read replica, or None when no replica is configured."""
+        if self.DB_ENGINE == "sqlite":
+            # The "replica" is a second, read-only connection to the same file
+            if not self.SQLITE_READ_CONNECTION or self.SQLITE_PATH == ":memory:":
+                return None
+            return {"file_path": self.SQLITE_PATH, **self.sqlite_pragmas, "query_only": "ON"}
+        if not self.DB_REPLICA_HOST:
+            return None
+        return {
+            "host": self.DB_REPLICA_HOST,
+            "port": self.DB_REPLICA_PORT,
+            "user": self.DB_REPLICA_USERNAME,
+            "password": self.DB_REPLICA_PASSWORD,
+            "database": self.DB_DATABASE,
+            "ssl": "require" if self.DB_SSL else None,
+            "minsize": self.DB_REPLICA_POOL_MIN_SIZE,
+            "maxsize": self.DB_REPLICA_POOL_MAX_SIZE,
+            **self.database_pool_options,
+        }
+    
+    @property
+    def database_connection(self) -> dict:
+        if self.DB_ENGINE == "sqlite":
+            return {
+                "engine": "app.utils.sqlite",
+                "credentials": {"file_path": self.SQLITE_PATH, **self.sqlite_pragmas},
+            }
+        return {
+            "engine": "tortoise.backends.asyncpg",
+            "credentials": {
+                "host": self.DB_HOST,
+                "port": self.DB_PORT,
+                "user": self.DB_USERNAME,
+                "password": self.DB_PASSWORD,
+                "database": self.DB_DATABASE,
+                "ssl": "require" if self.DB_SSL else None,
+                "minsize": self.DB_POOL_MIN_SIZE,
+                "maxsize": self.DB_POOL_MAX_SIZE,
+                **self.database_pool_options,
+            }
+        }
+    
     @property
     def database_config(self) -> dict:
-        """Return database configuration with SSL settings for asyncpg."""
+        """Return database configuration with SSL settings for asyncpg (or the SQLite file)."""
         config = {
             "connections": {
-                "default": {
-                    "engine": "tortoise.backends.asyncpg",
-                    "credentials": {
-                        "host": self.DB_HOST,
-                        "port": self.DB_PORT,
-                        "user": self.DB_USERNAME,
-                        "password": self.DB_PASSWORD,
-                        "database": self.DB_DATABASE,
-                        "ssl": "require" if self.DB_SSL else None
-                    }
-                }
+                "default": self.database_connection
             },
             "apps": {
                 "models": {
@@ -47,11 +134,58 @@ class Settings(BaseSettings):
         }
         return config
     
+    # Production server (app/server.py)
+    SERVER_HOST: str = os.getenv("SERVER_HOST", "0.0.0.0")
+    SERVER_PORT: int = int(os.getenv("SERVER_PORT", 8000))
+    WEB_CONCURRENCY: int = int(os.getenv("WEB_CONCURRENCY", 0))  # worker processes, 0 = one per CPU
+    SERVER_TIMEOUT: int = int(os.getenv("SERVER_TIMEOUT", 60))  # restart workers silent for longer than this
+    SERVER_GRACEFUL_TIMEOUT: int = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", 30))
+    SERVER_KEEPALIVE: int = int(os.getenv("SERVER_KEEPALIVE", 5))
+    SERVER_MAX_REQUESTS: int = int(os.getenv("SERVER_MAX_REQUESTS", 0))  # recycle workers after N requests, 0 = never
+    SERVER_MAX_REQUESTS_JITTER: int = int(os.getenv("SERVER_MAX_REQUESTS_JITTER", 0))
+    # Reverse proxies (comma-separated IPs, or *) whose X-Forwarded-For is trusted for the client address
+    FORWARDED_ALLOW_IPS: str = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+    DRAIN_DELAY_SECONDS: float = float(os.getenv("DRAIN_DELAY_SECONDS", 0))  # keep serving (health = 503) before exiting
+    DB_MAX_CONNECTIONS: int = int(os.getenv("DB_MAX_CONNECTIONS", 100))  # the database server's max_connections
+    DB_RESERVED_CONNECTIONS: int = int(os.getenv("DB_RESERVED_CONNECTIONS", 5))  # left for migrations, psql, etc.
+    
     # JWT settings
     SECRET_KEY: str = os.getenv("SECRET_KEY", "your-secret-key-for-jwt-please-change-in-production")
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7  # 7 days
     
+    # Auth cache settings (decoded tokens and user rows). Changes to a user are
+    # only invalidated in the worker that made them; other workers serve the
+    # cached row for up to the TTL, so keep it short with several workers
+    AUTH_CACHE_SIZE: int = int(os.getenv("AUTH_CACHE_SIZE", 10000))
+    AUTH_CACHE_TTL_SECONDS: float = float(os.getenv("AUTH_CACHE_TTL_SECONDS", 5))
+    
+    # Auth endpoint throttling, "<requests>/<seconds>" per bucket
+    RATE_LIMIT_ENABLED: bool = bool(int(os.getenv("RATE_LIMIT_ENABLED", 1)))
+    RATE_LIMIT_BACKEND: str = os.getenv("RATE_LIMIT_BACKEND", "memory")  # "memory" or "redis"
+    RATE_LIMIT_REDIS_URL: str = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+    RATE_LIMIT_MAX_KEYS: int = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000))
+    RATE_LIMIT_SIGNIN_PER_IP: str = os.getenv("RATE_LIMIT_SIGNIN_PER_IP", "20/60")
+    RATE_LIMIT_SIGNIN_PER_EMAIL: str = os.getenv("RATE_LIMIT_SIGNIN_PER_EMAIL", "10/300")
+    RATE_LIMIT_EMAIL_PER_IP: str = os.getenv("RATE_LIMIT_EMAIL_PER_IP", "10/600")  # signup, OTP resend, password reset
+    RATE_LIMIT_EMAIL_PER_EMAIL: str = os.getenv("RATE_LIMIT_EMAIL_PER_EMAIL", "3/600")
+    
+    # One-time codes (email verification, password reset)
+    OTP_TTL_SECONDS: int = int(os.getenv("OTP_TTL_SECONDS", 600))
+    OTP_MAX_ATTEMPTS: int = int(os.getenv("OTP_MAX_ATTEMPTS", 5))
+    OTP_SWEEP_INTERVAL_SECONDS: float = float(os.getenv("OTP_SWEEP_INTERVAL_SECONDS", 300))
+    OTP_SWEEP_BATCH_SIZE: int = int(os.getenv("OTP_SWEEP_BATCH_SIZE", 1000))
+    
+    # last_login write-behind
+    LAST_LOGIN_FLUSH_SECONDS: float = float(os.getenv("LAST_LOGIN_FLUSH_SECONDS", 5))
+    LAST_LOGIN_FLUSH_SIZE: int = int(os.getenv("LAST_LOGIN_FLUSH_SIZE", 500))
+    
+    # Password hashing settings
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", 12))
+    PASSWORD_HASH_EXECUTOR: str = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")  # "thread" or "process"
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+    PASSWORD_HASH_MAX_CONCURRENCY: int = int(os.getenv("PASSWORD_HASH_MAX_CONCURRENCY", 4))
+    
     # SMTP email settings
     SMTP_HOST: str = os.getenv("SMTP_HOST", "smtp.example.com")
     SMTP_PORT: int = int(os.getenv("SMTP_PORT", 587))
@@ -59,6 +193,65 @@ class Settings(BaseSettings):
     SMTP_PASSWORD: str = os.getenv("SMTP_PASSWORD", "")
     SMTP_FROM_EMAIL: str = os.getenv("SMTP_FROM_EMAIL", "noreply@example.com")
     SMTP_USE_TLS: bool = bool(int(os.getenv("SMTP_USE_TLS", 1)))
+    SMTP_TIMEOUT: float = float(os.getenv("SMTP_TIMEOUT", 10))
+    SMTP_IDLE_PROBE_SECONDS: float = float(os.getenv("SMTP_IDLE_PROBE_SECONDS", 30))
+    SMTP_IDLE_TIMEOUT_SECONDS: float = float(os.getenv("SMTP_IDLE_TIMEOUT_SECONDS", 60))
+    SMTP_OUTBOX_WORKERS: int = int(os.getenv("SMTP_OUTBOX_WORKERS", 1))
+    SMTP_BATCH_SIZE: int = int(os.getenv("SMTP_BATCH_SIZE", 20))
+    SMTP_MAX_ATTEMPTS: int = int(os.getenv("SMTP_MAX_ATTEMPTS", 5))
+    SMTP_RETRY_BACKOFF_SECONDS: float = float(os.getenv("SMTP_RETRY_BACKOFF_SECONDS", 2))
+    SMTP_OUTBOX_HISTORY: int = int(os.getenv("SMTP_OUTBOX_HISTORY", 1000))
+    
+    # Coupon list pagination
+    COUPON_PAGE_SIZE: int = int(os.getenv("COUPON_PAGE_SIZE", 50))
+    COUPON_PAGE_MAX_SIZE: int = int(os.getenv("COUPON_PAGE_MAX_SIZE", 500))
+    
+    # Barcode search; shorter queries only match prefixes
+    COUPON_SEARCH_MIN_SUBSTRING_LENGTH: int = int(os.getenv("COUPON_SEARCH_MIN_SUBSTRING_LENGTH", 3))
+    COUPON_SEARCH_MAX_OFFSET: int = int(os.getenv("COUPON_SEARCH_MAX_OFFSET", 10000))
+    
+    # Bulk coupon ingestion
+    COUPON_BATCH_MAX_SIZE: int = int(os.getenv("COUPON_BATCH_MAX_SIZE", 1000))
+    COUPON_COPY_THRESHOLD: int = int(os.getenv("COUPON_COPY_THRESHOLD", 200))
+    
+    # Response compression for coupon lists
+    COMPRESS_MIN_SIZE: int = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+    GZIP_LEVEL: int = int(os.getenv("GZIP_LEVEL", 5))
+    BROTLI_QUALITY: int = int(os.getenv("BROTLI_QUALITY", 4))
+    
+    # Barcode decoding (app/utils/barcodes.py)
+    BARCODE_CHECK_DIGITS: bool = bool(int(os.getenv("BARCODE_CHECK_DIGITS", 1)))  # reject EAN/UPC/GS1 codes with a wrong check digit
+    BARCODE_DECODE_VALUES: bool = bool(int(os.getenv("BARCODE_DECODE_VALUES", 1)))  # fill in embedded values when the client sends none
+    BARCODE_DEFAULT_CURRENCY: str = os.getenv("BARCODE_DEFAULT_CURRENCY", "EUR")
+    BARCODE_RULE_CACHE_SIZE: int = int(os.getenv("BARCODE_RULE_CACHE_SIZE", 4096))
+    
+    # Duplicate scan filter
+    SCAN_DEDUP_CACHE_SIZE: int = int(os.getenv("SCAN_DEDUP_CACHE_SIZE", 10000))
+    SCAN_DEDUP_TTL_SECONDS: float = float(os.getenv("SCAN_DEDUP_TTL_SECONDS", 30))
+    
+    # Streaming export
+    COUPON_EXPORT_CHUNK_SIZE: int = int(os.getenv("COUPON_EXPORT_CHUNK_SIZE", 1000))
+    
+    # Moving old redeemed coupons to coupon_archive; interval 0 disables the mover
+    COUPON_ARCHIVE_AFTER_DAYS: int = int(os.getenv("COUPON_ARCHIVE_AFTER_DAYS", 30))
+    COUPON_ARCHIVE_INTERVAL_SECONDS: float = float(os.getenv("COUPON_ARCHIVE_INTERVAL_SECONDS", 600))
+    COUPON_ARCHIVE_BATCH_SIZE: int = int(os.getenv("COUPON_ARCHIVE_BATCH_SIZE", 500))
+    
+    # Coupon change feed (GET /api/coupons/events)
+    EVENTS_CHANNEL: str = os.getenv("EVENTS_CHANNEL", "coupon_events")  # Postgres NOTIFY channel shared by all workers
+    EVENTS_RETRY_SECONDS: float = float(os.getenv("EVENTS_RETRY_SECONDS", 5))
+    SSE_HEARTBEAT_SECONDS: float = float(os.getenv("SSE_HEARTBEAT_SECONDS", 15))
+    SSE_QUEUE_SIZE: int = int(os.getenv("SSE_QUEUE_SIZE", 100))  # events a slow stream may lag behind before a resync
+    
+    # Request profiling (app/utils/profiling.py); no admin key disables the header and /api/admin
+    PROFILE_ADMIN_KEY: str = os.getenv("PROFILE_ADMIN_KEY", "")
+    PROFILE_SAMPLE_RATE: float = float(os.getenv("PROFILE_SAMPLE_RATE", 0))  # fraction of requests profiled at random
+    PROFILE_INTERVAL_MS: float = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+    PROFILE_MAX_CONCURRENT: int = int(os.getenv("PROFILE_MAX_CONCURRENT", 2))
+    PROFILE_MAX_SECONDS: float = float(os.getenv("PROFILE_MAX_SECONDS", 30))  # sampling stops after this
+    PROFILE_MAX_QUERIES: int = int(os.getenv("PROFILE_MAX_QUERIES", 500))  # per profile
+    PROFILE_DIR: str = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "drs-profiles"))
+    PROFILE_MAX_RECORDINGS: int = int(os.getenv("PROFILE_MAX_RECORDINGS", 200))  # oldest are deleted beyond this
     
     # CORS settings
     CORS_ORIGINS: list = ["http://localhost:3000", "http://localhost:5173"]
@@ -18,8 +18,6 @@ async def run():
             "name": "Test User",
             "password_hash": bcrypt.hash("test"),
             "is_verified": True,
-            "otp": None,
-            "otp_created_at": None,
             "last_login": datetime.utcnow(),
         }
     )
@@ -1,10 +1,17 @@
-from fastapi import Depends, HTTPException, status, Request
+from fastapi import Depends, Header, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
+from tortoise.signals import post_delete, post_save
 from app.config import settings
 from app.models import User
+from app.utils.cache import TTLCache
+from app.utils.db import read_replica
 from app.utils.logger import logger
+from app.utils.logins import last_login_buffer
+from app.utils.metrics import JWT_DECODE_SECONDS
+from app.utils.profiling import admin_token_valid
 from typing import Optional
+import time
 
 # Update tokenUrl to match the actual endpoint
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/signin", auto_error=False)
@@ -12,12 +19,67 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/signin", auto_error=Fal
 # Constants for test user
 TEST_USER_EMAIL = "test@gmail.com"
 
+# Decoded tokens (token -> user id) and user rows, so authenticated requests
+# don't pay for a JWT decode and a user query every time. The signal handlers
+# below only clear this process's copies: under app.server each worker has its
+# own cache, and the others keep a changed or deleted user for up to
+# AUTH_CACHE_TTL_SECONDS (default 5s for that reason)
+token_cache = TTLCache(maxsize=settings.AUTH_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL_SECONDS)
+user_cache = TTLCache(maxsize=settings.AUTH_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL_SECONDS)
+
+def _decode_token(token: str) -> Optional[str]:
+    """Return the user id in the token's sub claim. Raises JWTError for invalid tokens."""
+    user_id = token_cache.get(token)
+    if user_id is not None:
+        return user_id
+    with JWT_DECODE_SECONDS.time():
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    user_id = payload.get("sub")
+    if user_id is None:
+        return None
+    # Never keep a token cached past its own expiry
+    ttl = settings.AUTH_CACHE_TTL_SECONDS
+    if payload.get("exp"):
+        ttl = min(ttl, payload["exp"] - time.time())
+    token_cache.set(token, user_id, ttl=ttl)
+    return user_id
+
+async def _get_user(**lookup) -> Optional[User]:
+    (field, value), = lookup.items()
+    key = (field, str(value))
+    user = user_cache.get(key)
+    if user is None:
+        user = await read_replica.read(
+            lambda db: User.filter(**lookup).using_db(db).first(),
+            pin_key=str(value) if field == "id" else None,
+        )
+        if user is not None:
+            user_cache.set(("id", str(user.id)), user)
+            user_cache.set(("email", user.email), user)
+    if user is not None:
+        # A login that is not written to the database yet is still newer
+        user.last_login = last_login_buffer.pending_for(user.id) or user.last_login
+    return user
+
+def invalidate_user(user: User):
+    read_replica.pin(str(user.id))
+    user_cache.pop(("id", str(user.id)))
+    user_cache.pop(("email", user.email))
+
+@post_save(User)
+async def _user_saved(sender, instance, created, using_db, update_fields):
+    invalidate_user(instance)
+
+@post_delete(User)
+async def _user_deleted(sender, instance, using_db):
+    invalidate_user(instance)
+
 async def get_current_user(token: Optional[str] = Depends(oauth2_scheme), request: Request = None):
     # First check if it's the test user by looking at headers or cookies
     if request and await _is_test_user_request(request):
-        test_user = await User.get_or_none(email=TEST_USER_EMAIL)
+        test_user = await _get_user(email=TEST_USER_EMAIL)
         if test_user:
-            logger.info(f"Auto-authenticated test user: {TEST_USER_EMAIL}")
+            logger.info("Auto-authenticated test user: %s", TEST_USER_EMAIL)
             return test_user
     
     # If not a test user and no token, raise exception
@@ -35,22 +97,32 @@ async def get_current_user(token: Optional[str] = Depends(oauth2_scheme), reques
     )
     
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        user_id: str = payload.get("sub")
+        user_id: str = _decode_token(token)
         if user_id is None:
-            logger.error(f"JWT missing sub: {token}")
+            logger.error("JWT missing sub")
             raise credentials_exception
     except JWTError as e:
-        logger.error(f"JWTError: {e} | Token: {token[:20] if token and len(token) > 20 else token}...")
+        logger.error("JWTError: %s", e)
         raise credentials_exception
     
-    user = await User.get_or_none(id=user_id)
+    user = await _get_user(id=user_id)
     if user is None:
-        logger.error(f"No user found for id: {user_id}")
+        logger.error("No user found for id: %s", user_id)
         raise credentials_exception
     
     return user
 
+async def get_stream_user(
+    request: Request, token: Optional[str] = None, header_token: Optional[str] = Depends(oauth2_scheme)
+):
+    """get_current_user, also taking the token as ?token= since EventSource cannot send headers."""
+    return await get_current_user(token or header_token, request)
+
+async def require_admin(x_admin_signature: Optional[str] = Header(None)):
+    """Admin endpoints take a signed, expiring X-Admin-Signature (see app.utils.profiling)."""
+    if not admin_token_valid(x_admin_signature):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Valid admin signature required")
+
 # Helper function to check if request is from test user
 async def _is_test_user_request(request: Request) -> bool:
     # Check for a special header or cookie that indicates test user
@@ -71,9 +143,9 @@ async def _is_test_user_request(request: Request) -> bool:
 async def get_optional_user(request: Request):
     # First check if it's the test user
     if await _is_test_user_request(request):
-        test_user = await User.get_or_none(email=TEST_USER_EMAIL)
+        test_user = await _get_user(email=TEST_USER_EMAIL)
         if test_user:
-            logger.info(f"Auto-authenticated optional test user: {TEST_USER_EMAIL}")
+            logger.info("Auto-authenticated optional test user: %s", TEST_USER_EMAIL)
             return test_user
     
     # Otherwise proceed with normal token validation
@@ -86,12 +158,11 @@ async def get_optional_user(request: Request):
         if scheme.lower() != "bearer":
             return None
         
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        user_id = payload.get("sub")
+        user_id = _decode_token(token)
         if not user_id:
             return None
         
-        user = await User.get_or_none(id=user_id)
+        user = await _get_user(id=user_id)
         return user
     except (JWTError, ValueError):
         return None
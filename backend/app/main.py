@@ -1,9 +1,36 @@
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from tortoise import Tortoise, run_async
 from contextlib import asynccontextmanager
-from app.routes import auth, coupons
+from app.routes import admin, auth, coupons
 from app.config import settings
+from app.deps import token_cache, user_cache
+from app.utils.db import pool_recycler, pool_stats, read_replica
+from app.utils.email import email_outbox
+from app.utils.events import coupon_events
+from app.utils.logger import log_listener, logging_stats
+from app.utils.logins import last_login_buffer
+from app.utils.archive import coupon_archiver
+from app.utils.otp import otp_sweeper
+from app.utils.metrics import MetricsMiddleware, instrument_tortoise, metrics
+from app.utils.passwords import password_hasher
+from app.utils.profiling import ProfilingMiddleware, profiling_stats
+from app.utils.ratelimit import auth_rate_limiter
+
+metrics.register_collector("drs_bcrypt_pool", password_hasher.stats)
+metrics.register_collector("drs_email_outbox", email_outbox.stats)
+metrics.register_collector("drs_auth_token_cache", token_cache.stats)
+metrics.register_collector("drs_auth_user_cache", user_cache.stats)
+metrics.register_collector("drs_logging", logging_stats)
+metrics.register_collector("drs_auth_rate_limit", auth_rate_limiter.stats)
+metrics.register_collector("drs_otp_sweeper", otp_sweeper.stats)
+metrics.register_collector("drs_last_login_buffer", last_login_buffer.stats)
+metrics.register_collector("drs_coupon_archive", coupon_archiver.stats)
+metrics.register_collector("drs_coupon_events", coupon_events.stats)
+metrics.register_collector("drs_profiler", profiling_stats)
+metrics.register_collector("drs_db", pool_stats)
+metrics.register_collector("drs_db_replica", read_replica.stats)
 
 # Initialize Tortoise ORM
 async def init_db():
@@ -26,9 +53,28 @@ async def init_db():
 async def lifespan(app: FastAPI):
     # Startup: Initialize DB
     await init_db()
+    # Time every ORM query; client classes are only importable once Tortoise is initialised
+    instrument_tortoise()
+    await read_replica.connect()
+    pool_recycler.start()
+    email_outbox.start()
+    otp_sweeper.start()
+    last_login_buffer.start()
+    coupon_archiver.start()
+    coupon_events.start()
     yield  # App runs here
-    # Shutdown: Close DB connections
+    # Shutdown: Flush queued email, close DB connections and worker pools
+    await coupon_events.stop()
+    await coupon_archiver.stop()
+    await otp_sweeper.stop()
+    await last_login_buffer.stop()
+    await email_outbox.stop()
+    await pool_recycler.stop()
+    await read_replica.close()
     await Tortoise.close_connections()
+    password_hasher.shutdown()
+    # Write out queued log records before the worker exits
+    log_listener.stop()
 
 app = FastAPI(title="DRS Coupon App API", description="API for DRS Coupon Management", lifespan=lifespan)
 
@@ -39,16 +85,33 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Next-Offset", "X-Duplicate", "X-Profile-Id", "ETag"],
 )
 
+# Signed or sampled request profiles, stored for /api/admin/profiles
+app.add_middleware(ProfilingMiddleware)
+
+# Per-route request metrics (outermost, so it sees the final status)
+app.add_middleware(MetricsMiddleware)
+
 # Include routers
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
 app.include_router(coupons.router, prefix="/api/coupons", tags=["coupons"])
+app.include_router(admin.router, prefix="/api/admin", tags=["admin"])
 
 @app.get("/api/health", tags=["Health"])
 async def health_check():
+    # Set by app.server while a worker drains before shutting down
+    if getattr(app.state, "draining", False):
+        return JSONResponse({"status": "draining"}, status_code=503)
     return {"status": "healthy"}
 
+@app.get("/api/metrics", tags=["Health"], response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
+    uvicorn.run(
+        "app.main:app", host="0.0.0.0", port=8000, reload=True, forwarded_allow_ips=settings.FORWARDED_ALLOW_IPS
+    )
@@ -1,4 +1,5 @@
 from tortoise import fields, models
+from tortoise.indexes import Index
 from tortoise.contrib.pydantic import pydantic_model_creator
 from datetime import datetime
 
@@ -8,8 +9,6 @@ class User(models.Model):
     name = fields.CharField(max_length=255, null=True)
     password_hash = fields.CharField(max_length=255, null=True)
     is_verified = fields.BooleanField(default=False)
-    otp = fields.CharField(max_length=6, null=True)
-    otp_created_at = fields.DatetimeField(null=True)
     created_at = fields.DatetimeField(auto_now_add=True)
     last_login = fields.DatetimeField(null=True)
 
@@ -26,12 +25,98 @@ class Coupon(models.Model):
     scanned_at = fields.DatetimeField(auto_now_add=True)
     used_at = fields.DatetimeField(null=True)
     
+    class Meta:
+        # Keyset pagination walks (scanned_at, id) newest-first per user.
+        # Names must match migrations/models/1_20250610090000_coupon_list_indexes.py
+        indexes = (
+            Index(fields=("user_id", "is_used", "scanned_at", "id"), name="idx_coupon_user_used_scanned"),
+            Index(fields=("user_id", "scanned_at", "id"), name="idx_coupon_user_scanned"),
+            # The archiver picks the oldest redeemed coupons (migrations/models/6_20250624090000_coupon_archive.py)
+            Index(fields=("used_at",), name="idx_coupon_used_at"),
+        )
+        # A user can hold each barcode once; repeat scans return the existing coupon
+        unique_together = (("user", "barcode"),)
+    
     def __str__(self):
         return f"{self.barcode} ({self.value} {self.currency})"
 
+class CouponArchive(models.Model):
+    """Redeemed coupons moved out of the coupon table by app.utils.archive; same columns plus archived_at"""
+    id = fields.UUIDField(pk=True)
+    barcode = fields.CharField(max_length=255)
+    value = fields.DecimalField(max_digits=10, decimal_places=2, null=True)
+    currency = fields.CharField(max_length=3, default="EUR")
+    user = fields.ForeignKeyField("models.User", related_name="archived_coupons")
+    is_used = fields.BooleanField(default=True)
+    scanned_at = fields.DatetimeField()
+    used_at = fields.DatetimeField(null=True)
+    archived_at = fields.DatetimeField()
+    
+    class Meta:
+        table = "coupon_archive"
+        # History reads use the same keyset order as the coupon table; repeat
+        # scans look barcodes up here too. Names must match
+        # migrations/models/6_20250624090000_coupon_archive.py
+        indexes = (
+            Index(fields=("user_id", "scanned_at", "id"), name="idx_coupon_archive_user_scanned"),
+            Index(fields=("user_id", "barcode"), name="idx_coupon_archive_user_barcode"),
+        )
+    
+    def __str__(self):
+        return f"{self.barcode} ({self.value} {self.currency}, archived)"
+
+class CouponSummary(models.Model):
+    """Per-user, per-currency coupon totals, updated with every coupon write"""
+    id = fields.IntField(pk=True)
+    user = fields.ForeignKeyField("models.User", related_name="coupon_summaries")
+    currency = fields.CharField(max_length=3)
+    total_count = fields.IntField(default=0)
+    used_count = fields.IntField(default=0)
+    total_value = fields.DecimalField(max_digits=12, decimal_places=2, default=0)
+    unused_value = fields.DecimalField(max_digits=12, decimal_places=2, default=0)
+    
+    class Meta:
+        table = "coupon_summary"
+        unique_together = (("user", "currency"),)
+    
+    def __str__(self):
+        return f"{self.user_id} {self.currency}: {self.total_count}"
+
+class CouponVersion(models.Model):
+    """Per-user counter bumped by every coupon write, used for coupon list ETags"""
+    id = fields.IntField(pk=True)
+    user = fields.OneToOneField("models.User", related_name="coupon_version")
+    version = fields.BigIntField(default=0)
+    
+    class Meta:
+        table = "coupon_version"
+    
+    def __str__(self):
+        return f"{self.user_id} v{self.version}"
+
+class OtpCode(models.Model):
+    """One-time codes for email verification and password reset, deleted once used or expired"""
+    id = fields.IntField(pk=True)
+    email = fields.CharField(max_length=255)
+    purpose = fields.CharField(max_length=16)
+    code = fields.CharField(max_length=6)
+    attempts = fields.IntField(default=0)
+    created_at = fields.DatetimeField()
+    expires_at = fields.DatetimeField()
+    
+    class Meta:
+        table = "otp_code"
+        # One live code per email and purpose; a resend replaces it
+        unique_together = (("email", "purpose"),)
+        # The sweeper deletes by expiry. Name must match migrations/models/5_20250621090000_otp_code.py
+        indexes = (Index(fields=("expires_at",), name="idx_otp_code_expires"),)
+    
+    def __str__(self):
+        return f"{self.email} ({self.purpose})"
+
 # Pydantic models for API responses
-User_Pydantic = pydantic_model_creator(User, name="User", exclude=("created_at", "password_hash", "otp", "otp_created_at"))
-UserCreate_Pydantic = pydantic_model_creator(User, name="UserCreate", exclude_readonly=True, exclude=("is_verified", "otp", "otp_created_at"))
+User_Pydantic = pydantic_model_creator(User, name="User", exclude=("created_at", "password_hash"))
+UserCreate_Pydantic = pydantic_model_creator(User, name="UserCreate", exclude_readonly=True, exclude=("is_verified",))
 
 Coupon_Pydantic = pydantic_model_creator(Coupon, name="Coupon")
 CouponCreate_Pydantic = pydantic_model_creator(Coupon, name="CouponCreate", exclude_readonly=True, exclude=("is_used", "used_at"))
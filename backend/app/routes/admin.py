@@ -0,0 +1,44 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+import asyncio
+
+from app.deps import require_admin
+from app.utils.email import email_outbox
+from app.utils.profiling import profile_store
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+
+@router.get("/profiles")
+async def list_profiles():
+    """Recorded request profiles on this host, newest first, without stacks and queries."""
+    return await asyncio.get_running_loop().run_in_executor(None, profile_store.list)
+
+@router.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str, format: str = Query("json", regex="^(json|collapsed)$")):
+    """
+    One profile. format=collapsed returns just its stacks as text, ready for
+    flamegraph.pl or speedscope.
+    """
+    profile = await asyncio.get_running_loop().run_in_executor(None, profile_store.get, profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "collapsed":
+        return PlainTextResponse(profile["stacks"])
+    return profile
+
+@router.get("/emails")
+async def list_emails(limit: int = Query(50, ge=1, le=1000)):
+    """
+    Delivery state of recently queued mail, newest first. Each worker has its
+    own outbox, so this only covers mail queued through the worker answering.
+    """
+    return email_outbox.recent(limit)
+
+@router.get("/emails/{message_id}")
+async def get_email(message_id: str):
+    """Delivery state of one queued message (id as logged when it was queued)."""
+    message = email_outbox.status(message_id)
+    if message is None:
+        raise HTTPException(status_code=404, detail="Message not found on this worker")
+    return message
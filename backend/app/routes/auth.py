@@ -4,15 +4,19 @@ from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from pydantic import BaseModel
-from passlib.hash import bcrypt
-import random
-import string
+from tortoise.transactions import in_transaction
 import uuid
 
 from app.models import User, User_Pydantic
 from app.config import settings
-from app.utils.email import email_sender
-from app.utils.logger import logger
+from app.utils.email import email_outbox
+from app.utils.logins import last_login_buffer
+from app.utils.otp import (
+    OTP_EXPIRED, OTP_LOCKED, OTP_MISSING, OTP_VALID, PURPOSE_RESET, PURPOSE_VERIFY, check_otp, issue_otp,
+)
+from app.utils.passwords import password_hasher
+from app.utils.ratelimit import auth_rate_limiter
+from app.utils.logger import MaskedEmail, logger
 
 router = APIRouter()
 
@@ -46,45 +50,41 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-def generate_otp(length=6, email=None):
-    otp = ''.join(random.choices(string.digits, k=length))
-    logger.info(f"OTP generated for user {email}: {otp}")
-    return otp
+def _record_login(user: User):
+    # Written to the database in batches by last_login_buffer, not on the login path
+    now = datetime.utcnow()
+    user.last_login = now
+    last_login_buffer.record(user.id, now)
 
 @router.post("/signup", status_code=201)
-async def signup(payload: SignupRequest):
+async def signup(payload: SignupRequest, request: Request):
+    await auth_rate_limiter.check(request, "email", payload.email)
     existing = await User.get_or_none(email=payload.email)
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered.")
-    password_hash = bcrypt.hash(payload.password)
-    otp = generate_otp(email=payload.email)
-    now = datetime.utcnow()
-    user = await User.create(
-        id=uuid.uuid4(),
-        email=payload.email,
-        name=payload.name,
-        password_hash=password_hash,
-        is_verified=False,
-        otp=otp,
-        otp_created_at=now
-    )
-    logger.info(f"New user created: {payload.email}")
-    # Send OTP email
+    password_hash = await password_hasher.hash(payload.password)
+    async with in_transaction() as connection:
+        await User.create(
+            id=uuid.uuid4(),
+            email=payload.email,
+            name=payload.name,
+            password_hash=password_hash,
+            is_verified=False,
+        )
+        otp = await issue_otp(payload.email, PURPOSE_VERIFY, connection)
+    logger.info("New user created: %s", MaskedEmail(payload.email))
+    # Queue OTP email; delivery and retries happen in the background
     subject = "Your DRS App Verification Code"
     body = f"Your verification code is: {otp}"
-    try:
-        email_sender.send_email(payload.email, subject, body)
-        logger.info(f"OTP email sent to: {payload.email}")
-    except Exception as e:
-        logger.error(f"Failed to send email to {payload.email}: {str(e)}")
-        await user.delete()
-        raise HTTPException(status_code=500, detail=f"Failed to send verification email: {e}")
+    message_id = email_outbox.enqueue(payload.email, subject, body)
+    logger.info("OTP email %s queued for: %s", message_id, MaskedEmail(payload.email))
     return {"msg": "Signup successful. Please verify your email with the OTP sent."}
 
 @router.post("/signin", response_model=Token)
 async def signin(payload: SigninRequest, request: Request):
+    await auth_rate_limiter.check(request, "signin", payload.email)
     client_ip = request.client.host if request.client else "unknown"
-    logger.info(f"Login attempt from {client_ip} for email: {payload.email}")
+    logger.info("Login attempt from %s for email: %s", client_ip, MaskedEmail(payload.email))
     
     # Check for test user credentials
     if payload.email == "test@gmail.com" and payload.password == "1234":
@@ -96,15 +96,14 @@ async def signin(payload: SigninRequest, request: Request):
                 id=uuid.uuid4(),
                 email="test@gmail.com",
                 name="Test User",
-                password_hash=bcrypt.hash("1234"),
+                password_hash=await password_hasher.hash("1234"),
                 is_verified=True,
                 created_at=datetime.utcnow()
             )
             logger.info("Test user created")
         
-        test_user.last_login = datetime.utcnow()
-        await test_user.save()
-        logger.info(f"Test user logged in: {test_user.email}")
+        _record_login(test_user)
+        logger.info("Test user logged in: %s", MaskedEmail(test_user.email))
         
         # Create a long-lived token for test user
         access_token_expires = timedelta(days=30)  # Extend token validity for test user
@@ -115,7 +114,7 @@ async def signin(payload: SigninRequest, request: Request):
     # Normal authentication flow
     user = await User.get_or_none(email=payload.email)
     if not user:
-        logger.warning(f"Login attempt failed: User not found - {payload.email}")
+        logger.warning("Login attempt failed: User not found - %s", MaskedEmail(payload.email))
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -123,8 +122,11 @@ async def signin(payload: SigninRequest, request: Request):
         )
     
     # Verify password
-    if not user.password_hash or not bcrypt.verify(payload.password, user.password_hash):
-        logger.warning(f"Login attempt failed: Invalid password for {payload.email}")
+    valid, new_hash = (False, None)
+    if user.password_hash:
+        valid, new_hash = await password_hasher.verify_and_update(payload.password, user.password_hash)
+    if not valid:
+        logger.warning("Login attempt failed: Invalid password for %s", MaskedEmail(payload.email))
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -133,16 +135,20 @@ async def signin(payload: SigninRequest, request: Request):
     
     # Check if user is verified
     if not user.is_verified:
-        logger.warning(f"Login attempt failed: Unverified user {payload.email}")
+        logger.warning("Login attempt failed: Unverified user %s", MaskedEmail(payload.email))
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Email not verified. Please verify your email first.",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    user.last_login = datetime.utcnow()
-    await user.save()
-    logger.info(f"User logged in: {user.email}")
+    # Transparently upgrade hashes created with an older cost factor
+    if new_hash:
+        user.password_hash = new_hash
+        await user.save(update_fields=["password_hash"])
+        logger.info("Password hash upgraded for user: %s", MaskedEmail(user.email))
+    _record_login(user)
+    logger.info("User logged in: %s", MaskedEmail(user.email))
     
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(data={"sub": str(user.id)}, expires_delta=access_token_expires)
@@ -153,31 +159,30 @@ async def signin(payload: SigninRequest, request: Request):
 async def verify_otp(payload: OTPVerifyRequest):
     user = await User.get_or_none(email=payload.email)
     if not user:
-        logger.warning(f"OTP verification failed: User not found - {payload.email}")
+        logger.warning("OTP verification failed: User not found - %s", MaskedEmail(payload.email))
         raise HTTPException(status_code=404, detail="User not found.")
     
     if user.is_verified:
-        logger.info(f"OTP verification skipped: User already verified - {payload.email}")
+        logger.info("OTP verification skipped: User already verified - %s", MaskedEmail(payload.email))
         return {"msg": "Email already verified."}
     
-    if not user.otp or not user.otp_created_at:
-        logger.warning(f"OTP verification failed: No OTP found for user - {payload.email}")
+    result = await check_otp(payload.email, PURPOSE_VERIFY, payload.otp)
+    if result == OTP_MISSING:
+        logger.warning("OTP verification failed: No OTP found for user - %s", MaskedEmail(payload.email))
         raise HTTPException(status_code=400, detail="No OTP found. Please sign up again.")
-    
-    # Check OTP expiry (10 min)
-    if (datetime.utcnow() - user.otp_created_at).total_seconds() > 600:
-        logger.warning(f"OTP verification failed: OTP expired for user - {payload.email}")
+    if result == OTP_EXPIRED:
+        logger.warning("OTP verification failed: OTP expired for user - %s", MaskedEmail(payload.email))
         raise HTTPException(status_code=400, detail="OTP expired. Please sign up again.")
-    
-    if user.otp != payload.otp:
-        logger.warning(f"OTP verification failed: Invalid OTP for user - {payload.email}, provided: {payload.otp}, expected: {user.otp}")
+    if result == OTP_LOCKED:
+        logger.warning("OTP verification failed: Too many attempts for user - %s", MaskedEmail(payload.email))
+        raise HTTPException(status_code=400, detail="Too many attempts. Please request a new OTP.")
+    if result != OTP_VALID:
+        logger.warning("OTP verification failed: Invalid OTP for user - %s", MaskedEmail(payload.email))
         raise HTTPException(status_code=400, detail="Invalid OTP.")
     
     user.is_verified = True
-    user.otp = None
-    user.otp_created_at = None
-    await user.save()
-    logger.info(f"User email verified successfully: {payload.email}")
+    await user.save(update_fields=["is_verified"])
+    logger.info("User email verified successfully: %s", MaskedEmail(payload.email))
     return {"msg": "Email verified successfully. You may now sign in."}
 
 
@@ -185,27 +190,21 @@ class ResendOTPRequest(BaseModel):
     email: str
 
 @router.post("/resend-otp")
-async def resend_otp(payload: ResendOTPRequest):
+async def resend_otp(payload: ResendOTPRequest, request: Request):
+    await auth_rate_limiter.check(request, "email", payload.email)
     user = await User.get_or_none(email=payload.email)
     if not user:
-        logger.warning(f"Resend OTP failed: User not found - {payload.email}")
+        logger.warning("Resend OTP failed: User not found - %s", MaskedEmail(payload.email))
         raise HTTPException(status_code=404, detail="User not found.")
     if user.is_verified:
-        logger.info(f"Resend OTP skipped: User already verified - {payload.email}")
+        logger.info("Resend OTP skipped: User already verified - %s", MaskedEmail(payload.email))
         return {"msg": "Email already verified."}
-    otp = generate_otp(email=payload.email)
-    user.otp = otp
-    user.otp_created_at = datetime.utcnow()
-    await user.save()
-    logger.info(f"OTP regenerated for user: {payload.email}")
+    otp = await issue_otp(user.email, PURPOSE_VERIFY)
+    logger.info("OTP regenerated for user: %s", MaskedEmail(payload.email))
     subject = "Your DRS App Verification Code (Resend)"
     body = f"Your verification code is: {otp}"
-    try:
-        email_sender.send_email(user.email, subject, body)
-        logger.info(f"Resent OTP email to: {payload.email}")
-    except Exception as e:
-        logger.error(f"Failed to send resend OTP email to {payload.email}: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to send verification email: {e}")
+    message_id = email_outbox.enqueue(user.email, subject, body)
+    logger.info("Resend OTP email %s queued for: %s", message_id, MaskedEmail(payload.email))
     return {"msg": "OTP resent successfully. Please check your email."}
 
 
@@ -218,24 +217,18 @@ class PasswordResetVerifyRequest(BaseModel):
     new_password: str
 
 @router.post("/request-password-reset")
-async def request_password_reset(payload: PasswordResetRequest):
+async def request_password_reset(payload: PasswordResetRequest, request: Request):
+    await auth_rate_limiter.check(request, "email", payload.email)
     user = await User.get_or_none(email=payload.email)
     if not user:
-        logger.warning(f"Password reset failed: User not found - {payload.email}")
+        logger.warning("Password reset failed: User not found - %s", MaskedEmail(payload.email))
         raise HTTPException(status_code=404, detail="User not found.")
-    otp = generate_otp(email=payload.email)
-    user.otp = otp
-    user.otp_created_at = datetime.utcnow()
-    await user.save()
-    logger.info(f"Password reset OTP generated for user: {payload.email}")
+    otp = await issue_otp(user.email, PURPOSE_RESET)
+    logger.info("Password reset OTP generated for user: %s", MaskedEmail(payload.email))
     subject = "Your DRS App Password Reset Code"
     body = f"Your password reset code is: {otp}"
-    try:
-        email_sender.send_email(user.email, subject, body)
-        logger.info(f"Password reset OTP email sent to: {payload.email}")
-    except Exception as e:
-        logger.error(f"Failed to send password reset email to {payload.email}: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to send password reset email: {e}")
+    message_id = email_outbox.enqueue(user.email, subject, body)
+    logger.info("Password reset OTP email %s queued for: %s", message_id, MaskedEmail(payload.email))
     return {"msg": "Password reset OTP sent. Please check your email."}
 
 @router.post("/reset-password")
@@ -243,17 +236,17 @@ async def reset_password(payload: PasswordResetVerifyRequest):
     user = await User.get_or_none(email=payload.email)
     if not user:
         raise HTTPException(status_code=404, detail="User not found.")
-    if not user.otp or not user.otp_created_at:
+    result = await check_otp(user.email, PURPOSE_RESET, payload.otp)
+    if result == OTP_MISSING:
         raise HTTPException(status_code=400, detail="No OTP found. Please request password reset again.")
-    # Check OTP expiry (10 min)
-    if (datetime.utcnow() - user.otp_created_at).total_seconds() > 600:
+    if result == OTP_EXPIRED:
         raise HTTPException(status_code=400, detail="OTP expired. Please request password reset again.")
-    if user.otp != payload.otp:
+    if result == OTP_LOCKED:
+        raise HTTPException(status_code=400, detail="Too many attempts. Please request password reset again.")
+    if result != OTP_VALID:
         raise HTTPException(status_code=400, detail="Invalid OTP.")
-    user.password_hash = bcrypt.hash(payload.new_password)
-    user.otp = None
-    user.otp_created_at = None
-    await user.save()
+    user.password_hash = await password_hasher.hash(payload.new_password)
+    await user.save(update_fields=["password_hash"])
     return {"msg": "Password reset successful. You may now sign in."}
 
 class Token(BaseModel):
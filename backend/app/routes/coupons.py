@@ -1,52 +1,323 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response, Query
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
+import asyncio
+import orjson
 from pydantic import BaseModel
 import uuid
 from datetime import datetime
+from tortoise.exceptions import IntegrityError
+from tortoise.transactions import in_transaction
 
-from app.models import User, Coupon, Coupon_Pydantic, CouponCreate_Pydantic
-from app.deps import get_current_user, get_optional_user
+from app.models import User, Coupon, CouponArchive, Coupon_Pydantic, CouponCreate_Pydantic
+from app.config import settings
+from app.deps import get_current_user, get_optional_user, get_stream_user
+from app.utils.archive import find_archived, merge_newest_first
+from app.utils.barcodes import DecodedBarcode, decode_barcodes
+from app.utils.bulk import bulk_insert_coupons
+from app.utils.cache import TTLCache
+from app.utils.db import read_replica
+from app.utils.events import coupon_events, sse_frame
+from app.utils.export import stream_csv, stream_ndjson
+from app.utils.http import etag_matches, json_response, make_etag, not_modified
 from app.utils.logger import logger
+from app.utils.mutations import delete_coupons, mark_coupons_used
+from app.utils.summary import get_summary, record_created, record_deleted, record_used
+from app.utils.versions import bump_coupon_version, get_coupon_version
+from app.utils.pagination import after_cursor, encode_cursor
+from app.utils.search import search_coupons
+from app.utils.serializers import COUPON_FIELDS, coupon_row_to_dict, coupon_rows_to_dicts, coupon_to_row
 
 router = APIRouter()
 
+# Recently stored scans per (user id, barcode), so a scanner firing the same
+# code several times a second is answered without touching the database
+recent_scans = TTLCache(maxsize=settings.SCAN_DEDUP_CACHE_SIZE, ttl=settings.SCAN_DEDUP_TTL_SECONDS)
+
 class BarcodeData(BaseModel):
     barcode: str
     value: Optional[float] = None
     currency: Optional[str] = "EUR"
 
+class BatchItemResult(BaseModel):
+    index: int
+    status: str  # "created", "duplicate" or "error"
+    coupon: Optional[Coupon_Pydantic] = None
+    error: Optional[str] = None
+
+class BatchResult(BaseModel):
+    created: int
+    duplicates: int
+    failed: int
+    items: List[BatchItemResult]
+
+class CouponIds(BaseModel):
+    ids: List[uuid.UUID]
+
+class BulkMarkUsedResult(BaseModel):
+    updated: List[Coupon_Pydantic]
+    skipped: List[uuid.UUID]  # unknown or already redeemed
+
+class BulkDeleteResult(BaseModel):
+    deleted: List[uuid.UUID]
+    skipped: List[uuid.UUID]  # unknown
+
+def _validate_barcode_data(barcode_data: BarcodeData) -> Optional[str]:
+    """Return an error message if the scan can't be stored, else None."""
+    if not barcode_data.barcode or not barcode_data.barcode.strip():
+        return "Barcode is empty"
+    if len(barcode_data.barcode) > 255:
+        return "Barcode is longer than 255 characters"
+    if barcode_data.currency is not None and len(barcode_data.currency) > 3:
+        return "Currency must be a 3-letter code"
+    return None
+
+def _coupon_value(barcode_data: BarcodeData, decoded: DecodedBarcode) -> tuple:
+    """(value, currency) to store: what the client sent, else what the barcode encodes."""
+    if barcode_data.value is None and decoded.value is not None:
+        return decoded.value, decoded.currency
+    return barcode_data.value, barcode_data.currency or "EUR"
+
+def _scan_key(user: User, barcode: str) -> tuple:
+    return (str(user.id), barcode)
+
 @router.post("/", response_model=Coupon_Pydantic)
 async def create_coupon(
     barcode_data: BarcodeData,
     request: Request,
+    response: Response,
     current_user: User = Depends(get_current_user)
 ):
     """
     Save a new DRS coupon after scanning
+    If the user already has this barcode, the existing coupon is returned
+    and the X-Duplicate header is set
+    Barcodes marked as GS1 or carrying a deposit value must have a valid
+    check digit; without a value in the request, the value and currency
+    encoded in the barcode are stored
     """
-    coupon = await Coupon.create(
-        id=uuid.uuid4(),
-        barcode=barcode_data.barcode,
-        value=barcode_data.value,
-        currency=barcode_data.currency,
-        user=current_user,
-        scanned_at=datetime.utcnow()
-    )
-    return await Coupon_Pydantic.from_tortoise_orm(coupon)
+    # Same rules as each item of /batch
+    error = _validate_barcode_data(barcode_data)
+    if error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=error)
+    key = _scan_key(current_user, barcode_data.barcode)
+    cached = recent_scans.get(key)
+    if cached is not None:
+        # Scanner fired the same code again moments ago
+        response.headers["X-Duplicate"] = "true"
+        return cached
+    
+    decoded = decode_barcodes([barcode_data.barcode])[0]
+    if decoded.error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=decoded.error)
+    value, currency = _coupon_value(barcode_data, decoded)
+    
+    archived = await find_archived(current_user.id, [barcode_data.barcode])
+    if archived:
+        # Redeemed long ago and moved to the archive, but still the same coupon
+        response.headers["X-Duplicate"] = "true"
+        result = Coupon_Pydantic.from_orm(archived[barcode_data.barcode])
+        recent_scans.set(key, result)
+        return result
+    
+    try:
+        async with in_transaction() as connection:
+            coupon = await Coupon.create(
+                id=uuid.uuid4(),
+                barcode=barcode_data.barcode,
+                value=value,
+                currency=currency,
+                user=current_user,
+                scanned_at=datetime.utcnow()
+            )
+            await record_created(connection, [coupon])
+            await bump_coupon_version(connection, current_user.id)
+    except IntegrityError:
+        coupon = await Coupon.get_or_none(user_id=current_user.id, barcode=barcode_data.barcode)
+        if coupon is None:
+            raise
+        logger.info("Duplicate scan of %s for user %s", barcode_data.barcode, current_user.id)
+        response.headers["X-Duplicate"] = "true"
+    else:
+        await coupon_events.publish_coupons(current_user.id, "created", [coupon_to_row(coupon)])
+    
+    result = await Coupon_Pydantic.from_tortoise_orm(coupon)
+    recent_scans.set(key, result)
+    return result
+
+@router.post("/batch", response_model=BatchResult)
+async def create_coupons_batch(
+    items: List[BarcodeData],
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Save many scanned coupons in one request, e.g. when an offline client
+    replays its queue. New coupons are inserted in a single transaction;
+    barcodes the user already has are reported as duplicates with the
+    existing coupon. The result lists the outcome of every item in request order.
+    """
+    if len(items) > settings.COUPON_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.COUPON_BATCH_MAX_SIZE} coupons per batch"
+        )
+    
+    results: List[Optional[BatchItemResult]] = [None] * len(items)
+    # Check digits and embedded values for the whole batch in one pass
+    decoded = decode_barcodes([barcode_data.barcode for barcode_data in items])
+    # barcode -> indexes of the items carrying it; the first one wins
+    pending = {}
+    for index, barcode_data in enumerate(items):
+        error = _validate_barcode_data(barcode_data) or decoded[index].error
+        if error:
+            results[index] = BatchItemResult(index=index, status="error", error=error)
+            continue
+        pending.setdefault(barcode_data.barcode, []).append(index)
+    
+    coupons = []
+    existing = {}
+    for attempt in range(2):
+        existing = {}
+        if pending:
+            rows = await Coupon.filter(user_id=current_user.id, barcode__in=list(pending))
+            existing = {coupon.barcode: coupon for coupon in rows}
+            existing.update(await find_archived(current_user.id, [barcode for barcode in pending if barcode not in existing]))
+        now = datetime.utcnow()
+        coupons = []
+        for barcode, indexes in pending.items():
+            if barcode in existing:
+                continue
+            value, currency = _coupon_value(items[indexes[0]], decoded[indexes[0]])
+            coupons.append(Coupon(
+                id=uuid.uuid4(),
+                barcode=barcode,
+                value=value,
+                currency=currency,
+                user=current_user,
+                is_used=False,
+                scanned_at=now,
+                used_at=None
+            ))
+        try:
+            async with in_transaction() as connection:
+                await bulk_insert_coupons(coupons, connection)
+                await record_created(connection, coupons)
+                if coupons:
+                    await bump_coupon_version(connection, current_user.id)
+            break
+        except IntegrityError:
+            # A concurrent scan added one of these barcodes; look them up again
+            if attempt:
+                raise
+    
+    await coupon_events.publish_coupons(current_user.id, "created", [coupon_to_row(coupon) for coupon in coupons])
+    created = {coupon.barcode: coupon for coupon in coupons}
+    for barcode, indexes in pending.items():
+        if barcode in created:
+            results[indexes[0]] = BatchItemResult(
+                index=indexes[0], status="created", coupon=Coupon_Pydantic.from_orm(created[barcode])
+            )
+            indexes = indexes[1:]
+        coupon = Coupon_Pydantic.from_orm(existing.get(barcode) or created[barcode])
+        for index in indexes:
+            results[index] = BatchItemResult(index=index, status="duplicate", coupon=coupon)
+    
+    duplicates = sum(1 for result in results if result.status == "duplicate")
+    failed = sum(1 for result in results if result.status == "error")
+    logger.info("Batch of %s coupons for user %s: %s created, %s duplicate", len(items), current_user.id, len(coupons), duplicates)
+    return BatchResult(created=len(coupons), duplicates=duplicates, failed=failed, items=results)
+
+def _unique_ids(payload: CouponIds) -> List[uuid.UUID]:
+    ids = list(dict.fromkeys(payload.ids))
+    if len(ids) > settings.COUPON_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.COUPON_BATCH_MAX_SIZE} coupons per request"
+        )
+    return ids
+
+@router.post("/mark-used", response_model=BulkMarkUsedResult)
+async def mark_coupons_as_used(
+    payload: CouponIds,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Mark many coupons as used in one statement, e.g. a whole receipt
+    Returns the coupons that were redeemed by this request; ids that are
+    unknown or were already used are listed as skipped
+    """
+    ids = _unique_ids(payload)
+    async with in_transaction() as connection:
+        rows = await mark_coupons_used(connection, current_user.id, ids, datetime.utcnow())
+        if rows:
+            await record_used(connection, rows)
+            await bump_coupon_version(connection, current_user.id)
+    
+    updated = {row.id for row in rows}
+    for row in rows:
+        recent_scans.pop(_scan_key(current_user, row.barcode))
+    await coupon_events.publish_coupons(current_user.id, "used", rows)
+    logger.info("Marked %s of %s coupons used for user %s", len(rows), len(ids), current_user.id)
+    return json_response(request, {
+        "updated": coupon_rows_to_dicts(rows),
+        "skipped": [coupon_id for coupon_id in ids if coupon_id not in updated],
+    })
+
+@router.post("/delete", response_model=BulkDeleteResult)
+async def delete_coupons_bulk(
+    payload: CouponIds,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Delete many coupons in one statement
+    Ids that are unknown are listed as skipped
+    """
+    ids = _unique_ids(payload)
+    async with in_transaction() as connection:
+        rows = await delete_coupons(connection, current_user.id, ids)
+        if rows:
+            await record_deleted(connection, rows)
+            await bump_coupon_version(connection, current_user.id)
+    
+    deleted = {row.id for row in rows}
+    for row in rows:
+        recent_scans.pop(_scan_key(current_user, row.barcode))
+    await coupon_events.publish_deleted(current_user.id, [row.id for row in rows])
+    logger.info("Deleted %s of %s coupons for user %s", len(rows), len(ids), current_user.id)
+    return json_response(request, {
+        "deleted": [coupon_id for coupon_id in ids if coupon_id in deleted],
+        "skipped": [coupon_id for coupon_id in ids if coupon_id not in deleted],
+    })
 
 @router.get("/", response_model=List[Coupon_Pydantic])
 async def get_coupons(
     request: Request,
     used: bool = None,
+    limit: Optional[int] = Query(None, ge=1, le=settings.COUPON_PAGE_MAX_SIZE),
+    cursor: Optional[str] = None,
+    include_archived: bool = False,
     current_user: User = Depends(get_optional_user)
 ):
     """
-    Get all coupons for the current user
+    Get coupons for the current user, newest first
     Optional filter by used/unused status
+
+    Passing `limit` and/or `cursor` switches to keyset pagination: at most
+    `limit` coupons are returned and the cursor for the next page is sent
+    in the X-Next-Cursor header (absent on the last page).
+
+    Responses carry an ETag derived from the user's coupon version; a
+    matching If-None-Match is answered with 304 without querying coupons.
+
+    Coupons redeemed long ago live in the archive (see app.utils.archive)
+    and are only included with `include_archived=true`.
     """
     # If user is not authenticated, return empty list instead of 401
     if not current_user:
-        logger.warning(f"Unauthenticated access to coupons from {request.client.host if request.client else 'unknown'}")
+        logger.warning("Unauthenticated access to coupons from %s", request.client.host if request.client else 'unknown')
         # Return an empty list of Pydantic models directly
         return []
     
@@ -55,23 +326,190 @@ async def get_coupons(
     if used is not None:
         query["is_used"] = used
     
-    logger.info(f"Fetching coupons for user {current_user.email}, used filter: {used}")
-    coupons = await Coupon.filter(**query).order_by("-scanned_at")
+    # Reads go to the replica when one is configured (see app.utils.db)
+    pin_key = str(current_user.id)
+    version = await read_replica.read(lambda db: get_coupon_version(current_user.id, db), pin_key=pin_key)
+    etag = make_etag(current_user.id, version, used, limit, cursor, include_archived)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
     
-    # Convert queryset to Pydantic models and return
-    result = await Coupon_Pydantic.from_queryset(coupons)
-    return result
+    logger.info("Fetching coupons for user %s, used filter: %s", current_user.id, used)
+    querysets = [Coupon.filter(**query)]
+    # Everything in the archive is redeemed
+    if include_archived and used is not False:
+        querysets.append(CouponArchive.filter(**query))
+    querysets = [queryset.order_by("-scanned_at", "-id") for queryset in querysets]
+    
+    if limit is not None or cursor is not None:
+        page_size = limit or settings.COUPON_PAGE_SIZE
+        position = after_cursor(cursor)
+        if position is not None:
+            querysets = [queryset.filter(position) for queryset in querysets]
+        # Fetch one extra row to know whether another page follows
+        rows = await _read_rows(querysets, pin_key, page_size + 1)
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            last = rows[-1]
+            headers["X-Next-Cursor"] = encode_cursor(last[5], last[0])
+        return json_response(request, coupon_rows_to_dicts(rows), headers)
+    
+    # Plain tuples straight to orjson; same wire format as Coupon_Pydantic
+    rows = await _read_rows(querysets, pin_key)
+    return json_response(request, coupon_rows_to_dicts(rows), headers)
+
+async def _read_rows(querysets, pin_key: str, limit: Optional[int] = None) -> list:
+    """COUPON_FIELDS rows of each newest-first queryset, merged; one query per table."""
+    results = []
+    for queryset in querysets:
+        if limit is not None:
+            queryset = queryset.limit(limit)
+        results.append(await read_replica.read(
+            lambda db, queryset=queryset: queryset.using_db(db).values_list(*COUPON_FIELDS), pin_key=pin_key
+        ))
+    return merge_newest_first(results, limit)
+
+@router.get("/search", response_model=List[Coupon_Pydantic])
+async def search_coupons_by_barcode(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=255),
+    used: Optional[bool] = None,
+    limit: Optional[int] = Query(None, ge=1, le=settings.COUPON_PAGE_MAX_SIZE),
+    offset: int = Query(0, ge=0, le=settings.COUPON_SEARCH_MAX_OFFSET),
+    include_archived: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Find the current user's coupons by barcode
+    Exact matches come first, then barcodes starting with `q`, then barcodes
+    containing it (only for queries of COUPON_SEARCH_MIN_SUBSTRING_LENGTH
+    characters or more); newest first within each group.
+    The offset of the next page is sent in the X-Next-Offset header (absent on the last page).
+    """
+    page_size = limit or settings.COUPON_PAGE_SIZE
+    # Fetch one extra row to know whether another page follows
+    rows = await read_replica.read(
+        lambda db: search_coupons(db, current_user.id, q, page_size + 1, offset, used, include_archived),
+        pin_key=str(current_user.id),
+    )
+    headers = {}
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        headers["X-Next-Offset"] = str(offset + page_size)
+    return json_response(request, coupon_rows_to_dicts(rows), headers)
+
+@router.get("/summary")
+async def get_coupon_summary(
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Coupon counts and values for the current user, one entry per currency
+    """
+    currencies = await read_replica.read(lambda db: get_summary(current_user.id, db), pin_key=str(current_user.id))
+    return {"currencies": currencies}
+
+@router.get("/export")
+async def export_coupons(
+    request: Request,
+    format: str = Query("ndjson", regex="^(ndjson|csv)$"),
+    used: Optional[bool] = None,
+    scanned_from: Optional[datetime] = None,
+    scanned_to: Optional[datetime] = None,
+    used_from: Optional[datetime] = None,
+    used_to: Optional[datetime] = None,
+    include_archived: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Stream the current user's full coupon history as NDJSON or CSV
+    Optional filters on used status and scanned/used date ranges (inclusive)
+    Archived coupons are included with `include_archived=true`
+    """
+    filters = {"user_id": current_user.id}
+    if used is not None:
+        filters["is_used"] = used
+    if scanned_from is not None:
+        filters["scanned_at__gte"] = scanned_from
+    if scanned_to is not None:
+        filters["scanned_at__lte"] = scanned_to
+    if used_from is not None:
+        filters["used_at__gte"] = used_from
+    if used_to is not None:
+        filters["used_at__lte"] = used_to
+    
+    logger.info("Exporting coupons for user %s as %s", current_user.id, format)
+    chunk_size = settings.COUPON_EXPORT_CHUNK_SIZE
+    models = (Coupon, CouponArchive) if include_archived and used is not False else (Coupon,)
+    if format == "csv":
+        return StreamingResponse(
+            stream_csv(filters, chunk_size, models),
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="coupons.csv"'}
+        )
+    return StreamingResponse(
+        stream_ndjson(filters, chunk_size, models),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="coupons.ndjson"'}
+    )
+
+@router.get("/events")
+async def stream_coupon_events(
+    request: Request,
+    current_user: User = Depends(get_stream_user)
+):
+    """
+    Server-Sent Events feed of the current user's coupon changes, from any
+    device: "created", "used" and "deleted" (see app.utils.events)
+    The first event, "ready", carries the coupon version the feed starts
+    from; "resync" means events were missed and the list should be reloaded.
+    EventSource cannot set headers, so the token may be passed as ?token=
+    """
+    async def stream():
+        queue = coupon_events.subscribe(current_user.id)
+        try:
+            # Subscribed first, so nothing written after this version is missed
+            version = await read_replica.read(lambda db: get_coupon_version(current_user.id, db))
+            yield b"retry: 5000\n" + sse_frame("ready", orjson.dumps({"version": version}))
+            while True:
+                try:
+                    frame = await asyncio.wait_for(queue.get(), timeout=settings.SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle connection
+                    yield b": ping\n\n"
+                    continue
+                if frame is None:
+                    return
+                yield frame
+        finally:
+            coupon_events.unsubscribe(current_user.id, queue)
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @router.get("/{coupon_id}", response_model=Coupon_Pydantic)
 async def get_coupon(
     coupon_id: uuid.UUID,
     request: Request,
+    include_archived: bool = False,
     current_user: User = Depends(get_current_user)
 ):
     """
     Get a specific coupon by ID
+    Archived coupons are found with `include_archived=true`
     """
-    coupon = await Coupon.get_or_none(id=coupon_id, user_id=current_user.id)
+    coupon = await read_replica.read(
+        lambda db: Coupon.filter(id=coupon_id, user_id=current_user.id).using_db(db).first(),
+        pin_key=str(current_user.id),
+    )
+    if not coupon and include_archived:
+        coupon = await read_replica.read(
+            lambda db: CouponArchive.filter(id=coupon_id, user_id=current_user.id).using_db(db).first(),
+            pin_key=str(current_user.id),
+        )
     if not coupon:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -87,19 +525,30 @@ async def mark_coupon_as_used(
 ):
     """
     Mark a coupon as used after redeeming at a store
+    A coupon can be redeemed once: marking it again answers 409
     """
-    coupon = await Coupon.get_or_none(id=coupon_id, user_id=current_user.id)
-    if not coupon:
+    async with in_transaction() as connection:
+        rows = await mark_coupons_used(connection, current_user.id, [coupon_id], datetime.utcnow())
+        if rows:
+            await record_used(connection, rows)
+            await bump_coupon_version(connection, current_user.id)
+    
+    if not rows:
+        # Unknown coupon, or already redeemed (possibly by a concurrent request)
+        lookup = {"id": coupon_id, "user_id": current_user.id}
+        if await Coupon.exists(**lookup) or await CouponArchive.exists(**lookup):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Coupon already used"
+            )
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Coupon not found"
         )
-    
-    coupon.is_used = True
-    coupon.used_at = datetime.utcnow()
-    await coupon.save()
-    
-    return await Coupon_Pydantic.from_tortoise_orm(coupon)
+    coupon = rows[0]
+    recent_scans.pop(_scan_key(current_user, coupon.barcode))
+    await coupon_events.publish_coupons(current_user.id, "used", rows)
+    return json_response(request, coupon_row_to_dict(coupon))
 
 @router.delete("/{coupon_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_coupon(
@@ -110,12 +559,17 @@ async def delete_coupon(
     """
     Delete a coupon
     """
-    coupon = await Coupon.get_or_none(id=coupon_id, user_id=current_user.id)
-    if not coupon:
+    async with in_transaction() as connection:
+        rows = await delete_coupons(connection, current_user.id, [coupon_id])
+        if rows:
+            await record_deleted(connection, rows)
+            await bump_coupon_version(connection, current_user.id)
+    
+    if not rows:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Coupon not found"
         )
-    
-    await coupon.delete()
+    recent_scans.pop(_scan_key(current_user, rows[0].barcode))
+    await coupon_events.publish_deleted(current_user.id, [rows[0].id])
     return None
@@ -0,0 +1,190 @@
+"""
+Production entry point: a gunicorn master pre-forking uvicorn workers
+(uvloop event loop, httptools HTTP parser).
+
+    python -m app.server                  # serve with settings from env
+    python -m app.server --workers 4      # override the worker count
+    python -m app.server --check          # validate the plan and exit
+
+Signals (sent to the master):
+    HUP   graceful restart: start new workers, then retire the old ones
+    TERM  graceful shutdown: workers drain in-flight requests, then exit
+    TTIN / TTOU  add / remove one worker
+
+With DRAIN_DELAY_SECONDS set, a worker told to stop first keeps serving
+for that long with /api/health answering 503, so a load balancer can take
+it out of rotation before it stops accepting connections.
+
+For local development keep using `python -m app.main` (single process,
+auto-reload).
+"""
+import argparse
+import asyncio
+import os
+import sys
+from typing import List, Optional
+
+from app.config import settings
+
+
+def default_workers() -> int:
+    # CPUs this process may run on (respects taskset/cpusets), not the host total
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def worker_count(requested: Optional[int] = None) -> int:
+    # SQLite has a single writer, so extra processes would mostly queue for its lock
+    default = 1 if settings.DB_ENGINE == "sqlite" else default_workers()
+    workers = requested or settings.WEB_CONCURRENCY or default
+    return max(1, workers)
+
+
+def check_connection_budget(workers: int) -> List[str]:
+    """
+    Every worker owns its own pool, so the database must accept
+    workers * pool size connections on top of the reserved ones.
+    Returns a list of problems (empty when the plan fits).
+    """
+    problems = []
+    available = settings.DB_MAX_CONNECTIONS - settings.DB_RESERVED_CONNECTIONS
+    pools = [("primary", settings.DB_POOL_MAX_SIZE)]
+    if settings.DB_ENGINE == "sqlite":
+        # No server, no connection limit: each worker opens the file twice
+        pools = []
+    elif settings.replica_credentials:
+        # Replicas normally share the primary's max_connections
+        pools.append(("replica", settings.DB_REPLICA_POOL_MAX_SIZE))
+    for name, pool_size in pools:
+        needed = workers * pool_size
+        if needed > available:
+            problems.append(
+                f"{workers} workers x {pool_size} {name} connections = {needed}, but only {available} are "
+                f"available (DB_MAX_CONNECTIONS={settings.DB_MAX_CONNECTIONS} - "
+                f"DB_RESERVED_CONNECTIONS={settings.DB_RESERVED_CONNECTIONS}). Lower the pool size to at most "
+                f"{max(available // workers, 0)} or run fewer workers."
+            )
+    if settings.DRAIN_DELAY_SECONDS >= settings.SERVER_GRACEFUL_TIMEOUT:
+        problems.append(
+            f"DRAIN_DELAY_SECONDS ({settings.DRAIN_DELAY_SECONDS}) must be shorter than "
+            f"SERVER_GRACEFUL_TIMEOUT ({settings.SERVER_GRACEFUL_TIMEOUT}), or workers are killed mid-drain."
+        )
+    return problems
+
+
+def gunicorn_options(workers: int, bind: str) -> dict:
+    options = {
+        "bind": bind,
+        "workers": workers,
+        "worker_class": "app.server.Worker",
+        "timeout": settings.SERVER_TIMEOUT,
+        "graceful_timeout": settings.SERVER_GRACEFUL_TIMEOUT,
+        "keepalive": settings.SERVER_KEEPALIVE,
+        "max_requests": settings.SERVER_MAX_REQUESTS,
+        "max_requests_jitter": settings.SERVER_MAX_REQUESTS_JITTER,
+        # Behind nginx every connection comes from the proxy; the client is in X-Forwarded-For
+        "forwarded_allow_ips": settings.FORWARDED_ALLOW_IPS,
+        # Each worker imports the app itself: DB pools and background tasks
+        # belong to a worker's event loop and must not be created pre-fork
+        "preload_app": False,
+        "accesslog": None,
+        "errorlog": "-",
+    }
+    # Worker heartbeats on a disk-backed /tmp can stall inside containers
+    if os.path.isdir("/dev/shm"):
+        options["worker_tmp_dir"] = "/dev/shm"
+    return options
+
+
+try:
+    from gunicorn.app.base import BaseApplication
+    from gunicorn.arbiter import Arbiter
+    from uvicorn.main import Server
+    from uvicorn.workers import UvicornWorker
+except ImportError:  # pragma: no cover - gunicorn is not available on Windows
+    BaseApplication = object
+    Arbiter = Server = UvicornWorker = None
+
+
+if UvicornWorker is not None:
+
+    class DrainingServer(Server):
+        """uvicorn server that, when asked to stop, first reports unhealthy for DRAIN_DELAY_SECONDS."""
+
+        draining = False
+
+        def handle_exit(self, sig, frame):
+            if self.draining or settings.DRAIN_DELAY_SECONDS <= 0:
+                # Second signal, or draining disabled: stop right away
+                return self._exit(sig, frame)
+            self.draining = True
+            self.config.app.state.draining = True
+            asyncio.get_event_loop().call_later(settings.DRAIN_DELAY_SECONDS, self._exit, sig, frame)
+
+        def _exit(self, sig, frame):
+            # Open event streams would otherwise hold up the graceful shutdown
+            # until SERVER_GRACEFUL_TIMEOUT; clients reconnect to another worker.
+            # Imported here: the master must not import app modules (see gunicorn_options)
+            from app.utils.events import coupon_events
+
+            coupon_events.close_streams()
+            super().handle_exit(sig, frame)
+
+    class Worker(UvicornWorker):
+        CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools"}
+
+        async def _serve(self) -> None:
+            self.config.app = self.wsgi
+            server = DrainingServer(config=self.config)
+            self._install_sigquit_handler()
+            await server.serve(sockets=self.sockets)
+            if not server.started:
+                sys.exit(Arbiter.WORKER_BOOT_ERROR)
+
+
+class Application(BaseApplication):
+    def __init__(self, app_uri: str, options: dict):
+        self.app_uri = app_uri
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        from gunicorn.util import import_app
+        return import_app(self.app_uri)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default WEB_CONCURRENCY or CPUs)")
+    parser.add_argument("--bind", default=f"{settings.SERVER_HOST}:{settings.SERVER_PORT}")
+    parser.add_argument("--check", action="store_true", help="validate the configuration and exit")
+    parser.add_argument("--skip-pool-check", action="store_true", help="start even if the pools may not fit")
+    args = parser.parse_args(argv)
+
+    workers = worker_count(args.workers)
+    problems = check_connection_budget(workers)
+    if settings.DB_ENGINE == "sqlite":
+        database = f"SQLite database {settings.SQLITE_PATH}"
+    else:
+        database = f"DB pool {settings.DB_POOL_MIN_SIZE}-{settings.DB_POOL_MAX_SIZE} per worker"
+    print(f"Serving app.main:app on {args.bind} with {workers} workers, {database}")
+    for problem in problems:
+        print(f"Configuration problem: {problem}", file=sys.stderr)
+    if problems and not args.skip_pool_check:
+        sys.exit(1)
+    if args.check:
+        return
+    if UvicornWorker is None:
+        sys.exit("gunicorn is not installed; use `uvicorn app.main:app` instead")
+    Application("app.main:app", gunicorn_options(workers, args.bind)).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Hot/cold split for coupons. Redeemed coupons older than
+COUPON_ARCHIVE_AFTER_DAYS are moved from "coupon" to "coupon_archive" in
+small batches by a background task, so the coupon table and its indexes only
+hold what users still act on: unused coupons and recently redeemed ones.
+
+Archived coupons keep counting in the coupon summary and still make a repeat
+scan of their barcode a duplicate. Lists and exports read the archive only
+when asked to (include_archived) and merge it in newest-first.
+"""
+import asyncio
+import heapq
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.transactions import in_transaction
+
+from app.config import settings
+from app.models import CouponArchive
+from app.utils.logger import logger
+from app.utils.sql import is_postgres, param, params
+from app.utils.versions import bump_coupon_version
+
+_COLUMNS = ", ".join(
+    f'"{column}"'
+    for column in ("id", "barcode", "value", "currency", "user_id", "is_used", "scanned_at", "used_at")
+)
+
+
+async def _move_postgres(connection: BaseDBAsyncClient, cutoff: datetime, batch_size: int, now: datetime):
+    # One statement; SKIP LOCKED lets every worker's archiver run at once
+    # without waiting on each other or on requests touching the same rows
+    return await connection.execute_query_dict(
+        f"""
+        WITH "moved" AS (
+            DELETE FROM "coupon" WHERE "id" IN (
+                SELECT "id" FROM "coupon"
+                WHERE "is_used" AND "used_at" < $1
+                ORDER BY "used_at" LIMIT $2
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING {_COLUMNS}
+        ), "archived" AS (
+            INSERT INTO "coupon_archive" ({_COLUMNS}, "archived_at")
+            SELECT {_COLUMNS}, $3::timestamptz FROM "moved"
+            RETURNING "user_id"
+        )
+        SELECT "user_id", COUNT(*) AS "count" FROM "archived" GROUP BY "user_id"
+        """,
+        [cutoff, batch_size, now],
+    )
+
+
+async def _move_generic(connection: BaseDBAsyncClient, cutoff: datetime, batch_size: int, now: datetime):
+    rows = await connection.execute_query_dict(
+        f"""
+        SELECT "id", "user_id" FROM "coupon"
+        WHERE "is_used" AND "used_at" < {param(connection, 1)}
+        ORDER BY "used_at" LIMIT {param(connection, 2)}
+        """,
+        [cutoff.isoformat(" "), batch_size],
+    )
+    if not rows:
+        return []
+    ids = [row["id"] for row in rows]
+    await connection.execute_query(
+        f"""
+        INSERT INTO "coupon_archive" ({_COLUMNS}, "archived_at")
+        SELECT {_COLUMNS}, {param(connection, 1)} FROM "coupon"
+        WHERE "id" IN ({params(connection, len(ids), start=2)})
+        """,
+        [now.isoformat(" ")] + ids,
+    )
+    await connection.execute_query(
+        f'DELETE FROM "coupon" WHERE "id" IN ({params(connection, len(ids))})', ids
+    )
+    counts: Dict[str, int] = {}
+    for row in rows:
+        counts[row["user_id"]] = counts.get(row["user_id"], 0) + 1
+    return [{"user_id": user_id, "count": count} for user_id, count in counts.items()]
+
+
+async def archive_batch(cutoff: datetime, batch_size: int) -> int:
+    """Move up to `batch_size` coupons redeemed before `cutoff` to the archive. Returns the number moved."""
+    async with in_transaction() as connection:
+        move = _move_postgres if is_postgres(connection) else _move_generic
+        moved = await move(connection, cutoff, batch_size, datetime.utcnow())
+        # Their coupon lists changed, so cached ETags must not match any more
+        for row in moved:
+            await bump_coupon_version(connection, row["user_id"])
+    return sum(int(row["count"]) for row in moved)
+
+
+async def archive_used_coupons(older_than: timedelta, batch_size: int) -> int:
+    """Archive every coupon redeemed more than `older_than` ago, one batch per transaction."""
+    cutoff = datetime.utcnow() - older_than
+    total = 0
+    while True:
+        moved = await archive_batch(cutoff, batch_size)
+        total += moved
+        if moved < batch_size:
+            return total
+        # Let request handlers run between batches
+        await asyncio.sleep(0)
+
+
+async def find_archived(user_id, barcodes: Sequence[str]) -> Dict[str, CouponArchive]:
+    """The user's archived coupons among `barcodes`, by barcode."""
+    if not barcodes:
+        return {}
+    rows = await CouponArchive.filter(user_id=user_id, barcode__in=list(barcodes))
+    return {coupon.barcode: coupon for coupon in rows}
+
+
+def merge_newest_first(row_lists: Iterable[List[Tuple]], limit: Optional[int] = None) -> List[Tuple]:
+    """
+    Merge COUPON_FIELDS rows that are each already sorted newest-first
+    (scanned_at, id descending) into one list in the same order.
+    """
+    row_lists = [rows for rows in row_lists if rows]
+    if len(row_lists) == 1:
+        merged = row_lists[0]
+    else:
+        merged = list(heapq.merge(*row_lists, key=lambda row: (row[5], row[0]), reverse=True))
+    return merged[:limit] if limit is not None else merged
+
+
+class CouponArchiver:
+    """Background task archiving old redeemed coupons every COUPON_ARCHIVE_INTERVAL_SECONDS."""
+
+    def __init__(self, interval: float, older_than: timedelta, batch_size: int):
+        self.interval = interval
+        self.older_than = older_than
+        self.batch_size = batch_size
+        self.archived = 0
+        self.runs = 0
+        self.failures = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                archived = await archive_used_coupons(self.older_than, self.batch_size)
+            except Exception as e:
+                self.failures += 1
+                logger.warning("Coupon archiving failed: %s", e)
+                continue
+            self.runs += 1
+            self.archived += archived
+            if archived:
+                logger.info("Archived %s redeemed coupon(s)", archived)
+
+    def stats(self) -> dict:
+        return {"runs": self.runs, "archived": self.archived, "failures": self.failures}
+
+
+coupon_archiver = CouponArchiver(
+    settings.COUPON_ARCHIVE_INTERVAL_SECONDS,
+    timedelta(days=settings.COUPON_ARCHIVE_AFTER_DAYS),
+    settings.COUPON_ARCHIVE_BATCH_SIZE,
+)
@@ -0,0 +1,220 @@
+"""
+Server-side barcode decoding: GS1 check digit validation and deposit value
+extraction, done for a whole batch of scans at once.
+
+Codes are grouped by shape. All-digit codes of 8, 12, 13 or 14 digits are
+EAN-8, UPC-A, EAN-13 and GTIN-14; GS1-128 element strings such as
+"(01)09501101530003(3932)978250" are parsed for their GTIN (AI 01) and amount
+(AI 392n / 393n). Each group becomes one uint8 matrix, so check digits and
+embedded values are computed with a few NumPy operations per group rather
+than a Python loop per code. Anything else (QR payloads, Code 128 text) is
+passed through undecoded.
+
+A wrong check digit only rejects a code that is marked as GS1-128 or that
+matches a VALUE_RULES prefix, where a misread digit would store a wrong
+amount. Any other run of 8 to 14 digits may just as well be some other
+numbering scheme, and is kept as an opaque code.
+
+Embedded values come from VALUE_RULES, matched on the leading digits of the
+code. The rule for a given prefix is looked up once and kept in an LRU cache,
+so a batch only pays for the prefixes it has not seen before.
+"""
+import re
+from decimal import Decimal
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.config import settings
+
+FORMATS_BY_LENGTH = {8: "ean8", 12: "upca", 13: "ean13", 14: "gtin14"}
+FORMAT_NAMES = {"ean8": "EAN-8", "upca": "UPC-A", "ean13": "EAN-13", "gtin14": "GTIN-14"}
+
+
+class ValueRule(NamedTuple):
+    format: str
+    prefix: str
+    start: int  # value digits are code[start:end]
+    end: int
+    decimals: int
+    currency: Optional[str] = None  # None means BARCODE_DEFAULT_CURRENCY
+
+
+# GS1 restricted circulation numbers (EAN-13 prefixes 20-29, UPC-A number
+# system 2) are what in-store and deposit return machines print, with the
+# amount in cents just before the check digit. Add market-specific layouts
+# here; the longest matching prefix wins.
+VALUE_RULES: Tuple[ValueRule, ...] = tuple(
+    ValueRule("ean13", str(prefix), 7, 12, 2) for prefix in range(20, 30)
+) + (
+    ValueRule("upca", "2", 6, 11, 2),
+)
+
+# ISO 4217 numeric codes accepted in AI 393n
+CURRENCY_CODES = {
+    "978": "EUR", "826": "GBP", "840": "USD", "756": "CHF", "752": "SEK",
+    "578": "NOK", "208": "DKK", "985": "PLN", "203": "CZK", "348": "HUF",
+}
+
+_PREFIX_DIGITS = max(len(rule.prefix) for rule in VALUE_RULES)
+_GS = "\x1d"  # FNC1 separator as sent by scanners
+_SYMBOLOGY_IDS = ("]C1", "]e0", "]d2", "]Q3")
+# ASCII only: str.isdigit() also accepts digits like "٣" and "²"
+_DIGITS = re.compile(r"[0-9]+")
+
+
+def _is_digits(value: str) -> bool:
+    return _DIGITS.fullmatch(value) is not None
+
+
+class DecodedBarcode(NamedTuple):
+    format: Optional[str] = None  # None: not a GS1 code, nothing was checked
+    value: Optional[Decimal] = None
+    currency: Optional[str] = None
+    error: Optional[str] = None
+
+
+def check_digit(digits: str) -> str:
+    """GS1 check digit for `digits` (the code without its last digit)."""
+    total = sum(int(digit) * (3 if index % 2 == 0 else 1) for index, digit in enumerate(reversed(digits)))
+    return str(-total % 10)
+
+
+@lru_cache(maxsize=settings.BARCODE_RULE_CACHE_SIZE)
+def _rule_for(format: str, leading: str) -> int:
+    """Index in VALUE_RULES of the longest prefix rule matching `leading`, or -1."""
+    best, best_length = -1, -1
+    for index, rule in enumerate(VALUE_RULES):
+        if rule.format == format and leading.startswith(rule.prefix) and len(rule.prefix) > best_length:
+            best, best_length = index, len(rule.prefix)
+    return best
+
+
+def _digit_matrix(codes: Sequence[str]) -> np.ndarray:
+    """Equal-length digit strings as an (n, length) matrix of 0-9 values."""
+    length = len(codes[0])
+    return (np.frombuffer("".join(codes).encode("ascii"), dtype=np.uint8).reshape(len(codes), length) - 48).astype(
+        np.int64
+    )
+
+
+def _valid_check_digits(digits: np.ndarray) -> np.ndarray:
+    # Weights 3, 1, 3, ... counted leftwards from the digit before the check digit
+    weights = np.where(np.arange(digits.shape[1] - 1)[::-1] % 2 == 0, 3, 1)
+    expected = -(digits[:, :-1] @ weights) % 10
+    return expected == digits[:, -1]
+
+
+def _embedded_values(format: str, digits: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Per row: index of the matching value rule (-1 for none) and the raw integer amount."""
+    leading = digits[:, :_PREFIX_DIGITS] @ (10 ** np.arange(_PREFIX_DIGITS - 1, -1, -1))
+    prefixes, inverse = np.unique(leading, return_inverse=True)
+    rule_of_prefix = np.array(
+        [_rule_for(format, f"{prefix:0{_PREFIX_DIGITS}d}") for prefix in prefixes.tolist()], dtype=np.int64
+    )
+    rules = rule_of_prefix[inverse.reshape(-1)]
+    amounts = np.zeros(len(digits), dtype=np.int64)
+    for index in np.unique(rules[rules >= 0]).tolist():
+        rule = VALUE_RULES[index]
+        rows = rules == index
+        width = rule.end - rule.start
+        amounts[rows] = digits[rows, rule.start:rule.end] @ (10 ** np.arange(width - 1, -1, -1))
+    return rules, amounts
+
+
+def _parse_element_string(code: str) -> Tuple[Optional[Dict[str, str]], bool]:
+    """
+    AIs of a GS1-128 element string, or None if `code` is not one, and
+    whether `code` is marked as GS1 (symbology identifier, parenthesised
+    AIs or FNC1 separators). Only the AIs needed here are understood; parsing
+    stops at the first other AI. An unmarked run of digits is only read as
+    GS1 if those AIs make up all of it, so other long numeric codes that
+    happen to start with "01" stay opaque.
+    """
+    marked = False
+    for symbology in _SYMBOLOGY_IDS:
+        if code.startswith(symbology):
+            code, marked = code[len(symbology):], True
+            break
+    if code.startswith("("):
+        # Human-readable form: (01)...(3932)...
+        code, marked = code.replace(")", "").replace("(", _GS)[1:], True
+    elif not (code.startswith("01") and len(code) >= 16):
+        return None, False
+    marked = marked or _GS in code
+    fields: Dict[str, str] = {}
+    while code:
+        if code.startswith("01"):
+            fields["01"], code = code[2:16], code[16:]
+        elif code[:3] in ("392", "393") and len(code) > 4:
+            ai, rest = code[:4], code[4:]
+            value, _, code = rest.partition(_GS)
+            fields[ai] = value
+        else:
+            break
+        code = code.lstrip(_GS)
+    if "01" not in fields or len(fields["01"]) != 14 or not all(_is_digits(value) for value in fields.values()):
+        return None, False
+    if code and not marked:
+        return None, False
+    return fields, marked
+
+
+def _element_string_value(fields: Dict[str, str]) -> Tuple[Optional[Decimal], Optional[str]]:
+    for ai, value in fields.items():
+        decimals = int(ai[3]) if len(ai) == 4 else 0
+        if ai.startswith("392") and value:
+            return Decimal(int(value)).scaleb(-decimals), None
+        if ai.startswith("393") and len(value) > 3 and value[:3] in CURRENCY_CODES:
+            return Decimal(int(value[3:])).scaleb(-decimals), CURRENCY_CODES[value[:3]]
+    return None, None
+
+
+def decode_barcodes(codes: Sequence[str]) -> List[DecodedBarcode]:
+    """Check digits and embedded values for every code, in input order."""
+    results = [DecodedBarcode()] * len(codes)
+    groups: Dict[str, List[int]] = {}  # format -> positions in `codes`
+    gtins: Dict[int, str] = {}  # position -> GTIN-14 from a GS1-128 element string
+    element_values: Dict[int, Tuple[Optional[Decimal], Optional[str]]] = {}
+    unmarked = set()  # positions read as GS1-128 without being marked as such
+    for position, code in enumerate(codes):
+        format = FORMATS_BY_LENGTH.get(len(code)) if _is_digits(code) else None
+        if format is None:
+            fields, marked = _parse_element_string(code) if code else (None, False)
+            if fields is None:
+                continue
+            format = "gs1-128"
+            if not marked:
+                unmarked.add(position)
+            gtins[position] = fields["01"]
+            element_values[position] = _element_string_value(fields)
+        groups.setdefault(format, []).append(position)
+
+    for format, positions in groups.items():
+        strings = [gtins[position] if format == "gs1-128" else codes[position] for position in positions]
+        digits = _digit_matrix(strings)
+        valid = _valid_check_digits(digits) if settings.BARCODE_CHECK_DIGITS else np.ones(len(digits), dtype=bool)
+        rules = amounts = None
+        if format != "gs1-128":
+            rules, amounts = _embedded_values(format, digits)
+        for row, position in enumerate(positions):
+            if not valid[row]:
+                # A plain run of digits is not necessarily a GTIN; only reject
+                # it when it claims to carry a value or is marked as GS1
+                if position in unmarked or (rules is not None and rules[row] < 0):
+                    continue  # keep it as an opaque code
+                name = FORMAT_NAMES.get(format, "GS1-128 GTIN")
+                results[position] = DecodedBarcode(format, error=f"Invalid {name} check digit")
+                continue
+            value = currency = None
+            if settings.BARCODE_DECODE_VALUES:
+                if format == "gs1-128":
+                    value, currency = element_values[position]
+                elif rules[row] >= 0:
+                    rule = VALUE_RULES[rules[row]]
+                    value, currency = Decimal(int(amounts[row])).scaleb(-rule.decimals), rule.currency
+            if value is not None:
+                currency = currency or settings.BARCODE_DEFAULT_CURRENCY
+            results[position] = DecodedBarcode(format, value, currency)
+    return results
@@ -0,0 +1,67 @@
+from decimal import Decimal
+from typing import List
+
+import asyncpg
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.exceptions import IntegrityError
+
+from app.config import settings
+from app.models import Coupon
+from app.utils.sql import is_postgres
+
+COUPON_COLUMNS = ("id", "barcode", "value", "currency", "user_id", "is_used", "scanned_at", "used_at")
+
+# Keeps each statement well under the bind-parameter limit of every backend
+INSERT_CHUNK_ROWS = 500
+
+
+def _coupon_record(coupon: Coupon) -> tuple:
+    return (
+        coupon.id,
+        coupon.barcode,
+        None if coupon.value is None else Decimal(str(coupon.value)),
+        coupon.currency,
+        coupon.user_id,
+        coupon.is_used,
+        coupon.scanned_at,
+        coupon.used_at,
+    )
+
+
+async def bulk_insert_coupons(coupons: List[Coupon], connection: BaseDBAsyncClient):
+    """
+    Insert many coupons with as few round trips as possible.
+
+    On Postgres, large batches are streamed with COPY and smaller ones go out
+    as multi-row INSERT statements. Other backends fall back to Tortoise's
+    bulk_create. Pass the connection of an open transaction so the whole batch
+    commits or rolls back together. Constraint violations raise Tortoise's
+    IntegrityError on every path.
+    """
+    if not coupons:
+        return
+    if not is_postgres(connection):
+        # Runs on the caller's transaction connection
+        await Coupon.bulk_create(coupons)
+        return
+
+    records = [_coupon_record(coupon) for coupon in coupons]
+    if len(records) >= settings.COUPON_COPY_THRESHOLD:
+        async with connection.acquire_connection() as raw:
+            try:
+                await raw.copy_records_to_table("coupon", records=records, columns=COUPON_COLUMNS)
+            except asyncpg.IntegrityConstraintViolationError as e:
+                # The raw connection skips Tortoise's exception translation
+                raise IntegrityError(e) from e
+        return
+
+    columns = ", ".join(f'"{column}"' for column in COUPON_COLUMNS)
+    width = len(COUPON_COLUMNS)
+    for start in range(0, len(records), INSERT_CHUNK_ROWS):
+        chunk = records[start:start + INSERT_CHUNK_ROWS]
+        rows = ", ".join(
+            "(" + ", ".join(f"${i * width + j + 1}" for j in range(width)) + ")"
+            for i in range(len(chunk))
+        )
+        values = [value for record in chunk for value in record]
+        await connection.execute_query(f'INSERT INTO "coupon" ({columns}) VALUES {rows}', values)
@@ -0,0 +1,194 @@
+"""
+Database routing beyond the ORM's single default connection.
+
+GET handlers run their queries through `read_replica.read()`, which uses the
+replica when one is configured and healthy and falls back to the primary
+otherwise:
+
+    rows = await read_replica.read(
+        lambda db: Coupon.filter(user_id=user.id).using_db(db).values_list(*COUPON_FIELDS),
+        pin_key=str(user.id),
+    )
+
+The replica is kept out of the Tortoise config on purpose: Tortoise opens
+every configured connection at startup, so an unreachable replica would
+stop the app from booting instead of just being skipped.
+
+With DB_ENGINE=sqlite the "replica" is a read-only connection to the same
+database file: reads then never wait behind the single writer connection,
+and since WAL readers see every commit, users are never pinned.
+"""
+import asyncio
+import sqlite3
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import asyncpg
+from tortoise import Tortoise
+from tortoise.backends.asyncpg.client import AsyncpgDBClient
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.backends.sqlite.client import SqliteClient
+from tortoise.exceptions import DBConnectionError
+
+from app.config import settings
+from app.utils.cache import TTLCache
+from app.utils.logger import logger
+
+T = TypeVar("T")
+
+# Errors meaning "the replica is unreachable", as opposed to a bad query
+REPLICA_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    DBConnectionError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.InterfaceError,
+    asyncpg.CannotConnectNowError,
+)
+
+
+def primary_connection() -> BaseDBAsyncClient:
+    return Tortoise.get_connection("default")
+
+
+class ReadReplica:
+    """
+    Optional read-only connection. After a connection failure the replica is
+    skipped for DB_REPLICA_RETRY_SECONDS. Users who just wrote something are
+    pinned to the primary for DB_REPLICA_STICKY_SECONDS so they read their
+    own writes despite replication lag.
+    """
+
+    def __init__(self):
+        self.credentials = settings.replica_credentials
+        self.sqlite = settings.DB_ENGINE == "sqlite"
+        self._client: Optional[BaseDBAsyncClient] = None
+        self._down_until = 0.0
+        self._connect_lock: Optional[asyncio.Lock] = None
+        self._pinned = TTLCache(maxsize=settings.AUTH_CACHE_SIZE, ttl=settings.DB_REPLICA_STICKY_SECONDS)
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.fallbacks = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.credentials is not None
+
+    def _mark_down(self, error: Exception):
+        self._down_until = time.monotonic() + settings.DB_REPLICA_RETRY_SECONDS
+        logger.warning("Read replica unavailable, using primary for %ss: %s", settings.DB_REPLICA_RETRY_SECONDS, error)
+
+    async def connect(self) -> bool:
+        """Open the replica pool if configured and not known to be down. Returns True if usable."""
+        if not self.enabled or time.monotonic() < self._down_until:
+            return False
+        if self._client is not None:
+            return True
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._client is not None:
+                return True
+            client_class = SqliteClient if self.sqlite else AsyncpgDBClient
+            client = client_class(connection_name="replica", **self.credentials)
+            try:
+                await client.create_connection(with_db=True)
+            except REPLICA_ERRORS + (sqlite3.Error,) as e:
+                self._mark_down(e)
+                return False
+            self._client = client
+            if self.sqlite:
+                logger.info("Opened read connection to %s", self.credentials["file_path"])
+            else:
+                logger.info("Connected to read replica at %s:%s", self.credentials["host"], self.credentials["port"])
+            return True
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    def pin(self, key: str):
+        """Route reads for `key` (usually a user id) to the primary for a short while."""
+        if self.enabled and not self.sqlite:
+            self._pinned.set(key, True)
+
+    async def read(self, query: Callable[[BaseDBAsyncClient], Awaitable[T]], pin_key: Optional[str] = None) -> T:
+        """Run `query(connection)` on the replica if possible, else (or on failure) on the primary."""
+        if pin_key is None or pin_key not in self._pinned:
+            if await self.connect():
+                try:
+                    result = await query(self._client)
+                    self.replica_reads += 1
+                    return result
+                except REPLICA_ERRORS as e:
+                    self.fallbacks += 1
+                    self._mark_down(e)
+        self.primary_reads += 1
+        return await query(primary_connection())
+
+    def stats(self) -> dict:
+        return {
+            "enabled": int(self.enabled),
+            "connected": int(self._client is not None and time.monotonic() >= self._down_until),
+            "replica_reads": self.replica_reads,
+            "primary_reads": self.primary_reads,
+            "fallbacks": self.fallbacks,
+            "pinned_keys": len(self._pinned),
+            **_pool_stats("replica_pool", self._client),
+        }
+
+
+def _pool_stats(prefix: str, client) -> dict:
+    pool = getattr(client, "_pool", None)
+    if pool is None:
+        return {}
+    return {f"{prefix}_size": pool.get_size(), f"{prefix}_idle": pool.get_idle_size()}
+
+
+def pool_stats() -> dict:
+    """Size and idle count of the primary's asyncpg pool (empty for other backends)."""
+    try:
+        return _pool_stats("primary_pool", primary_connection())
+    except Exception:
+        return {}
+
+
+class PoolRecycler:
+    """
+    asyncpg has no max connection age, only max queries and max idle time.
+    Every DB_POOL_MAX_LIFETIME_SECONDS this expires the pools' connections,
+    so each is replaced the next time it is released.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            for client in (primary_connection(), read_replica._client):
+                pool = getattr(client, "_pool", None)
+                if pool is not None:
+                    try:
+                        await pool.expire_connections()
+                    except Exception as e:
+                        logger.warning("Failed to recycle pool connections: %s", e)
+
+
+read_replica = ReadReplica()
+pool_recycler = PoolRecycler(settings.DB_POOL_MAX_LIFETIME_SECONDS)
@@ -1,9 +1,22 @@
+import asyncio
 import smtplib
+import time
+import uuid
+from collections import OrderedDict
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from typing import List, Optional
+
 from app.config import settings
+from app.utils.logger import MaskedEmail, logger
+from app.utils.metrics import SMTP_SEND_SECONDS
 
 class EmailSender:
+    """
+    Sends mail over a single SMTP connection that is kept open between sends.
+    Not thread-safe: each outbox worker owns its own sender.
+    """
+
     def __init__(self):
         self.smtp_host = settings.SMTP_HOST
         self.smtp_port = settings.SMTP_PORT
@@ -11,19 +24,305 @@ class EmailSender:
         self.smtp_password = settings.SMTP_PASSWORD
         self.from_email = settings.SMTP_FROM_EMAIL
         self.use_tls = getattr(settings, 'SMTP_USE_TLS', True)
+        self.timeout = settings.SMTP_TIMEOUT
+        self._server: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
 
-    def send_email(self, to_email: str, subject: str, body: str):
+    def build_message(self, to_email: str, subject: str, body: str) -> str:
         msg = MIMEMultipart()
         msg['From'] = self.from_email
         msg['To'] = to_email
         msg['Subject'] = subject
         msg.attach(MIMEText(body, 'plain'))
+        return msg.as_string()
+
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(self.smtp_host, self.smtp_port, timeout=self.timeout)
+        if self.use_tls:
+            server.starttls()
+        if self.smtp_user and self.smtp_password:
+            server.login(self.smtp_user, self.smtp_password)
+        return server
+
+    def _get_connection(self) -> smtplib.SMTP:
+        if self._server is not None:
+            # Probe connections that sat idle; the server may have dropped them
+            if time.monotonic() - self._last_used > settings.SMTP_IDLE_PROBE_SECONDS:
+                try:
+                    if self._server.noop()[0] != 250:
+                        self.close()
+                except (smtplib.SMTPException, OSError):
+                    self.close()
+        if self._server is None:
+            self._server = self._connect()
+        return self._server
 
-        with smtplib.SMTP(self.smtp_host, self.smtp_port) as server:
-            if self.use_tls:
-                server.starttls()
-            if self.smtp_user and self.smtp_password:
-                server.login(self.smtp_user, self.smtp_password)
-            server.sendmail(self.from_email, to_email, msg.as_string())
+    def close(self):
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._server = None
+
+    def close_if_idle(self, idle_seconds: float):
+        if self._server is not None and time.monotonic() - self._last_used > idle_seconds:
+            self.close()
+
+    def send_email(self, to_email: str, subject: str, body: str):
+        message = self.build_message(to_email, subject, body)
+        try:
+            server = self._get_connection()
+            server.sendmail(self.from_email, to_email, message)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # Stale connection: reconnect once and retry
+            self.close()
+            server = self._get_connection()
+            server.sendmail(self.from_email, to_email, message)
+        self._last_used = time.monotonic()
 
 email_sender = EmailSender()
+
+
+class OutboxMessage:
+    def __init__(self, to_email: str, subject: str, body: str):
+        self.id = str(uuid.uuid4())
+        self.to_email = to_email
+        self.subject = subject
+        self.body = body
+        self.attempts = 0
+        self.status = "queued"
+        self.last_error: Optional[str] = None
+        self.created_at = time.time()
+        self.sent_at: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "to": self.to_email,
+            "status": self.status,
+            "attempts": self.attempts,
+            "last_error": self.last_error,
+            "created_at": self.created_at,
+            "sent_at": self.sent_at,
+        }
+
+
+class EmailOutbox:
+    """
+    Asynchronous outbox for transactional email.
+
+    Request handlers call `enqueue()` and return immediately. Background
+    workers, each holding a persistent SMTP connection, drain the queue in
+    batches and retry failed messages with exponential backoff. The state
+    of recent messages can be looked up with `status()`.
+
+    On shutdown, messages waiting out a retry backoff get one last attempt
+    straight away; whatever still is not sent is marked failed and logged
+    with its id.
+
+    The queue and the delivery state live in this worker's memory only.
+    Mail queued when the process crashes or is killed is lost without a
+    trace, and status() only knows the messages this worker queued; the
+    user has to ask for a new code (resend-otp, request-password-reset).
+    """
+
+    def __init__(self):
+        self.workers = settings.SMTP_OUTBOX_WORKERS
+        self.batch_size = settings.SMTP_BATCH_SIZE
+        self.max_attempts = settings.SMTP_MAX_ATTEMPTS
+        self.retry_backoff = settings.SMTP_RETRY_BACKOFF_SECONDS
+        self.idle_timeout = settings.SMTP_IDLE_TIMEOUT_SECONDS
+        self.history_size = settings.SMTP_OUTBOX_HISTORY
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._senders: List[EmailSender] = []
+        self._retry_handles = {}  # message id -> (TimerHandle, message)
+        self._stopping = False
+        self._unsent: List[OutboxMessage] = []  # given up on during stop()
+        self._messages: "OrderedDict[str, OutboxMessage]" = OrderedDict()
+        self.sent_count = 0
+        self.failed_count = 0
+        self.retry_count = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._stopping = False
+        for i in range(self.workers):
+            sender = EmailSender()
+            self._senders.append(sender)
+            self._tasks.append(asyncio.create_task(self._worker(sender), name=f"email-outbox-{i}"))
+        logger.info("Email outbox started with %s worker(s)", self.workers)
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """Give queued and retrying mail a last chance to go out, then stop the workers."""
+        if not self._tasks:
+            return
+        self._stopping = True
+        self._unsent = []
+        # Don't wait out the backoff: retry now, once
+        for handle, message in list(self._retry_handles.values()):
+            handle.cancel()
+            self._requeue(message)
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            pass
+        while not self._queue.empty():
+            message = self._queue.get_nowait()
+            self._give_up(message, "outbox stopped before it was sent")
+        if self._unsent:
+            logger.warning(
+                "Email outbox stopped with %s unsent message(s): %s",
+                len(self._unsent), ", ".join(message.id for message in self._unsent),
+            )
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        loop = asyncio.get_running_loop()
+        for sender in self._senders:
+            await loop.run_in_executor(None, sender.close)
+        self._senders = []
+
+    def enqueue(self, to_email: str, subject: str, body: str) -> str:
+        """Queue a message for delivery and return its id."""
+        message = OutboxMessage(to_email, subject, body)
+        self._remember(message)
+        if self._queue is None:
+            # Outbox not running (e.g. scripts): deliver inline
+            self._send_inline(message)
+        else:
+            self._queue.put_nowait(message)
+        return message.id
+
+    def status(self, message_id: str) -> Optional[dict]:
+        message = self._messages.get(message_id)
+        return message.to_dict() if message else None
+
+    def recent(self, limit: int) -> List[dict]:
+        """Delivery state of the last `limit` messages queued by this worker, newest first."""
+        messages = list(self._messages.values())[-limit:] if limit > 0 else []
+        return [message.to_dict() for message in reversed(messages)]
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "workers": len(self._tasks),
+            "sent": self.sent_count,
+            "failed": self.failed_count,
+            "retries": self.retry_count,
+        }
+
+    def _remember(self, message: OutboxMessage):
+        self._messages[message.id] = message
+        while len(self._messages) > self.history_size:
+            self._messages.popitem(last=False)
+
+    def _send_inline(self, message: OutboxMessage):
+        message.attempts += 1
+        try:
+            email_sender.send_email(message.to_email, message.subject, message.body)
+        except Exception as e:
+            message.status = "failed"
+            message.last_error = str(e)
+            self.failed_count += 1
+            logger.error("Failed to send email %s to %s: %s", message.id, MaskedEmail(message.to_email), e)
+            return
+        message.status = "sent"
+        message.sent_at = time.time()
+        self.sent_count += 1
+
+    async def _next_batch(self) -> List[OutboxMessage]:
+        try:
+            first = await asyncio.wait_for(self._queue.get(), timeout=self.idle_timeout)
+        except asyncio.TimeoutError:
+            return []
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    async def _worker(self, sender: EmailSender):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            if not batch:
+                # Nothing to do for a while: let the server reclaim the connection
+                await loop.run_in_executor(None, sender.close_if_idle, self.idle_timeout)
+                continue
+            try:
+                for message in batch:
+                    message.status = "sending"
+                results = await loop.run_in_executor(None, self._send_batch, sender, batch)
+                for message, error in zip(batch, results):
+                    self._record_result(message, error)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    @staticmethod
+    def _send_batch(sender: EmailSender, batch: List[OutboxMessage]) -> List[Optional[Exception]]:
+        results: List[Optional[Exception]] = []
+        for message in batch:
+            message.attempts += 1
+            start = time.perf_counter()
+            try:
+                sender.send_email(message.to_email, message.subject, message.body)
+                results.append(None)
+                SMTP_SEND_SECONDS.observe(time.perf_counter() - start, result="sent")
+            except Exception as e:
+                SMTP_SEND_SECONDS.observe(time.perf_counter() - start, result="error")
+                # Drop the connection so the next message starts clean
+                sender.close()
+                results.append(e)
+        return results
+
+    def _record_result(self, message: OutboxMessage, error: Optional[Exception]):
+        if error is None:
+            message.status = "sent"
+            message.sent_at = time.time()
+            message.last_error = None
+            self.sent_count += 1
+            logger.info("Email %s sent to %s", message.id, MaskedEmail(message.to_email))
+            return
+        message.last_error = str(error)
+        if self._stopping:
+            self._give_up(message, str(error))
+            return
+        if message.attempts >= self.max_attempts:
+            message.status = "failed"
+            self.failed_count += 1
+            logger.error("Giving up on email %s to %s after %s attempts: %s", message.id, MaskedEmail(message.to_email), message.attempts, error)
+            return
+        delay = self.retry_backoff * (2 ** (message.attempts - 1))
+        message.status = "retrying"
+        self.retry_count += 1
+        logger.warning("Email %s to %s failed (%s), retrying in %.1fs", message.id, MaskedEmail(message.to_email), error, delay)
+        handle = asyncio.get_running_loop().call_later(delay, self._requeue, message)
+        self._retry_handles[message.id] = (handle, message)
+
+    def _give_up(self, message: OutboxMessage, reason: str):
+        message.status = "failed"
+        message.last_error = reason
+        self.failed_count += 1
+        self._unsent.append(message)
+
+    def _requeue(self, message: OutboxMessage):
+        self._retry_handles.pop(message.id, None)
+        if self._queue is not None:
+            message.status = "queued"
+            self._queue.put_nowait(message)
+
+email_outbox = EmailOutbox()
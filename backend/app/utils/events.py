@@ -0,0 +1,200 @@
+"""
+Per-user coupon change feed behind GET /api/coupons/events (Server-Sent Events).
+
+Write routes call `coupon_events.publish()` once their transaction has
+committed. Each worker keeps the open streams of its own clients; to reach
+streams held by other workers, events go through Postgres:
+
+    publish() -> NOTIFY coupon_events -> every worker's LISTEN connection
+              -> that worker's streams for the user
+
+The LISTEN connection is a dedicated asyncpg connection outside the pool and
+is re-opened after EVENTS_RETRY_SECONDS if it drops. Without Postgres
+(DB_ENGINE=sqlite) or while it is down, events are delivered to this
+worker's streams only.
+
+Events are "created" and "used" with {"coupons": [...]} in the coupon list's
+JSON shape, and "deleted" with {"ids": [...]}. A stream that falls more than
+SSE_QUEUE_SIZE events behind gets a single "resync" event instead, meaning
+"reload the list" (which the ETag keeps cheap).
+"""
+import asyncio
+from typing import Dict, List, Optional, Sequence, Set
+
+import asyncpg
+import orjson
+from tortoise import Tortoise
+
+from app.config import settings
+from app.utils.logger import logger
+from app.utils.serializers import coupon_rows_to_dicts
+from app.utils.sql import is_postgres
+
+# NOTIFY payloads are capped at 8000 bytes; a coupon is roughly 200
+NOTIFY_CHUNK = 25
+
+CLOSE = None  # queued to end a stream
+
+
+def sse_frame(event: str, data: bytes) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + data + b"\n\n"
+
+
+class CouponEventBus:
+    def __init__(self, channel: str, queue_size: int, retry_seconds: float):
+        self.channel = channel
+        self.queue_size = queue_size
+        self.retry_seconds = retry_seconds
+        self._streams: Dict[str, Set[asyncio.Queue]] = {}
+        self._listener = None  # asyncpg connection while LISTENing
+        self._task: Optional[asyncio.Task] = None
+        self.published = 0
+        self.delivered = 0
+        self.resyncs = 0
+        self.notify_failures = 0
+
+    # Streams
+
+    def subscribe(self, user_id) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._streams.setdefault(str(user_id), set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id, queue: asyncio.Queue):
+        streams = self._streams.get(str(user_id))
+        if streams is not None:
+            streams.discard(queue)
+            if not streams:
+                del self._streams[str(user_id)]
+
+    def close_streams(self):
+        """End every open stream, e.g. when the worker is shutting down."""
+        for streams in self._streams.values():
+            for queue in streams:
+                self._put(queue, CLOSE, force=True)
+
+    def _put(self, queue: asyncio.Queue, frame, force: bool = False):
+        try:
+            queue.put_nowait(frame)
+            return
+        except asyncio.QueueFull:
+            pass
+        # Too far behind: drop what is queued and tell the client to reload
+        while not queue.empty():
+            queue.get_nowait()
+        self.resyncs += 1
+        queue.put_nowait(CLOSE if force else sse_frame("resync", b"{}"))
+
+    def _dispatch(self, user_id: str, event: str, data: bytes):
+        streams = self._streams.get(user_id)
+        if not streams:
+            return
+        frame = sse_frame(event, data)
+        for queue in streams:
+            self._put(queue, frame)
+            self.delivered += 1
+
+    # Publishing
+
+    async def publish(self, user_id, event: str, data: dict):
+        """Send `event` to all of the user's streams, on every worker. Never raises."""
+        self.published += 1
+        user_id = str(user_id)
+        if self._listener is None:
+            self._dispatch(user_id, event, orjson.dumps(data))
+            return
+        try:
+            connection = Tortoise.get_connection("default")
+            for chunk in _chunks(data):
+                payload = orjson.dumps({"user_id": user_id, "event": event, "data": chunk}).decode()
+                await connection.execute_query("SELECT pg_notify($1, $2)", [self.channel, payload])
+        except Exception as e:
+            # This worker's own streams still get it; other workers' clients catch up on their next reload
+            self.notify_failures += 1
+            logger.warning("Failed to NOTIFY coupon event, delivering locally: %s", e)
+            self._dispatch(user_id, event, orjson.dumps(data))
+
+    async def publish_coupons(self, user_id, event: str, rows: Sequence[tuple]):
+        """Publish "created" or "used" for COUPON_FIELDS rows."""
+        if rows:
+            await self.publish(user_id, event, {"coupons": coupon_rows_to_dicts(rows)})
+
+    async def publish_deleted(self, user_id, ids: Sequence):
+        if ids:
+            await self.publish(user_id, "deleted", {"ids": list(ids)})
+
+    def _on_notify(self, connection, pid, channel, payload: str):
+        try:
+            message = orjson.loads(payload)
+            self._dispatch(message["user_id"], message["event"], orjson.dumps(message["data"]))
+        except (ValueError, KeyError) as e:
+            logger.warning("Ignoring malformed coupon event: %s", e)
+
+    # LISTEN connection
+
+    def start(self):
+        if self._task is None and is_postgres(Tortoise.get_connection("default")):
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        self.close_streams()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        credentials = settings.database_connection["credentials"]
+        while True:
+            closed = asyncio.Event()
+            try:
+                connection = await asyncpg.connect(
+                    host=credentials["host"],
+                    port=credentials["port"],
+                    user=credentials["user"],
+                    password=credentials["password"],
+                    database=credentials["database"],
+                    ssl=credentials["ssl"],
+                )
+            except Exception as e:
+                logger.warning("Coupon event LISTEN connection failed, retrying in %ss: %s", self.retry_seconds, e)
+                await asyncio.sleep(self.retry_seconds)
+                continue
+            try:
+                connection.add_termination_listener(lambda _: closed.set())
+                await connection.add_listener(self.channel, self._on_notify)
+                self._listener = connection
+                logger.info("Listening for coupon events on %s", self.channel)
+                await closed.wait()
+                logger.warning("Coupon event LISTEN connection lost, delivering locally until it is back")
+            except Exception as e:
+                logger.warning("Coupon event LISTEN failed: %s", e)
+            finally:
+                self._listener = None
+                if not connection.is_closed():
+                    await connection.close()
+            await asyncio.sleep(self.retry_seconds)
+
+    def stats(self) -> dict:
+        return {
+            "listening": int(self._listener is not None),
+            "streams": sum(len(streams) for streams in self._streams.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+            "resyncs": self.resyncs,
+            "notify_failures": self.notify_failures,
+        }
+
+
+def _chunks(data: dict) -> List[dict]:
+    for key in ("coupons", "ids"):
+        items = data.get(key)
+        if items is not None and len(items) > NOTIFY_CHUNK:
+            return [{key: items[i:i + NOTIFY_CHUNK]} for i in range(0, len(items), NOTIFY_CHUNK)]
+    return [data]
+
+
+coupon_events = CouponEventBus(settings.EVENTS_CHANNEL, settings.SSE_QUEUE_SIZE, settings.EVENTS_RETRY_SECONDS)
@@ -0,0 +1,72 @@
+import csv
+import io
+from typing import AsyncIterator, Dict, List, Sequence, Tuple
+
+import orjson
+
+from app.models import Coupon
+from app.utils.archive import merge_newest_first
+from app.utils.pagination import after_position
+from app.utils.serializers import COUPON_FIELDS, coupon_row_to_dict
+
+EXPORT_FIELDS = COUPON_FIELDS
+
+
+def _row_to_csv_dict(row: Tuple) -> Dict:
+    coupon_id, barcode, value, currency, is_used, scanned_at, used_at = row
+    return {
+        "id": str(coupon_id),
+        "barcode": barcode,
+        "value": float(value) if value is not None else None,
+        "currency": currency,
+        "is_used": is_used,
+        "scanned_at": scanned_at.isoformat() if scanned_at else None,
+        "used_at": used_at.isoformat() if used_at else None,
+    }
+
+
+async def iter_coupon_rows(
+    filters: Dict, chunk_size: int, models: Sequence = (Coupon,)
+) -> AsyncIterator[List[Tuple]]:
+    """
+    Yield a user's coupons newest-first in chunks of at most `chunk_size`
+    rows. Each chunk is a separate keyset query, so no connection is held
+    between chunks and memory stays bounded by the chunk size.
+    With several models (coupon and coupon_archive) each chunk is merged
+    from one keyset query per table.
+    """
+    position = None
+    while True:
+        chunks = []
+        for model in models:
+            queryset = model.filter(**filters)
+            if position is not None:
+                queryset = queryset.filter(after_position(*position))
+            chunks.append(
+                await queryset.order_by("-scanned_at", "-id").limit(chunk_size).values_list(*EXPORT_FIELDS)
+            )
+        rows = merge_newest_first(chunks, chunk_size)
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1]
+        position = (last[5], last[0])
+
+
+async def stream_ndjson(filters: Dict, chunk_size: int, models: Sequence = (Coupon,)) -> AsyncIterator[bytes]:
+    async for rows in iter_coupon_rows(filters, chunk_size, models):
+        yield b"".join(orjson.dumps(coupon_row_to_dict(row)) + b"\n" for row in rows)
+
+
+async def stream_csv(filters: Dict, chunk_size: int, models: Sequence = (Coupon,)) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    yield buffer.getvalue()
+    async for rows in iter_coupon_rows(filters, chunk_size, models):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(_row_to_csv_dict(row) for row in rows)
+        yield buffer.getvalue()
@@ -0,0 +1,71 @@
+import gzip
+import hashlib
+from typing import Dict, Iterable, Optional
+
+import orjson
+from fastapi import Request, Response
+
+from app.config import settings
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Weak comparison: ignore W/ prefixes on either side
+    wanted = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == wanted:
+            return True
+    return False
+
+
+_VARY = "Accept-Encoding, Authorization"
+
+
+def not_modified(etag: str) -> Response:
+    # Same caching headers the 200 carried, so caches keep keying it the same way
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache", "Vary": _VARY})
+
+
+def _accepted_encodings(request: Request) -> Iterable[str]:
+    for item in request.headers.get("accept-encoding", "").split(","):
+        token, _, params = item.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        if token:
+            yield token.lower()
+
+
+def json_response(request: Request, content, headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    orjson-encoded response, brotli- or gzip-compressed when the client
+    accepts it and the body is at least COMPRESS_MIN_SIZE bytes.
+    """
+    headers = dict(headers or {})
+    body = orjson.dumps(content)
+    headers["Vary"] = _VARY
+    if len(body) >= settings.COMPRESS_MIN_SIZE:
+        accepted = set(_accepted_encodings(request))
+        if brotli is not None and "br" in accepted:
+            body = brotli.compress(body, quality=settings.BROTLI_QUALITY)
+            headers["Content-Encoding"] = "br"
+        elif "gzip" in accepted:
+            body = gzip.compress(body, compresslevel=settings.GZIP_LEVEL)
+            headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -1,21 +1,207 @@
+import atexit
+import json
 import logging
-import sys
 import os
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Attributes every LogRecord has; anything else was passed via `extra=`
+_RESERVED_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including any fields passed with `extra=`."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps WARNING and above, and only a fraction of lower-level records. The
+    rate can be set per logger name (most specific prefix wins).
+    """
+
+    def __init__(self, default_rate: float = 1.0, rates: dict = None):
+        super().__init__()
+        self.default_rate = default_rate
+        self.rates = rates or {}
+        self.dropped = 0
+
+    def _rate_for(self, name: str) -> float:
+        best, rate = -1, self.default_rate
+        for prefix, prefix_rate in self.rates.items():
+            if (name == prefix or name.startswith(prefix + ".")) and len(prefix) > best:
+                best, rate = len(prefix), prefix_rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate_for(record.name)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        self.dropped += 1
+        return False
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Caps how often the same message template is logged below WARNING,
+    per second. Templates are the unformatted `msg`, so lazily formatted
+    calls with different arguments share one budget.
+    """
+
+    def __init__(self, per_second: float):
+        super().__init__()
+        self.per_second = per_second
+        self._windows = {}
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.per_second <= 0 or record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, record.msg)
+        now = int(time.monotonic())
+        with self._lock:
+            window, count = self._windows.get(key, (now, 0))
+            if window != now:
+                window, count = now, 0
+            if count >= self.per_second:
+                self.dropped += 1
+                return False
+            self._windows[key] = (window, count + 1)
+            if len(self._windows) > 10000:
+                self._windows.clear()
+        return True
+
+
+class LazyQueueListener(QueueListener):
+    """
+    QueueListener whose thread is started by the first record a process
+    logs. Threads do not survive fork(), so a listener started at import
+    time in the gunicorn master would leave every worker without one; a
+    forked child gets a fresh queue (the inherited one holds the parent's
+    records and possibly a lock held by its thread) and starts its own.
+    """
+
+    def __init__(self, log_queue: queue.Queue, *handlers, respect_handler_level: bool = False):
+        super().__init__(log_queue, *handlers, respect_handler_level=respect_handler_level)
+        self.running = False
+        self._start_lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self._thread = None
+        self.running = False
+        self._start_lock = threading.Lock()
+
+    def ensure_started(self):
+        if not self.running:
+            with self._start_lock:
+                if not self.running:
+                    self.start()
+                    self.running = True
+
+    def stop(self):
+        """Write out everything queued and end the thread; the next record starts it again."""
+        with self._start_lock:
+            if self.running:
+                super().stop()
+                self.running = False
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread without formatting them. Only
+    the message arguments are merged, so the record is safe to read from
+    another thread. Drops records instead of blocking when the queue is full.
+    """
+
+    def __init__(self, listener: LazyQueueListener):
+        super().__init__(listener.queue)
+        self.listener = listener
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        self.listener.ensure_started()
+        try:
+            # Not self.queue: the listener replaces its queue after a fork
+            self.listener.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _parse_rates(value: str) -> dict:
+    # "drs_app.coupons=0.1,drs_app.deps=0.01"
+    rates = {}
+    for item in value.split(","):
+        name, _, rate = item.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+class MaskedEmail:
+    """
+    Log argument standing for an email address: "j***@example.com". Like the
+    other arguments it is only turned into text if the record is written.
+    """
+
+    __slots__ = ("email",)
+
+    def __init__(self, email: str):
+        self.email = email
+
+    def __str__(self) -> str:
+        local, at, domain = (self.email or "").partition("@")
+        return f"{local[:1]}***{at}{domain}" if at else "***"
+
 
 # Create logger
 logger = logging.getLogger("drs_app")
 logger.setLevel(logging.INFO)
+logger.propagate = False
+
+# Create formatter: JSON lines by default, plain text for local reading
+if os.environ.get('LOG_FORMAT', 'json') == 'text':
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+else:
+    formatter = JsonFormatter()
 
 # Create console handler - log to stdout for cloud environments
 console_handler = logging.StreamHandler(sys.stdout)
 console_handler.setLevel(logging.INFO)
-
-# Create formatter
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 console_handler.setFormatter(formatter)
-
-# Add handlers to logger
-logger.addHandler(console_handler)
+output_handlers = [console_handler]
 
 # Only add file logging in development environments, not in production
 if os.environ.get('ENVIRONMENT') == 'development':
@@ -23,16 +209,41 @@ if os.environ.get('ENVIRONMENT') == 'development':
         from logging.handlers import RotatingFileHandler
         # Ensure logs directory exists
         os.makedirs('logs', exist_ok=True)
-        
+
         # Create file handler
         file_handler = RotatingFileHandler(
-            "logs/drs_app.log", 
+            "logs/drs_app.log",
             maxBytes=10485760,  # 10MB
             backupCount=5
         )
         file_handler.setLevel(logging.INFO)
         file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        output_handlers.append(file_handler)
     except Exception as e:
-        logger.warning(f"Could not set up file logging: {e}")
+        sys.stderr.write(f"Could not set up file logging: {e}\n")
+
+# Request paths only put records on a queue; a background thread does the
+# formatting and the (blocking) writes to stdout and the log file
+log_queue = queue.Queue(maxsize=int(os.environ.get('LOG_QUEUE_SIZE', 10000)))
+log_listener = LazyQueueListener(log_queue, *output_handlers, respect_handler_level=True)
+queue_handler = NonBlockingQueueHandler(log_listener)
+sampling_filter = SamplingFilter(
+    default_rate=float(os.environ.get('LOG_INFO_SAMPLE_RATE', 1.0)),
+    rates=_parse_rates(os.environ.get('LOG_SAMPLE_RATES', '')),
+)
+rate_limit_filter = RateLimitFilter(float(os.environ.get('LOG_RATE_LIMIT_PER_SECOND', 0)))
+queue_handler.addFilter(sampling_filter)
+queue_handler.addFilter(rate_limit_filter)
+logger.addHandler(queue_handler)
+
+# Stopped by the app's shutdown too; this covers scripts and tools
+atexit.register(log_listener.stop)
+
 
+def logging_stats() -> dict:
+    return {
+        "queue_depth": log_listener.queue.qsize(),
+        "dropped_queue_full": queue_handler.dropped,
+        "dropped_sampled": sampling_filter.dropped,
+        "dropped_rate_limited": rate_limit_filter.dropped,
+    }
@@ -0,0 +1,120 @@
+"""
+Write-behind buffer for user.last_login. Signin only records the timestamp
+in memory; a background task writes all pending timestamps in one batched
+UPDATE every LAST_LOGIN_FLUSH_SECONDS (sooner once LAST_LOGIN_FLUSH_SIZE
+users are pending) and once more on shutdown.
+"""
+import asyncio
+from datetime import datetime
+from typing import Dict, Optional
+
+from tortoise import Tortoise
+
+from app.config import settings
+from app.utils.logger import logger
+from app.utils.sql import is_postgres
+
+# Rows per UPDATE statement; two bind parameters each
+FLUSH_CHUNK_ROWS = 1000
+
+
+async def write_last_logins(pending: Dict[str, datetime]):
+    """Persist {user id: last login} without moving any timestamp backwards."""
+    connection = Tortoise.get_connection("default")
+    items = list(pending.items())
+    if not is_postgres(connection):
+        await connection.execute_many(
+            'UPDATE "user" SET "last_login" = ? WHERE "id" = ? AND ("last_login" IS NULL OR "last_login" < ?)',
+            [[when.isoformat(" "), user_id, when.isoformat(" ")] for user_id, when in items],
+        )
+        return
+    for start in range(0, len(items), FLUSH_CHUNK_ROWS):
+        chunk = items[start:start + FLUSH_CHUNK_ROWS]
+        rows = ", ".join(f"(${i * 2 + 1}::uuid, ${i * 2 + 2}::timestamptz)" for i in range(len(chunk)))
+        values = [value for user_id, when in chunk for value in (user_id, when)]
+        await connection.execute_query(
+            f"""
+            UPDATE "user" SET "last_login" = "v"."last_login"
+            FROM (VALUES {rows}) AS "v" ("id", "last_login")
+            WHERE "user"."id" = "v"."id"
+              AND ("user"."last_login" IS NULL OR "user"."last_login" < "v"."last_login")
+            """,
+            values,
+        )
+
+
+class LastLoginBuffer:
+    def __init__(self, interval: float, max_pending: int):
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending: Dict[str, datetime] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self.flushed = 0
+        self.flushes = 0
+        self.failures = 0
+
+    def record(self, user_id, when: datetime):
+        key = str(user_id)
+        if key not in self._pending or self._pending[key] < when:
+            self._pending[key] = when
+        if self._wakeup is not None and len(self._pending) >= self.max_pending:
+            self._wakeup.set()
+
+    def pending_for(self, user_id) -> Optional[datetime]:
+        return self._pending.get(str(user_id))
+
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        try:
+            await write_last_logins(pending)
+        except Exception as e:
+            self.failures += 1
+            logger.warning("Failed to write %s last_login update(s), will retry: %s", len(pending), e)
+            # Keep them for the next flush unless a newer login came in meanwhile
+            for user_id, when in pending.items():
+                self.record(user_id, when)
+            return 0
+        self.flushes += 1
+        self.flushed += len(pending)
+        return len(pending)
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the background task and write whatever is still pending."""
+        if self._task is not None:
+            # Not cancelled: a flush in progress must finish, not lose its batch
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._wakeup = None
+        await self.flush()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "failures": self.failures,
+        }
+
+
+last_login_buffer = LastLoginBuffer(settings.LAST_LOGIN_FLUSH_SECONDS, settings.LAST_LOGIN_FLUSH_SIZE)
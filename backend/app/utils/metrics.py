@@ -0,0 +1,256 @@
+"""
+In-process metrics with Prometheus text exposition, served at /api/metrics.
+
+Instruments are module-level objects so any module can record into them:
+
+    from app.utils.metrics import JWT_DECODE_SECONDS
+    with JWT_DECODE_SECONDS.time():
+        ...
+"""
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        lines = self.header()
+        for key, state in items:
+            for bound, count in zip(self.buckets, state):
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {state[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {state[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        # Callbacks returning {name: value} for point-in-time gauges
+        self._collectors: List[Tuple[str, Callable[[], Dict[str, float]]]] = []
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, prefix: str, collect: Callable[[], Dict[str, float]]):
+        """Expose the numeric values returned by `collect()` as gauges named `<prefix>_<key>`."""
+        self._collectors.append((prefix, collect))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, collect in self._collectors:
+            for key, value in collect().items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"{prefix}_{key}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Registry()
+
+HTTP_REQUESTS = metrics.counter(
+    "drs_http_requests_total", "HTTP requests handled", ("method", "route", "status"))
+HTTP_LATENCY = metrics.histogram(
+    "drs_http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+HTTP_DB_QUERIES = metrics.histogram(
+    "drs_http_request_db_queries", "Database queries issued per request", ("method", "route"),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100))
+HTTP_DB_SECONDS = metrics.histogram(
+    "drs_http_request_db_seconds", "Database time spent per request", ("method", "route"))
+DB_QUERY_SECONDS = metrics.histogram(
+    "drs_db_query_duration_seconds", "Database query latency", ("operation",))
+BCRYPT_SECONDS = metrics.histogram(
+    "drs_bcrypt_duration_seconds", "bcrypt hash/verify time on the worker pool", ("operation",),
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.0, 5.0))
+BCRYPT_WAIT_SECONDS = metrics.histogram(
+    "drs_bcrypt_queue_wait_seconds", "Time spent waiting for a bcrypt worker slot")
+SMTP_SEND_SECONDS = metrics.histogram(
+    "drs_smtp_send_duration_seconds", "SMTP send time per message", ("result",))
+JWT_DECODE_SECONDS = metrics.histogram(
+    "drs_jwt_decode_duration_seconds", "JWT decode and verification time",
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01))
+
+
+# Per-request database accounting: [query count, seconds]
+_request_db: ContextVar[Optional[List]] = ContextVar("request_db", default=None)
+# Set while a query is being timed so nested client calls are counted once
+_in_db_call: ContextVar[bool] = ContextVar("in_db_call", default=False)
+
+# Called as listener(operation, query, start, duration) for each query timed
+# in the current context; set by the request profiler
+db_query_listener: ContextVar[Optional[Callable]] = ContextVar("db_query_listener", default=None)
+
+_DB_METHODS = ("execute_query", "execute_query_dict", "execute_insert", "execute_many", "execute_script")
+
+
+def _wrap_db_method(operation: str, method):
+    @functools.wraps(method)
+    async def wrapper(self, query, *args, **kwargs):
+        if _in_db_call.get():
+            return await method(self, query, *args, **kwargs)
+        token = _in_db_call.set(True)
+        start = time.perf_counter()
+        try:
+            return await method(self, query, *args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            _in_db_call.reset(token)
+            DB_QUERY_SECONDS.observe(duration, operation=operation)
+            stats = _request_db.get()
+            if stats is not None:
+                stats[0] += 1
+                stats[1] += duration
+            listener = db_query_listener.get()
+            if listener is not None:
+                listener(operation, query, start, duration)
+    wrapper._drs_instrumented = True
+    return wrapper
+
+
+def instrument_tortoise():
+    """Time every query issued through any Tortoise client class, including transaction wrappers."""
+    from tortoise.backends.base.client import BaseDBAsyncClient
+
+    pending = [BaseDBAsyncClient]
+    seen = set()
+    while pending:
+        cls = pending.pop()
+        if cls in seen:
+            continue
+        seen.add(cls)
+        pending.extend(cls.__subclasses__())
+        for name in _DB_METHODS:
+            method = cls.__dict__.get(name)
+            if method is not None and not getattr(method, "_drs_instrumented", False):
+                setattr(cls, name, _wrap_db_method(name, method))
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request count, latency and DB usage per route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        db_stats = [0, 0.0]
+        token = _request_db.set(db_stats)
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            _request_db.reset(token)
+            route = scope.get("route")
+            # Unmatched paths share one label so random URLs can't blow up cardinality
+            route_label = getattr(route, "path", None) or "unmatched"
+            method = scope.get("method", "")
+            HTTP_REQUESTS.inc(method=method, route=route_label, status=str(status_code))
+            HTTP_LATENCY.observe(duration, method=method, route=route_label)
+            HTTP_DB_QUERIES.observe(db_stats[0], method=method, route=route_label)
+            HTTP_DB_SECONDS.observe(db_stats[1], method=method, route=route_label)
@@ -0,0 +1,86 @@
+"""
+Coupon state changes done as one conditional statement each
+(UPDATE/DELETE ... WHERE user_id AND id ... RETURNING), so checking the
+owner, checking the current state and writing happen atomically in a
+single round trip, for one coupon or a whole list.
+
+Run them inside the transaction that also updates the summary and the
+coupon version, and feed the returned rows to the record_* helpers.
+Archived coupons still count in the summary, so deleting one from
+coupon_archive is recorded the same way.
+"""
+from collections import namedtuple
+from datetime import datetime
+from typing import List, Sequence, Tuple
+
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+from app.models import Coupon
+from app.utils.serializers import COUPON_FIELDS
+from app.utils.sql import is_postgres, param, params
+
+# COUPON_FIELDS first, so rows also work with coupon_row_to_dict; user_id
+# is there for the summary helpers
+CouponRow = namedtuple("CouponRow", COUPON_FIELDS + ("user_id",))
+
+_RETURNING = ", ".join(f'"{column}"' for column in CouponRow._fields)
+
+
+def _id_condition(connection: BaseDBAsyncClient, ids: Sequence, start: int) -> Tuple[str, list]:
+    if is_postgres(connection):
+        return f'"id" = ANY({param(connection, start)}::uuid[])', [list(ids)]
+    return f'"id" IN ({params(connection, len(ids), start=start)})', [str(coupon_id) for coupon_id in ids]
+
+
+def _to_rows(rows) -> List[CouponRow]:
+    # asyncpg already returns Python types; SQLite hands back text and ints
+    fields = [Coupon._meta.fields_map[name] for name in CouponRow._fields]
+    return [
+        CouponRow(*(field.to_python_value(value) for field, value in zip(fields, row)))
+        for row in rows
+    ]
+
+
+async def mark_coupons_used(
+    connection: BaseDBAsyncClient, user_id, ids: Sequence, used_at: datetime
+) -> List[CouponRow]:
+    """Redeem the user's unused coupons among `ids`. Returns only the rows this call changed."""
+    if not ids:
+        return []
+    condition, id_values = _id_condition(connection, ids, start=3)
+    values = [used_at, user_id] if is_postgres(connection) else [used_at.isoformat(" "), str(user_id)]
+    _, rows = await connection.execute_query(
+        f"""
+        UPDATE "coupon" SET "is_used" = TRUE, "used_at" = {param(connection, 1)}
+        WHERE "user_id" = {param(connection, 2)} AND {condition} AND NOT "is_used"
+        RETURNING {_RETURNING}
+        """,
+        values + id_values,
+    )
+    return _to_rows(rows)
+
+
+async def delete_coupons(connection: BaseDBAsyncClient, user_id, ids: Sequence) -> List[CouponRow]:
+    """
+    Delete the user's coupons among `ids`, archived ones included. Returns
+    the deleted rows as they were.
+    """
+    deleted: List[CouponRow] = []
+    values = [user_id] if is_postgres(connection) else [str(user_id)]
+    remaining = list(ids)
+    for table in ("coupon", "coupon_archive"):
+        if not remaining:
+            break
+        condition, id_values = _id_condition(connection, remaining, start=2)
+        _, rows = await connection.execute_query(
+            f"""
+            DELETE FROM "{table}"
+            WHERE "user_id" = {param(connection, 1)} AND {condition}
+            RETURNING {_RETURNING}
+            """,
+            values + id_values,
+        )
+        deleted.extend(_to_rows(rows))
+        found = {row.id for row in deleted}
+        remaining = [coupon_id for coupon_id in remaining if coupon_id not in found]
+    return deleted
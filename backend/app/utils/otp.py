@@ -0,0 +1,149 @@
+"""
+One-time codes for email verification and password reset, kept in the
+otp_code table instead of on the user row. Issuing, checking and consuming
+a code never writes to `user`; expired codes are deleted in batches by
+`otp_sweeper`, started from the app lifespan.
+"""
+import asyncio
+import hmac
+import secrets
+import string
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from tortoise import Tortoise
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.expressions import F
+
+from app.config import settings
+from app.models import OtpCode
+from app.utils.logger import MaskedEmail, logger
+from app.utils.sql import is_postgres, params
+
+PURPOSE_VERIFY = "verify"
+PURPOSE_RESET = "reset"
+
+# check_otp results
+OTP_VALID = "valid"
+OTP_MISSING = "missing"
+OTP_EXPIRED = "expired"
+OTP_INVALID = "invalid"
+OTP_LOCKED = "locked"
+
+
+def _naive_utc(value: datetime) -> datetime:
+    # Postgres hands back aware datetimes, SQLite naive ones; compare as naive UTC
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def generate_code(length: int = 6) -> str:
+    return "".join(secrets.choice(string.digits) for _ in range(length))
+
+
+async def issue_otp(email: str, purpose: str, connection: Optional[BaseDBAsyncClient] = None) -> str:
+    """Create (or replace) the code for `email` and `purpose` and return it. Resets the attempt count."""
+    code = generate_code()
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=settings.OTP_TTL_SECONDS)
+    # Pass the caller's transaction to issue the code atomically with other writes
+    connection = connection or Tortoise.get_connection("default")
+    values = [email, purpose, code, now, expires_at]
+    if not is_postgres(connection):
+        # Same text format Tortoise uses for SQLite datetimes, so comparisons line up
+        values = [email, purpose, code, now.isoformat(" "), expires_at.isoformat(" ")]
+    await connection.execute_query(
+        f"""
+        INSERT INTO "otp_code" ("email", "purpose", "code", "attempts", "created_at", "expires_at")
+        VALUES ({params(connection, 3)}, 0, {params(connection, 2, start=4)})
+        ON CONFLICT ("email", "purpose") DO UPDATE SET
+            "code" = excluded."code",
+            "attempts" = 0,
+            "created_at" = excluded."created_at",
+            "expires_at" = excluded."expires_at"
+        """,
+        values,
+    )
+    logger.info("OTP generated for user %s", MaskedEmail(email))
+    return code
+
+
+async def check_otp(email: str, purpose: str, code: str) -> str:
+    """
+    Check `code` and consume it if it matches. Returns one of the OTP_*
+    results; a wrong code counts as an attempt, and after OTP_MAX_ATTEMPTS
+    the code is locked until a new one is issued.
+    """
+    row = await OtpCode.get_or_none(email=email, purpose=purpose)
+    if row is None:
+        return OTP_MISSING
+    if _naive_utc(row.expires_at) <= datetime.utcnow():
+        return OTP_EXPIRED
+    if row.attempts >= settings.OTP_MAX_ATTEMPTS:
+        return OTP_LOCKED
+    if not hmac.compare_digest(row.code, code or ""):
+        await OtpCode.filter(id=row.id).update(attempts=F("attempts") + 1)
+        return OTP_INVALID
+    # Conditional delete: of two concurrent requests with the right code, one wins
+    deleted = await OtpCode.filter(id=row.id, code=row.code).delete()
+    return OTP_VALID if deleted else OTP_INVALID
+
+
+async def sweep_expired(batch_size: int) -> int:
+    """Delete expired codes in batches of `batch_size`. Returns the number deleted."""
+    total = 0
+    while True:
+        now = datetime.utcnow()
+        ids = await OtpCode.filter(expires_at__lte=now).limit(batch_size).values_list("id", flat=True)
+        if not ids:
+            break
+        total += await OtpCode.filter(id__in=ids).delete()
+        if len(ids) < batch_size:
+            break
+        # Let request handlers run between batches
+        await asyncio.sleep(0)
+    return total
+
+
+class OtpSweeper:
+    """Background task deleting expired codes every OTP_SWEEP_INTERVAL_SECONDS."""
+
+    def __init__(self, interval: float, batch_size: int):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.deleted = 0
+        self.runs = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                deleted = await sweep_expired(self.batch_size)
+            except Exception as e:
+                logger.warning("OTP sweep failed: %s", e)
+                continue
+            self.runs += 1
+            self.deleted += deleted
+            if deleted:
+                logger.info("Swept %s expired OTP code(s)", deleted)
+
+    def stats(self) -> dict:
+        return {"runs": self.runs, "deleted": self.deleted}
+
+
+otp_sweeper = OtpSweeper(settings.OTP_SWEEP_INTERVAL_SECONDS, settings.OTP_SWEEP_BATCH_SIZE)
@@ -0,0 +1,40 @@
+import base64
+import uuid
+from datetime import datetime
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, status
+from tortoise.expressions import Q
+
+
+def encode_cursor(scanned_at: datetime, coupon_id: uuid.UUID) -> str:
+    """Opaque cursor pointing just past the given (scanned_at, id) position."""
+    raw = f"{scanned_at.isoformat()}|{coupon_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        scanned_at, coupon_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        return datetime.fromisoformat(scanned_at), uuid.UUID(coupon_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+
+def after_position(scanned_at: datetime, coupon_id: uuid.UUID) -> Q:
+    """Filter for rows that come after (scanned_at, id) in (scanned_at DESC, id DESC) order."""
+    return Q(scanned_at__lt=scanned_at) | Q(scanned_at=scanned_at, id__lt=coupon_id)
+
+
+def after_cursor(cursor: Optional[str]) -> Optional[Q]:
+    """
+    Filter for rows that come after the cursor in (scanned_at DESC, id DESC)
+    order. Returns None when there is no cursor.
+    """
+    if not cursor:
+        return None
+    return after_position(*decode_cursor(cursor))
@@ -0,0 +1,128 @@
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+from passlib.hash import bcrypt
+
+from app.config import settings
+from app.utils.logger import logger
+from app.utils.metrics import BCRYPT_SECONDS, BCRYPT_WAIT_SECONDS
+
+
+# Module-level helpers so they can be pickled into a process pool
+def _hash_password(password: str, rounds: int) -> str:
+    return bcrypt.using(rounds=rounds).hash(password)
+
+
+def _verify_password(password: str, password_hash: str) -> bool:
+    return bcrypt.verify(password, password_hash)
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a dedicated worker pool so password hashing never blocks
+    the event loop. At most `max_concurrency` hashes run at once; further
+    callers wait their turn and are counted in `queue_depth`.
+    """
+
+    def __init__(self):
+        self.rounds = settings.BCRYPT_ROUNDS
+        self.executor_type = settings.PASSWORD_HASH_EXECUTOR
+        self.workers = settings.PASSWORD_HASH_WORKERS
+        self.max_concurrency = settings.PASSWORD_HASH_MAX_CONCURRENCY
+        self._executor: Optional[Executor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.queue_depth = 0
+        self.in_flight = 0
+        self.total_hashes = 0
+        self.total_verifies = 0
+        self.total_rehashes = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_type == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def _run(self, operation: str, func, *args):
+        semaphore = self._get_semaphore()
+        self.queue_depth += 1
+        try:
+            with BCRYPT_WAIT_SECONDS.time():
+                await semaphore.acquire()
+        finally:
+            # Leaves the queue whether we got a slot or were cancelled waiting
+            self.queue_depth -= 1
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            with BCRYPT_SECONDS.time(operation=operation):
+                return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self.in_flight -= 1
+            semaphore.release()
+
+    async def hash(self, password: str) -> str:
+        self.total_hashes += 1
+        return await self._run("hash", _hash_password, password, self.rounds)
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        self.total_verifies += 1
+        try:
+            return await self._run("verify", _verify_password, password, password_hash)
+        except ValueError:
+            # Malformed hash stored for the user
+            return False
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """
+        True if the hash was created with a lower cost than the configured
+        one. Never downgrades: passlib's needs_update() would also rehash
+        stronger hashes after BCRYPT_ROUNDS is lowered.
+        """
+        try:
+            return bcrypt.from_string(password_hash).rounds < self.rounds
+        except ValueError:
+            return False
+
+    async def verify_and_update(self, password: str, password_hash: str):
+        """
+        Verify a password and, if it was hashed with an outdated cost factor,
+        return a fresh hash to store. Returns (valid, new_hash_or_None).
+        """
+        if not await self.verify(password, password_hash):
+            return False, None
+        if not self.needs_rehash(password_hash):
+            return True, None
+        self.total_rehashes += 1
+        return True, await self.hash(password)
+
+    def stats(self) -> dict:
+        return {
+            "rounds": self.rounds,
+            "executor": self.executor_type,
+            "workers": self.workers,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "total_hashes": self.total_hashes,
+            "total_verifies": self.total_verifies,
+            "total_rehashes": self.total_rehashes,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self._semaphore = None
+
+
+password_hasher = PasswordHasher()
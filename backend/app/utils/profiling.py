@@ -0,0 +1,355 @@
+"""
+On-demand request profiling.
+
+ProfilingMiddleware profiles a request when it carries a valid
+X-Admin-Signature header, or at random for PROFILE_SAMPLE_RATE of requests.
+A profile records:
+
+- collapsed stacks ("frame;frame;frame count" lines, the input of
+  flamegraph.pl, speedscope and inferno), sampled from the event loop thread
+  every PROFILE_INTERVAL_MS while the request's task is the one running.
+  Samples taken while the request is awaiting (database, bcrypt pool, other
+  requests running) only count towards "samples", not "cpu_samples";
+- the request's database queries, with start offset and duration.
+
+Sampling stops after PROFILE_MAX_SECONDS ("truncated": true) so a slow
+request cannot hold one of the PROFILE_MAX_CONCURRENT slots for long. The
+SSE feed is never profiled: it stays open for as long as the client does.
+
+Profiles are JSON files in PROFILE_DIR, which keeps the newest
+PROFILE_MAX_RECORDINGS and is shared by all workers on the host. They are
+listed and fetched through /api/admin/profiles; a header-triggered request
+gets the id of its profile back in X-Profile-Id.
+
+The signature is "<expiry>.<hex>", the HMAC-SHA256 of the Unix expiry time
+under PROFILE_ADMIN_KEY. Make one with
+
+    python -m app.utils.profiling [ttl_seconds]
+"""
+import asyncio
+import hashlib
+import hmac
+import os
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import orjson
+
+from app.config import settings
+from app.utils.logger import logger
+from app.utils.metrics import db_query_listener
+
+ADMIN_HEADER = b"x-admin-signature"
+# Never profiled, whatever their headers: admin endpoints, and streams that
+# stay open for hours
+EXCLUDED_PREFIXES = ("/api/admin", "/api/coupons/events")
+SQL_MAX_LENGTH = 1000
+
+_PROFILE_ID = re.compile(r"^[0-9]{20}-[0-9]+-[0-9a-f]+$")
+
+# The running task of each event loop. Private, but present and kept up to
+# date by CPython 3.7 to 3.13 (the app runs on 3.9); StackSampler checks it
+# still works before relying on it.
+_current_tasks = getattr(asyncio.tasks, "_current_tasks", None)
+
+
+def _mac(key: str, expires: str) -> str:
+    return hmac.new(key.encode(), expires.encode(), hashlib.sha256).hexdigest()
+
+
+def sign_admin_token(ttl_seconds: int = 3600, key: Optional[str] = None) -> str:
+    expires = str(int(time.time()) + ttl_seconds)
+    return f"{expires}.{_mac(key or settings.PROFILE_ADMIN_KEY, expires)}"
+
+
+def admin_token_valid(token: Optional[str]) -> bool:
+    key = settings.PROFILE_ADMIN_KEY
+    if not key or not token:
+        return False
+    expires, _, mac = token.partition(".")
+    if not re.fullmatch(r"[0-9]+", expires) or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(mac, _mac(key, expires))
+
+
+class _Recording:
+    def __init__(self, start: float):
+        self.start = start
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.truncated = False
+        self.queries: List[dict] = []
+        self.queries_dropped = 0
+
+    def add_query(self, operation: str, query, start: float, duration: float):
+        if len(self.queries) >= settings.PROFILE_MAX_QUERIES:
+            self.queries_dropped += 1
+            return
+        self.queries.append({
+            "offset_ms": round((start - self.start) * 1000, 3),
+            "duration_ms": round(duration * 1000, 3),
+            "operation": operation,
+            "sql": str(query)[:SQL_MAX_LENGTH],
+        })
+
+
+class StackSampler:
+    """
+    One daemon thread that samples the event loop thread's stack while any
+    request is being profiled, and exits when none is.
+
+    A sample is credited to the request whose task is running on the loop.
+    If that cannot be told (see _current_tasks), every active profile gets
+    every loop sample and is marked "attributed": false.
+    """
+
+    def __init__(self, interval: float, max_seconds: float):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.attributed = True
+        self._recordings: Dict[asyncio.Task, _Recording] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._switch_interval: Optional[float] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._labels: Dict[object, str] = {}  # code object -> "module:function"
+        self.skipped = 0  # requests not profiled because PROFILE_MAX_CONCURRENT were
+
+    @property
+    def active(self) -> int:
+        return len(self._recordings)
+
+    def begin(self, task: asyncio.Task, recording: _Recording):
+        with self._lock:
+            self._recordings[task] = recording
+            self._loop = task.get_loop()
+            self._loop_thread_id = threading.get_ident()
+            # Called from inside `task`, so a working _current_tasks must say so
+            self.attributed = _current_tasks is not None and _current_tasks.get(self._loop) is task
+            if self._thread is None:
+                # The loop thread only gives up the GIL every switch interval
+                # (5ms by default) while it runs Python code; without this,
+                # samples would mostly land while it waits for I/O
+                self._switch_interval = sys.getswitchinterval()
+                sys.setswitchinterval(min(self._switch_interval, self.interval))
+                self._thread = threading.Thread(target=self._run, name="drs-profiler", daemon=True)
+                self._thread.start()
+
+    def end(self, task: asyncio.Task):
+        with self._lock:
+            self._recordings.pop(task, None)
+
+    def _label(self, frame) -> str:
+        code = frame.f_code
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{frame.f_globals.get('__name__', '?')}:{code.co_name}"
+        return label
+
+    def _collapse(self, frame) -> str:
+        labels = []
+        while frame is not None:
+            labels.append(self._label(frame))
+            frame = frame.f_back
+        return ";".join(reversed(labels))
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._recordings:
+                    sys.setswitchinterval(self._switch_interval)
+                    self._thread = None
+                    return
+                now = time.perf_counter()
+                for task, recording in list(self._recordings.items()):
+                    if now - recording.start > self.max_seconds:
+                        recording.truncated = True
+                        del self._recordings[task]
+                    else:
+                        recording.samples += 1
+                if self.attributed:
+                    recording = self._recordings.get(_current_tasks.get(self._loop))
+                    targets = [recording] if recording is not None else []
+                else:
+                    targets = list(self._recordings.values())
+                if not targets:
+                    continue
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is not None:
+                    stack = self._collapse(frame)
+                    for recording in targets:
+                        recording.stacks[stack] += 1
+
+
+class ProfileStore:
+    """Profiles as files in `directory`, newest `max_recordings` kept. Methods do blocking I/O."""
+
+    def __init__(self, directory: str, max_recordings: int):
+        self.directory = directory
+        self.max_recordings = max_recordings
+        self.recorded = 0
+        self.write_failures = 0
+
+    def _path(self, profile_id: str) -> str:
+        return os.path.join(self.directory, profile_id + ".json")
+
+    def _ids(self) -> List[str]:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        # Ids start with a nanosecond timestamp, so name order is age order
+        return sorted(name[:-5] for name in names if name.endswith(".json"))
+
+    def save(self, profile: dict):
+        path = self._path(profile["id"])
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                f.write(orjson.dumps(profile))
+            os.replace(path + ".tmp", path)
+            for profile_id in self._ids()[:-self.max_recordings]:
+                try:
+                    os.remove(self._path(profile_id))
+                except FileNotFoundError:
+                    pass  # another worker trimmed it first
+            self.recorded += 1
+        except OSError as e:
+            self.write_failures += 1
+            logger.warning("Failed to write profile %s: %s", profile["id"], e)
+
+    def get(self, profile_id: str) -> Optional[dict]:
+        if not _PROFILE_ID.match(profile_id):
+            return None
+        try:
+            with open(self._path(profile_id), "rb") as f:
+                return orjson.loads(f.read())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def list(self) -> List[dict]:
+        """Every profile without its stacks and queries, newest first."""
+        profiles = []
+        for profile_id in reversed(self._ids()):
+            profile = self.get(profile_id)
+            if profile is not None:
+                profile.pop("stacks", None)
+                profile.pop("queries", None)
+                profiles.append(profile)
+        return profiles
+
+
+def _new_profile_id() -> str:
+    return f"{time.time_ns():020d}-{os.getpid()}-{secrets.token_hex(4)}"
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope.get("headers", ()):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling signed or randomly sampled requests (see module docstring)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def _trigger(self, scope) -> Optional[str]:
+        if scope["type"] != "http" or scope["path"].startswith(EXCLUDED_PREFIXES):
+            return None
+        if admin_token_valid(_header(scope, ADMIN_HEADER)):
+            trigger = "header"
+        elif settings.PROFILE_SAMPLE_RATE > 0 and random.random() < settings.PROFILE_SAMPLE_RATE:
+            trigger = "sample"
+        else:
+            return None
+        # Sampling slows the whole worker down a little; cap how much of that there is
+        if stack_sampler.active >= settings.PROFILE_MAX_CONCURRENT:
+            stack_sampler.skipped += 1
+            return None
+        return trigger
+
+    async def __call__(self, scope, receive, send):
+        trigger = self._trigger(scope)
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = _new_profile_id()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if trigger == "header":
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"x-profile-id", profile_id.encode())
+                    ]
+            await send(message)
+
+        task = asyncio.current_task()
+        started_at = datetime.utcnow()
+        recording = _Recording(time.perf_counter())
+        stack_sampler.begin(task, recording)
+        token = db_query_listener.set(recording.add_query)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - recording.start
+            db_query_listener.reset(token)
+            stack_sampler.end(task)
+            route = scope.get("route")
+            profile = {
+                "id": profile_id,
+                "trigger": trigger,
+                "method": scope.get("method", ""),
+                # No query string: it can carry tokens (?token= on /events)
+                "path": scope["path"],
+                "route": getattr(route, "path", None),
+                "status": status_code,
+                "started_at": started_at.isoformat() + "Z",
+                "duration_ms": round(duration * 1000, 3),
+                "interval_ms": settings.PROFILE_INTERVAL_MS,
+                "samples": recording.samples,
+                "cpu_samples": sum(recording.stacks.values()),
+                "attributed": stack_sampler.attributed,
+                "truncated": recording.truncated,
+                "db_queries": len(recording.queries) + recording.queries_dropped,
+                "db_ms": round(sum(query["duration_ms"] for query in recording.queries), 3),
+                "queries": recording.queries,
+                "queries_dropped": recording.queries_dropped,
+                "stacks": "".join(f"{stack} {count}\n" for stack, count in recording.stacks.most_common()),
+            }
+            # Written off the event loop; the response has already been sent
+            asyncio.get_running_loop().run_in_executor(None, profile_store.save, profile)
+
+
+stack_sampler = StackSampler(settings.PROFILE_INTERVAL_MS / 1000, settings.PROFILE_MAX_SECONDS)
+profile_store = ProfileStore(settings.PROFILE_DIR, settings.PROFILE_MAX_RECORDINGS)
+
+
+def profiling_stats() -> dict:
+    return {
+        "active": stack_sampler.active,
+        "skipped": stack_sampler.skipped,
+        "recorded": profile_store.recorded,
+        "write_failures": profile_store.write_failures,
+    }
+
+
+if __name__ == "__main__":
+    if not settings.PROFILE_ADMIN_KEY:
+        sys.exit("PROFILE_ADMIN_KEY is not set")
+    print(sign_admin_token(int(sys.argv[1]) if len(sys.argv) > 1 else 3600))
@@ -0,0 +1,179 @@
+"""
+Token-bucket throttling for the auth endpoints that cost a bcrypt run or an
+SMTP send. Each request takes one token from a bucket keyed by client IP and
+one from a bucket keyed by email; an empty bucket means 429.
+
+Buckets live in process memory by default. With several workers each one
+keeps its own buckets, so the effective limit is multiplied by the worker
+count; set RATE_LIMIT_BACKEND=redis (and `pip install redis`) to share them.
+
+Behind a reverse proxy, client IPs come from X-Forwarded-For only if the
+proxy's address is listed in FORWARDED_ALLOW_IPS (passed to uvicorn by
+app.server). Otherwise every request appears to come from the proxy and
+the per-IP limits act as one global limit. docker-compose.yml gives the
+nginx container a fixed address for this.
+"""
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+
+from app.config import settings
+from app.utils.logger import logger
+
+
+def parse_rate(value: str) -> Tuple[float, float]:
+    """"10/60" -> (capacity 10, refill 10/60 tokens per second)."""
+    count, _, seconds = value.partition("/")
+    capacity = float(count)
+    return capacity, capacity / float(seconds or 1)
+
+
+class MemoryBackend:
+    """
+    Buckets in one OrderedDict per namespace, least recently touched first.
+    All buckets in a namespace refill at the same rate, so the front entry is
+    always the first to be full again; full buckets are dropped from the
+    front on every call (a full bucket and a missing one behave the same).
+    """
+
+    def __init__(self, maxsize: int = 100000):
+        self.maxsize = maxsize
+        self._namespaces: Dict[str, "OrderedDict[str, Tuple[float, float]]"] = {}
+
+    def _expire(self, buckets: OrderedDict, now: float, refill_time: float):
+        while buckets:
+            _, updated = next(iter(buckets.values()))
+            if now - updated < refill_time:
+                break
+            buckets.popitem(last=False)
+
+    async def consume(self, namespace: str, key: str, capacity: float, rate: float) -> float:
+        """Take one token. Returns 0 if allowed, else the seconds until one is available."""
+        now = time.monotonic()
+        buckets = self._namespaces.setdefault(namespace, OrderedDict())
+        self._expire(buckets, now, capacity / rate)
+        tokens, updated = buckets.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * rate)
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / rate
+        buckets[key] = (tokens, now)
+        while len(buckets) > self.maxsize:
+            buckets.popitem(last=False)
+        return retry_after
+
+    def size(self) -> int:
+        return sum(len(buckets) for buckets in self._namespaces.values())
+
+
+# Same algorithm as MemoryBackend.consume, run atomically inside Redis
+_REDIS_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return tostring(retry_after)
+"""
+
+
+class RedisBackend:
+    """Buckets shared by all workers, stored as Redis hashes that expire once full."""
+
+    def __init__(self, url: str, prefix: str = "drs:ratelimit:"):
+        # Optional dependency, only needed when this backend is selected
+        import redis.asyncio as redis
+
+        self.prefix = prefix
+        self._client = redis.from_url(url)
+        self._script = self._client.register_script(_REDIS_SCRIPT)
+
+    async def consume(self, namespace: str, key: str, capacity: float, rate: float) -> float:
+        result = await self._script(keys=[f"{self.prefix}{namespace}:{key}"], args=[capacity, rate, time.time()])
+        return float(result)
+
+    def size(self) -> int:
+        return 0
+
+
+class AuthRateLimiter:
+    """
+    Per-IP and per-email buckets for one group of endpoints ("signin" or
+    "email"). If the backend fails the request is let through: throttling
+    must never take login down with it.
+    """
+
+    def __init__(self, backend, rules: Dict[str, Dict[str, str]], enabled: bool = True):
+        self.backend = backend
+        self.enabled = enabled
+        self.rules = {
+            group: {scope: parse_rate(rate) for scope, rate in scopes.items()}
+            for group, scopes in rules.items()
+        }
+        self.allowed = 0
+        self.rejected = 0
+        self.backend_errors = 0
+
+    async def check(self, request: Request, group: str, email: Optional[str] = None):
+        """Raise HTTP 429 if the client IP or the email is over its limit for `group`."""
+        if not self.enabled:
+            return
+        keys = {"ip": request.client.host if request.client else "unknown"}
+        if email:
+            keys["email"] = email.strip().lower()
+        for scope, key in keys.items():
+            capacity, rate = self.rules[group][scope]
+            try:
+                retry_after = await self.backend.consume(f"{group}:{scope}", key, capacity, rate)
+            except Exception as e:
+                self.backend_errors += 1
+                logger.warning("Rate limit backend failed, allowing request: %s", e)
+                return
+            if retry_after > 0:
+                self.rejected += 1
+                logger.info("Rate limited %s request by %s: %s", group, scope, key)
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Too many requests. Please try again later.",
+                    headers={"Retry-After": str(math.ceil(retry_after))},
+                )
+        self.allowed += 1
+
+    def stats(self) -> dict:
+        return {
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "backend_errors": self.backend_errors,
+            "buckets": self.backend.size(),
+        }
+
+
+def _make_backend():
+    if settings.RATE_LIMIT_BACKEND == "redis":
+        return RedisBackend(settings.RATE_LIMIT_REDIS_URL)
+    return MemoryBackend(maxsize=settings.RATE_LIMIT_MAX_KEYS)
+
+
+auth_rate_limiter = AuthRateLimiter(
+    _make_backend(),
+    rules={
+        "signin": {"ip": settings.RATE_LIMIT_SIGNIN_PER_IP, "email": settings.RATE_LIMIT_SIGNIN_PER_EMAIL},
+        "email": {"ip": settings.RATE_LIMIT_EMAIL_PER_IP, "email": settings.RATE_LIMIT_EMAIL_PER_EMAIL},
+    },
+    enabled=settings.RATE_LIMIT_ENABLED,
+)
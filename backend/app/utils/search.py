@@ -0,0 +1,126 @@
+"""
+Barcode search within one user's coupons. Matches rank exact first, then
+prefix, then substring; ties go newest-first like the coupon list.
+
+Prefixes are searched as a range, q <= barcode < (q with its last character
+incremented), compared byte-wise. On Postgres that is the ~>=~ / ~<~ pair the
+(user_id, barcode varchar_pattern_ops) index serves; a LIKE 'q%' pattern
+would not do, since with the pattern bound as a parameter a generic plan
+cannot turn it into an index range. Substring matches use the pg_trgm GIN
+index. Both indexes are created by
+migrations/models/7_20250627090000_coupon_barcode_search.py. Trigrams need at
+least three characters, so shorter queries only match prefixes (and exact).
+
+Other backends (SQLite) have no trigram index: prefixes are the same range
+scan, on the (user_id, barcode) unique index, and substrings an instr()
+filter over the user's rows.
+"""
+from typing import List, Optional, Sequence, Tuple
+
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+from app.config import settings
+from app.models import Coupon
+from app.utils.serializers import COUPON_FIELDS
+from app.utils.sql import is_postgres
+
+RANK_EXACT = 0
+RANK_PREFIX = 1
+RANK_SUBSTRING = 2
+
+_COLUMNS = ", ".join(f'"{column}"' for column in COUPON_FIELDS)
+
+_MAX_CODE_POINT = 0x10FFFF
+_SURROGATES = range(0xD800, 0xE000)  # not valid in UTF-8 text
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _prefix_upper_bound(q: str) -> Optional[str]:
+    """
+    The smallest string above every string starting with `q`, in byte-wise
+    UTF-8 order (which is code point order), or None if there is none.
+    """
+    while q:
+        code_point = ord(q[-1]) + 1
+        if code_point in _SURROGATES:
+            code_point = _SURROGATES.stop
+        if code_point <= _MAX_CODE_POINT:
+            return q[:-1] + chr(code_point)
+        q = q[:-1]
+    return None
+
+
+class _Params:
+    """Collects bind values and hands out placeholders in the connection's dialect."""
+
+    def __init__(self, postgres: bool):
+        self.postgres = postgres
+        self.values: list = []
+
+    def __call__(self, value) -> str:
+        self.values.append(value)
+        return f"${len(self.values)}" if self.postgres else "?"
+
+
+def _table_query(table: str, p: _Params, user_id, q: str, substring: bool, used) -> str:
+    # SQLite placeholders are positional, so p() must be called in text order
+    exact = f'"barcode" = {p(q)}'
+    if p.postgres:
+        prefix = f"\"barcode\" LIKE {p(_escape_like(q) + '%')} ESCAPE '\\'"
+    else:
+        prefix = f'substr("barcode", 1, {p(len(q))}) = {p(q)}'
+    rank = f"CASE WHEN {exact} THEN {RANK_EXACT} WHEN {prefix} THEN {RANK_PREFIX} ELSE {RANK_SUBSTRING} END"
+    where = f'"user_id" = {p(user_id if p.postgres else str(user_id))}'
+    if substring:
+        if p.postgres:
+            where += f" AND \"barcode\" LIKE {p('%' + _escape_like(q) + '%')} ESCAPE '\\'"
+        else:
+            where += f' AND instr("barcode", {p(q)}) > 0'
+    else:
+        # Postgres: byte-wise operators, the ones varchar_pattern_ops indexes.
+        # SQLite compares byte-wise already.
+        gte, lt = ("~>=~", "~<~") if p.postgres else (">=", "<")
+        where += f' AND "barcode" {gte} {p(q)}'
+        upper = _prefix_upper_bound(q)
+        if upper is not None:
+            where += f' AND "barcode" {lt} {p(upper)}'
+    if used is not None:
+        where += f' AND "is_used" = {p(used)}'
+    return f'SELECT {_COLUMNS}, {rank} AS "rank" FROM "{table}" WHERE {where}'
+
+
+def _to_rows(rows) -> List[Tuple]:
+    # asyncpg already returns Python types; SQLite hands back text and ints
+    fields = [Coupon._meta.fields_map[name] for name in COUPON_FIELDS]
+    return [tuple(field.to_python_value(value) for field, value in zip(fields, row)) for row in rows]
+
+
+async def search_coupons(
+    connection: BaseDBAsyncClient,
+    user_id,
+    q: str,
+    limit: int,
+    offset: int = 0,
+    used=None,
+    include_archived: bool = False,
+) -> List[Tuple]:
+    """The user's coupons whose barcode contains `q`, best match first, as COUPON_FIELDS rows."""
+    p = _Params(is_postgres(connection))
+    substring = len(q) >= settings.COUPON_SEARCH_MIN_SUBSTRING_LENGTH
+    tables: Sequence[str] = ["coupon"]
+    # Everything in the archive is redeemed
+    if include_archived and used is not False:
+        tables = ["coupon", "coupon_archive"]
+    union = " UNION ALL ".join(_table_query(table, p, user_id, q, substring, used) for table in tables)
+    _, rows = await connection.execute_query(
+        f"""
+        SELECT {_COLUMNS} FROM ({union}) AS "matches"
+        ORDER BY "rank", "scanned_at" DESC, "id" DESC
+        LIMIT {p(limit)} OFFSET {p(offset)}
+        """,
+        p.values,
+    )
+    return _to_rows(rows)
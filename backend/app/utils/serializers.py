@@ -0,0 +1,31 @@
+from typing import Dict, Iterable, List, Tuple
+
+# Column order for values_list() fetches; must match coupon_row_to_dict
+COUPON_FIELDS = ("id", "barcode", "value", "currency", "is_used", "scanned_at", "used_at")
+
+
+def coupon_row_to_dict(row: Tuple) -> Dict:
+    """
+    Turn a COUPON_FIELDS tuple into the same JSON shape Coupon_Pydantic
+    produces. UUIDs and datetimes are left for orjson to encode natively;
+    decimals become floats like FastAPI's encoder does.
+    """
+    value = row[2]
+    return {
+        "id": row[0],
+        "barcode": row[1],
+        "value": None if value is None else float(value),
+        "currency": row[3],
+        "is_used": row[4],
+        "scanned_at": row[5],
+        "used_at": row[6],
+    }
+
+
+def coupon_to_row(coupon) -> Tuple:
+    """COUPON_FIELDS tuple of a Coupon instance."""
+    return tuple(getattr(coupon, field) for field in COUPON_FIELDS)
+
+
+def coupon_rows_to_dicts(rows: Iterable[Tuple]) -> List[Dict]:
+    return [coupon_row_to_dict(row) for row in rows]
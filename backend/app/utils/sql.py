@@ -0,0 +1,15 @@
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+
+def is_postgres(connection: BaseDBAsyncClient) -> bool:
+    return connection.capabilities.dialect == "postgres"
+
+
+def param(connection: BaseDBAsyncClient, index: int) -> str:
+    """Bind placeholder for the 1-based parameter `index` in the connection's dialect."""
+    return f"${index}" if is_postgres(connection) else "?"
+
+
+def params(connection: BaseDBAsyncClient, count: int, start: int = 1) -> str:
+    """Comma-separated placeholders for `count` parameters starting at `start`."""
+    return ", ".join(param(connection, i) for i in range(start, start + count))
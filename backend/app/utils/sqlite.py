@@ -0,0 +1,48 @@
+"""
+Tortoise engine for DB_ENGINE=sqlite, used on single-node and edge boxes.
+
+Tortoise's SQLite client already funnels every statement and transaction of
+a process through one connection guarded by a FIFO lock, so writes are
+serialized in arrival order. On top of that this engine:
+
+- starts transactions with BEGIN IMMEDIATE, so a transaction takes the write
+  lock up front (waiting up to SQLITE_BUSY_TIMEOUT_MS for other processes)
+  instead of failing with "database is locked" when it first writes;
+- runs PRAGMA optimize on close, keeping the query planner's statistics fresh.
+
+GET handlers read through a second, query_only connection to the same file
+(see read_replica in app.utils.db). In WAL mode it sees every committed
+write and is never blocked by the writer. Pragmas come from
+Settings.sqlite_pragmas; tables and indexes are created from the models at
+startup since the aerich migrations are Postgres-only.
+"""
+import sqlite3
+
+from tortoise.backends.base.client import TransactionContext
+from tortoise.backends.sqlite.client import SqliteClient, TransactionWrapper
+from tortoise.exceptions import TransactionManagementError
+
+
+class ImmediateTransactionWrapper(TransactionWrapper):
+    async def start(self) -> None:
+        try:
+            await self._connection.commit()
+            await self._connection.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as exc:
+            raise TransactionManagementError(exc)
+
+
+class WriterClient(SqliteClient):
+    def _in_transaction(self) -> TransactionContext:
+        return TransactionContext(ImmediateTransactionWrapper(self))
+
+    async def close(self) -> None:
+        if self._connection:
+            try:
+                await self._connection.execute("PRAGMA optimize")
+            except sqlite3.Error as e:
+                self.log.warning("PRAGMA optimize failed: %s", e)
+        await super().close()
+
+
+client_class = WriterClient
@@ -0,0 +1,221 @@
+"""
+Per-user coupon totals kept in the coupon_summary table.
+
+Every coupon write calls one of the record_* helpers with the connection of
+its transaction, so the summary commits or rolls back together with the
+coupon row. Archived coupons (app.utils.archive) keep counting. If the table
+ever drifts, rebuild it from the coupon tables:
+
+    python -m app.utils.summary verify
+    python -m app.utils.summary rebuild
+"""
+import sys
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from tortoise import Tortoise, run_async
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.transactions import in_transaction
+
+from app.models import Coupon, CouponSummary
+from app.utils.sql import is_postgres, param, params
+
+ZERO = Decimal("0")
+
+# (total_count, used_count, total_value, unused_value)
+Delta = Tuple[int, int, Decimal, Decimal]
+
+
+def _value(value) -> Decimal:
+    return ZERO if value is None else Decimal(str(value))
+
+
+async def _apply(connection: BaseDBAsyncClient, user_id, currency: str, delta: Delta):
+    total_count, used_count, total_value, unused_value = delta
+    if not (total_count or used_count or total_value or unused_value):
+        return
+    if is_postgres(connection):
+        values = [user_id, currency, total_count, used_count, total_value, unused_value]
+    else:
+        # SQLite stores decimals as text
+        values = [str(user_id), currency, total_count, used_count, str(total_value), str(unused_value)]
+    await connection.execute_query(
+        f"""
+        INSERT INTO "coupon_summary" ("user_id", "currency", "total_count", "used_count", "total_value", "unused_value")
+        VALUES ({params(connection, 6)})
+        ON CONFLICT ("user_id", "currency") DO UPDATE SET
+            "total_count" = "coupon_summary"."total_count" + excluded."total_count",
+            "used_count" = "coupon_summary"."used_count" + excluded."used_count",
+            "total_value" = "coupon_summary"."total_value" + excluded."total_value",
+            "unused_value" = "coupon_summary"."unused_value" + excluded."unused_value"
+        """,
+        values,
+    )
+
+
+async def record_created(connection: BaseDBAsyncClient, coupons: Iterable[Coupon]):
+    """Account for newly inserted coupons, grouped into one statement per (user, currency)."""
+    deltas: Dict[tuple, List] = defaultdict(lambda: [0, 0, ZERO, ZERO])
+    for coupon in coupons:
+        delta = deltas[(coupon.user_id, coupon.currency)]
+        value = _value(coupon.value)
+        delta[0] += 1
+        delta[2] += value
+        if coupon.is_used:
+            delta[1] += 1
+        else:
+            delta[3] += value
+    for (user_id, currency), delta in deltas.items():
+        await _apply(connection, user_id, currency, tuple(delta))
+
+
+async def record_used(connection: BaseDBAsyncClient, coupons: Iterable[Coupon]):
+    """Account for coupons that just went from unused to used."""
+    deltas: Dict[tuple, List] = defaultdict(lambda: [0, 0, ZERO, ZERO])
+    for coupon in coupons:
+        delta = deltas[(coupon.user_id, coupon.currency)]
+        delta[1] += 1
+        delta[3] -= _value(coupon.value)
+    for (user_id, currency), delta in deltas.items():
+        await _apply(connection, user_id, currency, tuple(delta))
+
+
+async def record_deleted(connection: BaseDBAsyncClient, coupons: Iterable[Coupon]):
+    """Account for deleted coupons, using their state at deletion time."""
+    deltas: Dict[tuple, List] = defaultdict(lambda: [0, 0, ZERO, ZERO])
+    for coupon in coupons:
+        delta = deltas[(coupon.user_id, coupon.currency)]
+        value = _value(coupon.value)
+        delta[0] -= 1
+        delta[2] -= value
+        if coupon.is_used:
+            delta[1] -= 1
+        else:
+            delta[3] -= value
+    for (user_id, currency), delta in deltas.items():
+        await _apply(connection, user_id, currency, tuple(delta))
+
+
+async def get_summary(user_id, connection: Optional[BaseDBAsyncClient] = None) -> List[dict]:
+    rows = CouponSummary.filter(user_id=user_id, total_count__gt=0).order_by("currency")
+    if connection is not None:
+        rows = rows.using_db(connection)
+    rows = await rows
+    return [
+        {
+            "currency": row.currency,
+            "total_count": row.total_count,
+            "used_count": row.used_count,
+            "unused_count": row.total_count - row.used_count,
+            "total_value": float(row.total_value),
+            "unused_value": float(row.unused_value),
+        }
+        for row in rows
+    ]
+
+
+async def compute_summaries(connection: BaseDBAsyncClient, user_id=None) -> Dict[tuple, Delta]:
+    """Aggregate the coupon and coupon_archive tables from scratch: {(user_id, currency): delta}."""
+    where, archive_where, values = "", "", []
+    if user_id is not None:
+        where = f'WHERE "user_id" = {param(connection, 1)}'
+        archive_where = f'WHERE "user_id" = {param(connection, 2)}'
+        values = [user_id if is_postgres(connection) else str(user_id)] * 2
+    rows = await connection.execute_query_dict(
+        f"""
+        SELECT "user_id", "currency",
+            COUNT(*) AS "total_count",
+            SUM(CASE WHEN "is_used" THEN 1 ELSE 0 END) AS "used_count",
+            COALESCE(SUM("value"), 0) AS "total_value",
+            COALESCE(SUM(CASE WHEN "is_used" THEN 0 ELSE "value" END), 0) AS "unused_value"
+        FROM (
+            SELECT "user_id", "currency", "is_used", "value" FROM "coupon" {where}
+            UNION ALL
+            SELECT "user_id", "currency", "is_used", "value" FROM "coupon_archive" {archive_where}
+        ) AS "coupons"
+        GROUP BY "user_id", "currency"
+        """,
+        values,
+    )
+    return {
+        (str(row["user_id"]), row["currency"]): (
+            int(row["total_count"]),
+            int(row["used_count"] or 0),
+            _value(row["total_value"]).quantize(Decimal("0.01")),
+            _value(row["unused_value"]).quantize(Decimal("0.01")),
+        )
+        for row in rows
+    }
+
+
+async def rebuild_summaries(user_id=None) -> int:
+    """Recompute the summary table (for one user or everyone). Returns the number of rows written."""
+    async with in_transaction() as connection:
+        expected = await compute_summaries(connection, user_id)
+        stale = CouponSummary.all()
+        if user_id is not None:
+            stale = stale.filter(user_id=user_id)
+        await stale.delete()
+        await CouponSummary.bulk_create([
+            CouponSummary(
+                user_id=uuid.UUID(key[0]),
+                currency=key[1],
+                total_count=delta[0],
+                used_count=delta[1],
+                total_value=delta[2],
+                unused_value=delta[3],
+            )
+            for key, delta in expected.items()
+        ])
+    return len(expected)
+
+
+async def verify_summaries(user_id=None) -> List[dict]:
+    """Compare the summary table against the coupon tables and return the mismatches."""
+    connection = Tortoise.get_connection("default")
+    expected = await compute_summaries(connection, user_id)
+    stored_rows = CouponSummary.all()
+    if user_id is not None:
+        stored_rows = stored_rows.filter(user_id=user_id)
+    stored = {
+        (str(row.user_id), row.currency): (row.total_count, row.used_count, row.total_value, row.unused_value)
+        for row in await stored_rows
+        if row.total_count
+    }
+    mismatches = []
+    for key in sorted(set(expected) | set(stored)):
+        if expected.get(key) != stored.get(key):
+            mismatches.append({
+                "user_id": key[0],
+                "currency": key[1],
+                "expected": expected.get(key),
+                "stored": stored.get(key),
+            })
+    return mismatches
+
+
+async def _main(command: str, user_id: Optional[str]):
+    from app.config import settings
+    await Tortoise.init(config=settings.database_config)
+    try:
+        if command == "rebuild":
+            count = await rebuild_summaries(user_id)
+            print(f"Rebuilt {count} summary row(s).")
+        else:
+            mismatches = await verify_summaries(user_id)
+            for mismatch in mismatches:
+                print(f"Mismatch: {mismatch}")
+            print(f"{len(mismatches)} mismatch(es) found.")
+            if mismatches:
+                sys.exit(1)
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("rebuild", "verify"):
+        print("Usage: python -m app.utils.summary rebuild|verify [user_id]")
+        sys.exit(2)
+    run_async(_main(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None))
@@ -0,0 +1,28 @@
+from typing import Optional
+
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+from app.models import CouponVersion
+from app.utils.db import read_replica
+from app.utils.sql import is_postgres, param
+
+
+async def bump_coupon_version(connection: BaseDBAsyncClient, user_id):
+    """Advance the user's coupon version; call inside the write's transaction."""
+    # Every coupon write lands here, so it is also where the user's reads get pinned to the primary
+    read_replica.pin(str(user_id))
+    await connection.execute_query(
+        f"""
+        INSERT INTO "coupon_version" ("user_id", "version") VALUES ({param(connection, 1)}, 1)
+        ON CONFLICT ("user_id") DO UPDATE SET "version" = "coupon_version"."version" + 1
+        """,
+        [user_id if is_postgres(connection) else str(user_id)],
+    )
+
+
+async def get_coupon_version(user_id, connection: Optional[BaseDBAsyncClient] = None) -> int:
+    queryset = CouponVersion.filter(user_id=user_id)
+    if connection is not None:
+        queryset = queryset.using_db(connection)
+    versions = await queryset.values_list("version", flat=True)
+    return versions[0] if versions else 0
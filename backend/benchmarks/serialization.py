@@ -0,0 +1,89 @@
+"""
+Micro-benchmark: coupon list serialization, ORM + Pydantic path vs the
+values_list + orjson path used by GET /api/coupons/.
+
+Runs against an in-memory SQLite database, so no server is needed:
+
+    python -m benchmarks.serialization --rows 5000 --repeat 20
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from tortoise import Tortoise
+
+
+async def _seed(rows: int):
+    from app.models import Coupon, User
+    user = await User.create(id=uuid.uuid4(), email="bench@example.com", is_verified=True)
+    now = datetime.utcnow()
+    await Coupon.bulk_create([
+        Coupon(
+            id=uuid.uuid4(),
+            barcode=f"{i:013d}",
+            value=Decimal("0.15") if i % 3 else None,
+            currency="EUR",
+            user=user,
+            is_used=bool(i % 2),
+            scanned_at=now - timedelta(seconds=i),
+            used_at=now if i % 2 else None,
+        )
+        for i in range(rows)
+    ])
+    return user
+
+
+async def _pydantic_path(user_id) -> bytes:
+    from app.models import Coupon, Coupon_Pydantic
+    queryset = Coupon.filter(user_id=user_id).order_by("-scanned_at", "-id")
+    result = await Coupon_Pydantic.from_queryset(queryset)
+    return JSONResponse(jsonable_encoder(result)).body
+
+
+async def _fast_path(user_id) -> bytes:
+    from app.models import Coupon
+    from app.utils.serializers import COUPON_FIELDS, coupon_rows_to_dicts
+    queryset = Coupon.filter(user_id=user_id).order_by("-scanned_at", "-id")
+    rows = await queryset.values_list(*COUPON_FIELDS)
+    return ORJSONResponse(coupon_rows_to_dicts(rows)).body
+
+
+async def _time(func, user_id, repeat: int):
+    timings = []
+    body = b""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = await func(user_id)
+        timings.append((time.perf_counter() - start) * 1000)
+    return body, timings
+
+
+async def main(rows: int, repeat: int):
+    await Tortoise.init(db_url="sqlite://:memory:", modules={"models": ["app.models"]})
+    await Tortoise.generate_schemas()
+    try:
+        user = await _seed(rows)
+        current, current_ms = await _time(_pydantic_path, user.id, repeat)
+        fast, fast_ms = await _time(_fast_path, user.id, repeat)
+        if current != fast:
+            raise SystemExit("Wire format mismatch between the two paths")
+        print(f"{rows} coupons, {repeat} runs, identical output ({len(fast)} bytes)")
+        for name, timings in (("pydantic", current_ms), ("orjson", fast_ms)):
+            print(f"  {name:9s} median {statistics.median(timings):8.2f} ms   min {min(timings):8.2f} ms")
+        print(f"  speedup   {statistics.median(current_ms) / statistics.median(fast_ms):.1f}x")
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.repeat))
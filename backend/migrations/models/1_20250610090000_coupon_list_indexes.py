@@ -0,0 +1,13 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE INDEX IF NOT EXISTS "idx_coupon_user_used_scanned" ON "coupon" ("user_id", "is_used", "scanned_at", "id");
+CREATE INDEX IF NOT EXISTS "idx_coupon_user_scanned" ON "coupon" ("user_id", "scanned_at", "id");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX IF EXISTS "idx_coupon_user_used_scanned";
+DROP INDEX IF EXISTS "idx_coupon_user_scanned";"""
@@ -0,0 +1,30 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "coupon_summary" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "currency" VARCHAR(3) NOT NULL,
+    "total_count" INT NOT NULL DEFAULT 0,
+    "used_count" INT NOT NULL DEFAULT 0,
+    "total_value" DECIMAL(12,2) NOT NULL DEFAULT 0,
+    "unused_value" DECIMAL(12,2) NOT NULL DEFAULT 0,
+    "user_id" UUID NOT NULL REFERENCES "user" ("id") ON DELETE CASCADE,
+    CONSTRAINT "uid_coupon_summ_user_id_67c80a" UNIQUE ("user_id", "currency")
+);
+COMMENT ON TABLE "coupon_summary" IS 'Per-user, per-currency coupon totals, updated with every coupon write';
+INSERT INTO "coupon_summary" ("user_id", "currency", "total_count", "used_count", "total_value", "unused_value")
+SELECT "user_id", "currency",
+    COUNT(*),
+    SUM(CASE WHEN "is_used" THEN 1 ELSE 0 END),
+    COALESCE(SUM("value"), 0),
+    COALESCE(SUM(CASE WHEN "is_used" THEN 0 ELSE "value" END), 0)
+FROM "coupon"
+GROUP BY "user_id", "currency"
+ON CONFLICT ("user_id", "currency") DO NOTHING;"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "coupon_summary";"""
@@ -0,0 +1,50 @@
+from tortoise import BaseDBAsyncClient
+
+# Every copy of a (user_id, barcode) but the one kept: the redeemed copy if
+# there is one, otherwise the earliest scan
+_DUPLICATE_IDS = """
+    SELECT "id" FROM (
+        SELECT "id", ROW_NUMBER() OVER (
+            PARTITION BY "user_id", "barcode"
+            ORDER BY "is_used" DESC, "scanned_at" ASC, "id" ASC
+        ) AS "rank"
+        FROM "coupon"
+    ) AS "ranked"
+    WHERE "rank" > 1"""
+
+_COLUMNS = '"id", "barcode", "value", "currency", "user_id", "is_used", "scanned_at", "used_at"'
+
+_RECOUNT_SUMMARY = """
+DELETE FROM "coupon_summary";
+INSERT INTO "coupon_summary" ("user_id", "currency", "total_count", "used_count", "total_value", "unused_value")
+SELECT "user_id", "currency",
+    COUNT(*),
+    SUM(CASE WHEN "is_used" THEN 1 ELSE 0 END),
+    COALESCE(SUM("value"), 0),
+    COALESCE(SUM(CASE WHEN "is_used" THEN 0 ELSE "value" END), 0)
+FROM "coupon"
+GROUP BY "user_id", "currency";"""
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    # Existing duplicate scans are moved to "coupon_duplicate" rather than
+    # deleted, so their used flags, values and dates can still be looked at
+    # (and the downgrade puts them back). Drop that table once nobody needs it.
+    rows = await db.execute_query_dict(f'SELECT COUNT(*) AS "count" FROM ({_DUPLICATE_IDS}) AS "duplicates"')
+    print(f"Moving {rows[0]['count']} duplicate coupon scan(s) to coupon_duplicate")
+    return f"""
+        CREATE TABLE IF NOT EXISTS "coupon_duplicate" AS
+SELECT {_COLUMNS}, NOW() AS "removed_at" FROM "coupon" WHERE "id" IN ({_DUPLICATE_IDS}
+);
+DELETE FROM "coupon" WHERE "id" IN (SELECT "id" FROM "coupon_duplicate");{_RECOUNT_SUMMARY}
+ALTER TABLE "coupon" ADD CONSTRAINT "uid_coupon_user_id_9ffb1a" UNIQUE ("user_id", "barcode");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return f"""
+        ALTER TABLE "coupon" DROP CONSTRAINT IF EXISTS "uid_coupon_user_id_9ffb1a";
+INSERT INTO "coupon" ({_COLUMNS})
+SELECT {_COLUMNS} FROM "coupon_duplicate"
+WHERE "user_id" IN (SELECT "id" FROM "user")
+ON CONFLICT ("id") DO NOTHING;
+DROP TABLE IF EXISTS "coupon_duplicate";{_RECOUNT_SUMMARY}"""
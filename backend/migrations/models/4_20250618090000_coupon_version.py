@@ -0,0 +1,16 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "coupon_version" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "version" BIGINT NOT NULL DEFAULT 0,
+    "user_id" UUID NOT NULL UNIQUE REFERENCES "user" ("id") ON DELETE CASCADE
+);
+COMMENT ON TABLE "coupon_version" IS 'Per-user counter bumped by every coupon write, used for coupon list ETags';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "coupon_version";"""
@@ -0,0 +1,38 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    # Carry over codes that are still pending before dropping the user columns.
+    # The user row did not record a purpose: unverified users were waiting to
+    # verify their email, verified ones to reset their password.
+    return """
+        CREATE TABLE IF NOT EXISTS "otp_code" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "email" VARCHAR(255) NOT NULL,
+    "purpose" VARCHAR(16) NOT NULL,
+    "code" VARCHAR(6) NOT NULL,
+    "attempts" INT NOT NULL  DEFAULT 0,
+    "created_at" TIMESTAMPTZ NOT NULL,
+    "expires_at" TIMESTAMPTZ NOT NULL,
+    CONSTRAINT "uid_otp_code_email_eac81a" UNIQUE ("email", "purpose")
+);
+CREATE  INDEX IF NOT EXISTS "idx_otp_code_expires" ON "otp_code" ("expires_at");
+COMMENT ON TABLE "otp_code" IS 'One-time codes for email verification and password reset, deleted once used or expired';
+INSERT INTO "otp_code" ("email", "purpose", "code", "attempts", "created_at", "expires_at")
+SELECT "email", CASE WHEN "is_verified" THEN 'reset' ELSE 'verify' END, "otp", 0,
+       "otp_created_at", "otp_created_at" + INTERVAL '10 minutes'
+FROM "user"
+WHERE "otp" IS NOT NULL AND "otp_created_at" IS NOT NULL
+  AND "otp_created_at" > NOW() - INTERVAL '10 minutes';
+ALTER TABLE "user" DROP COLUMN IF EXISTS "otp";
+ALTER TABLE "user" DROP COLUMN IF EXISTS "otp_created_at";"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "user" ADD "otp" VARCHAR(6);
+ALTER TABLE "user" ADD "otp_created_at" TIMESTAMPTZ;
+UPDATE "user" SET "otp" = "otp_code"."code", "otp_created_at" = "otp_code"."created_at"
+FROM "otp_code"
+WHERE "otp_code"."email" = "user"."email";
+DROP TABLE IF EXISTS "otp_code";"""
@@ -0,0 +1,47 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    # Only creates the table: existing redeemed coupons are moved over in
+    # batches by the running app (app/utils/archive.py), not in this migration.
+    return """
+        CREATE TABLE IF NOT EXISTS "coupon_archive" (
+    "id" UUID NOT NULL  PRIMARY KEY,
+    "barcode" VARCHAR(255) NOT NULL,
+    "value" DECIMAL(10,2),
+    "currency" VARCHAR(3) NOT NULL  DEFAULT 'EUR',
+    "is_used" BOOL NOT NULL  DEFAULT True,
+    "scanned_at" TIMESTAMPTZ NOT NULL,
+    "used_at" TIMESTAMPTZ,
+    "archived_at" TIMESTAMPTZ NOT NULL,
+    "user_id" UUID NOT NULL REFERENCES "user" ("id") ON DELETE CASCADE
+);
+CREATE  INDEX IF NOT EXISTS "idx_coupon_archive_user_scanned" ON "coupon_archive" ("user_id", "scanned_at", "id");
+CREATE  INDEX IF NOT EXISTS "idx_coupon_archive_user_barcode" ON "coupon_archive" ("user_id", "barcode");
+COMMENT ON TABLE "coupon_archive" IS 'Redeemed coupons moved out of the coupon table by app.utils.archive; same columns plus archived_at';
+CREATE  INDEX IF NOT EXISTS "idx_coupon_used_at" ON "coupon" ("used_at");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    # Put archived coupons back before dropping the archive. An archived
+    # coupon whose barcode the user has scanned again since cannot go back
+    # under the unique (user_id, barcode) constraint; stop rather than drop it.
+    rows = await db.execute_query_dict(
+        """
+        SELECT COUNT(*) AS "count" FROM "coupon_archive" AS "archived"
+        JOIN "coupon" ON "coupon"."user_id" = "archived"."user_id"
+            AND "coupon"."barcode" = "archived"."barcode" AND "coupon"."id" <> "archived"."id"
+        """
+    )
+    if rows[0]["count"]:
+        raise RuntimeError(
+            f"{rows[0]['count']} archived coupon(s) share a user and barcode with a coupon in the coupon "
+            "table; delete or merge one of each pair before downgrading"
+        )
+    return """
+        INSERT INTO "coupon" ("id", "barcode", "value", "currency", "user_id", "is_used", "scanned_at", "used_at")
+SELECT "id", "barcode", "value", "currency", "user_id", "is_used", "scanned_at", "used_at"
+FROM "coupon_archive"
+ON CONFLICT ("id") DO NOTHING;
+DROP INDEX IF EXISTS "idx_coupon_used_at";
+DROP TABLE IF EXISTS "coupon_archive";"""
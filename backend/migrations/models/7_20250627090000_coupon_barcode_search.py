@@ -0,0 +1,22 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    # Indexes for GET /api/coupons/search (app/utils/search.py). They need
+    # operator classes Tortoise cannot declare, so they are not in the models.
+    # varchar_pattern_ops gives a btree in byte-wise order under any collation,
+    # for the ~>=~ / ~<~ prefix range; the trigram GIN index serves LIKE '%abc%'.
+    return """
+        CREATE EXTENSION IF NOT EXISTS "pg_trgm";
+CREATE INDEX IF NOT EXISTS "idx_coupon_user_barcode_prefix" ON "coupon" ("user_id", "barcode" varchar_pattern_ops);
+CREATE INDEX IF NOT EXISTS "idx_coupon_barcode_trgm" ON "coupon" USING GIN ("barcode" gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS "idx_coupon_archive_user_barcode_prefix" ON "coupon_archive" ("user_id", "barcode" varchar_pattern_ops);
+CREATE INDEX IF NOT EXISTS "idx_coupon_archive_barcode_trgm" ON "coupon_archive" USING GIN ("barcode" gin_trgm_ops);"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX IF EXISTS "idx_coupon_archive_barcode_trgm";
+DROP INDEX IF EXISTS "idx_coupon_archive_user_barcode_prefix";
+DROP INDEX IF EXISTS "idx_coupon_barcode_trgm";
+DROP INDEX IF EXISTS "idx_coupon_user_barcode_prefix";"""
@@ -0,0 +1,60 @@
+"""
+Tests run the app in-process against a throwaway SQLite database. Settings
+are read from the environment at import, so it is set up before any app
+module is imported.
+"""
+import os
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="drs-tests-")
+os.environ.update(
+    DB_ENGINE="sqlite",
+    SQLITE_PATH=os.path.join(_tmp, "test.sqlite3"),
+    BCRYPT_ROUNDS="4",
+    SMTP_HOST="127.0.0.1",
+    SMTP_PORT="9",  # nothing listens here; queued mail just fails in the background
+    SMTP_USE_TLS="0",
+    PROFILE_DIR=os.path.join(_tmp, "profiles"),
+    LOG_INFO_SAMPLE_RATE="0",
+)
+
+import httpx
+import pytest
+
+from app.main import app, lifespan
+from app.models import User
+from app.utils.ratelimit import MemoryBackend, auth_rate_limiter
+
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+async def started_app():
+    async with lifespan(app):
+        yield app
+
+
+@pytest.fixture(autouse=True)
+def fresh_rate_limits(monkeypatch):
+    # Every test signs users up from the same address; don't let them add up
+    monkeypatch.setattr(auth_rate_limiter, "backend", MemoryBackend())
+
+
+@pytest.fixture
+async def client(started_app):
+    transport = httpx.ASGITransport(app=started_app, client=("192.0.2.1", 1234))
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+async def signup_and_signin(client: httpx.AsyncClient, email: str, password: str = "password") -> dict:
+    """Create a verified user and return auth headers for it."""
+    response = await client.post("/api/auth/signup", json={"email": email, "password": password})
+    assert response.status_code == 201, response.text
+    await User.filter(email=email).update(is_verified=True)
+    response = await client.post("/api/auth/signin", json={"email": email, "password": password})
+    assert response.status_code == 200, response.text
+    return {"Authorization": "Bearer " + response.json()["access_token"]}
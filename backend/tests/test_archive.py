@@ -0,0 +1,93 @@
+import glob
+import importlib.util
+import os
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from tortoise import Tortoise
+
+from app.models import Coupon, CouponArchive, User
+from app.utils.archive import archive_used_coupons
+from tests.conftest import signup_and_signin
+
+pytestmark = pytest.mark.anyio
+
+
+async def _archived_coupon(client, headers, barcode: str) -> str:
+    response = await client.post("/api/coupons/", json={"barcode": barcode, "value": 0.25}, headers=headers)
+    coupon_id = response.json()["id"]
+    await client.put(f"/api/coupons/{coupon_id}/mark-used", headers=headers)
+    await archive_used_coupons(timedelta(0), batch_size=100)
+    assert not await Coupon.exists(id=coupon_id)
+    assert await CouponArchive.exists(id=coupon_id)
+    return coupon_id
+
+
+async def _summary_count(client, headers) -> int:
+    response = await client.get("/api/coupons/summary", headers=headers)
+    return sum(row["total_count"] for row in response.json()["currencies"])
+
+
+async def test_delete_archived_coupon(client):
+    headers = await signup_and_signin(client, "archive-delete@example.com")
+    coupon_id = await _archived_coupon(client, headers, "archived-1")
+    assert await _summary_count(client, headers) == 1
+
+    response = await client.delete(f"/api/coupons/{coupon_id}", headers=headers)
+    assert response.status_code == 204
+    assert not await CouponArchive.exists(id=coupon_id)
+    assert await _summary_count(client, headers) == 0
+
+    # The barcode no longer counts as a duplicate
+    response = await client.post("/api/coupons/", json={"barcode": "archived-1"}, headers=headers)
+    assert response.status_code == 200
+    assert "X-Duplicate" not in response.headers
+
+
+async def test_bulk_delete_includes_archived_coupons(client):
+    headers = await signup_and_signin(client, "archive-bulk@example.com")
+    archived_id = await _archived_coupon(client, headers, "archived-2")
+    response = await client.post("/api/coupons/", json={"barcode": "live-2"}, headers=headers)
+    live_id = response.json()["id"]
+
+    response = await client.post("/api/coupons/delete", json={"ids": [archived_id, live_id]}, headers=headers)
+    assert response.status_code == 200
+    assert sorted(response.json()["deleted"]) == sorted([archived_id, live_id])
+    assert response.json()["skipped"] == []
+    assert await _summary_count(client, headers) == 0
+
+
+async def test_cannot_delete_another_users_archived_coupon(client):
+    owner = await signup_and_signin(client, "archive-owner@example.com")
+    other = await signup_and_signin(client, "archive-other@example.com")
+    coupon_id = await _archived_coupon(client, owner, "archived-3")
+
+    response = await client.delete(f"/api/coupons/{coupon_id}", headers=other)
+    assert response.status_code == 404
+    assert await CouponArchive.exists(id=coupon_id)
+
+
+def _archive_migration():
+    path, = glob.glob(os.path.join(os.path.dirname(__file__), "..", "migrations", "models", "6_*.py"))
+    spec = importlib.util.spec_from_file_location("coupon_archive_migration", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+async def test_downgrade_refuses_to_drop_conflicting_archived_coupons(client):
+    headers = await signup_and_signin(client, "archive-downgrade@example.com")
+    await _archived_coupon(client, headers, "archived-4")
+    migration = _archive_migration()
+    connection = Tortoise.get_connection("default")
+    assert "INSERT INTO" in await migration.downgrade(connection)
+
+    # The same barcode in both tables, as after a rescan raced the archiver
+    user = await User.get(email="archive-downgrade@example.com")
+    live = await Coupon.create(id=uuid.uuid4(), barcode="archived-4", user=user, scanned_at=datetime.utcnow())
+    try:
+        with pytest.raises(RuntimeError, match="1 archived coupon"):
+            await migration.downgrade(connection)
+    finally:
+        await live.delete()
@@ -0,0 +1,119 @@
+from decimal import Decimal
+
+import pytest
+
+from app.utils.barcodes import DecodedBarcode, check_digit, decode_barcodes
+from tests.conftest import signup_and_signin
+
+pytestmark = pytest.mark.anyio
+
+OPAQUE = DecodedBarcode()
+GS = "\x1d"
+
+
+def test_check_digit():
+    assert check_digit("400638133393") == "1"
+    assert check_digit("0950110153000") == "3"
+
+
+@pytest.mark.parametrize("code, format", [
+    ("96385074", "ean8"),
+    ("036000291452", "upca"),
+    ("4006381333931", "ean13"),
+    ("00012345600012", "gtin14"),
+])
+def test_valid_gtins(code, format):
+    assert decode_barcodes([code]) == [DecodedBarcode(format)]
+
+
+@pytest.mark.parametrize("code", ["12345678", "123456789013", "1234567890123", "4006381333932", "00012345600013"])
+def test_invalid_check_digit_without_a_value_is_opaque(code):
+    assert decode_barcodes([code]) == [OPAQUE]
+
+
+def test_restricted_circulation_code_carries_its_value():
+    assert decode_barcodes(["2912345001506"]) == [DecodedBarcode("ean13", Decimal("1.50"), "EUR")]
+    assert decode_barcodes(["212345001509"]) == [DecodedBarcode("upca", Decimal("1.50"), "EUR")]
+
+
+def test_restricted_circulation_code_with_bad_check_digit_is_rejected():
+    # A misread digit would store a wrong amount
+    assert decode_barcodes(["2912345001507"]) == [DecodedBarcode("ean13", error="Invalid EAN-13 check digit")]
+
+
+@pytest.mark.parametrize("code, value, currency", [
+    ("(01)09501101530003(3922)250", Decimal("2.50"), "EUR"),
+    ("(01)09501101530003(3932)826125", Decimal("1.25"), "GBP"),
+    ("]C101095011015300033922250", Decimal("2.50"), "EUR"),
+    (f"0109501101530003{GS}3921025", Decimal("2.5"), "EUR"),
+    ("0109501101530003", None, None),
+    ("01095011015300033922250", Decimal("2.50"), "EUR"),
+])
+def test_gs1_128_element_strings(code, value, currency):
+    assert decode_barcodes([code]) == [DecodedBarcode("gs1-128", value, currency)]
+
+
+def test_gs1_128_check_digit():
+    # Marked as GS1: the GTIN must be right
+    assert decode_barcodes(["(01)09501101530004"]) == [
+        DecodedBarcode("gs1-128", error="Invalid GS1-128 GTIN check digit")
+    ]
+    # A long number that merely starts with 01 is someone else's code
+    assert decode_barcodes(["0109501101530004"]) == [OPAQUE]
+    assert decode_barcodes(["01095011015300031234"]) == [OPAQUE]
+
+
+@pytest.mark.parametrize("code", [
+    "٤٠٠٦٣٨١٣٣٣٩٣١",  # Arabic-Indic digits
+    "４００６３８１３３３９３１",  # fullwidth digits
+    "4006381333²31",
+    "(01)0950110153000³",
+    "(01)09501101530003(3922)٢٥٠",
+])
+def test_non_ascii_digits_are_opaque(code):
+    assert decode_barcodes([code]) == [OPAQUE]
+
+
+def test_mixed_batch_keeps_input_order():
+    codes = [
+        "4006381333931",
+        "https://example.com/qr",
+        "1234567890123",
+        "(01)09501101530003(3922)250",
+        "2912345001507",
+        "96385074",
+        "٤٠٠٦٣٨١٣٣٣٩٣١",
+        "2912345001506",
+        "",
+    ]
+    assert decode_barcodes(codes) == [
+        DecodedBarcode("ean13"),
+        OPAQUE,
+        OPAQUE,
+        DecodedBarcode("gs1-128", Decimal("2.50"), "EUR"),
+        DecodedBarcode("ean13", error="Invalid EAN-13 check digit"),
+        DecodedBarcode("ean8"),
+        OPAQUE,
+        DecodedBarcode("ean13", Decimal("1.50"), "EUR"),
+        OPAQUE,
+    ]
+
+
+async def test_scans_store_decoded_values_and_keep_other_numbers(client):
+    headers = await signup_and_signin(client, "barcodes@example.com")
+
+    response = await client.post("/api/coupons/", json={"barcode": "2912345001506"}, headers=headers)
+    assert response.status_code == 200
+    assert (Decimal(str(response.json()["value"])), response.json()["currency"]) == (Decimal("1.50"), "EUR")
+
+    response = await client.post("/api/coupons/", json={"barcode": "1234567890123"}, headers=headers)
+    assert response.status_code == 200
+
+    response = await client.post("/api/coupons/", json={"barcode": "2912345001507"}, headers=headers)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid EAN-13 check digit"
+
+    response = await client.post(
+        "/api/coupons/batch", json=[{"barcode": "12345678"}, {"barcode": "2912345001507"}], headers=headers
+    )
+    assert [item["status"] for item in response.json()["items"]] == ["created", "error"]
@@ -0,0 +1,50 @@
+import pytest
+
+from app.config import settings
+from tests.conftest import signup_and_signin
+
+pytestmark = pytest.mark.anyio
+
+INVALID = [
+    ({"barcode": ""}, "Barcode is empty"),
+    ({"barcode": "   "}, "Barcode is empty"),
+    ({"barcode": "x" * 256}, "Barcode is longer than 255 characters"),
+    ({"barcode": "long-currency", "currency": "EURO"}, "Currency must be a 3-letter code"),
+]
+
+
+@pytest.mark.parametrize("payload, error", INVALID)
+async def test_single_and_batch_create_reject_the_same_payloads(client, payload, error):
+    headers = await signup_and_signin(client, f"validate-{INVALID.index((payload, error))}@example.com")
+
+    response = await client.post("/api/coupons/", json=payload, headers=headers)
+    assert response.status_code == 400
+    assert response.json()["detail"] == error
+
+    response = await client.post("/api/coupons/batch", json=[payload], headers=headers)
+    assert response.status_code == 200
+    assert response.json()["items"] == [{"index": 0, "status": "error", "coupon": None, "error": error}]
+    assert (await client.get("/api/coupons/", headers=headers)).json() == []
+
+
+async def test_batch_reports_every_item(client):
+    headers = await signup_and_signin(client, "batch-items@example.com")
+    existing = (await client.post("/api/coupons/", json={"barcode": "batch-existing"}, headers=headers)).json()
+
+    response = await client.post(
+        "/api/coupons/batch",
+        json=[{"barcode": "batch-new"}, {"barcode": "batch-existing"}, {"barcode": ""}, {"barcode": "batch-new"}],
+        headers=headers,
+    )
+    result = response.json()
+    assert (result["created"], result["duplicates"], result["failed"]) == (1, 2, 1)
+    assert [item["status"] for item in result["items"]] == ["created", "duplicate", "error", "duplicate"]
+    assert result["items"][1]["coupon"]["id"] == existing["id"]
+    assert result["items"][3]["coupon"]["id"] == result["items"][0]["coupon"]["id"]
+
+
+async def test_batch_size_is_capped(client, monkeypatch):
+    headers = await signup_and_signin(client, "batch-cap@example.com")
+    monkeypatch.setattr(settings, "COUPON_BATCH_MAX_SIZE", 2)
+    response = await client.post("/api/coupons/batch", json=[{"barcode": f"cap-{i}"} for i in range(3)], headers=headers)
+    assert response.status_code == 413
@@ -0,0 +1,66 @@
+import uuid
+from datetime import datetime
+
+import pytest
+
+from app.models import Coupon, User
+from app.routes.coupons import recent_scans
+from tests.conftest import signup_and_signin
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_rescan_returns_existing_coupon(client):
+    headers = await signup_and_signin(client, "dup-rescan@example.com")
+    first = await client.post("/api/coupons/", json={"barcode": "dup-1", "value": 0.25}, headers=headers)
+    assert "X-Duplicate" not in first.headers
+
+    recent_scans.clear()
+    second = await client.post("/api/coupons/", json={"barcode": "dup-1", "value": 0.5}, headers=headers)
+    assert second.status_code == 200
+    assert second.headers["X-Duplicate"] == "true"
+    assert second.json() == first.json()
+    assert await Coupon.filter(barcode="dup-1").count() == 1
+
+
+async def test_unique_constraint_answers_a_concurrent_scan(client):
+    headers = await signup_and_signin(client, "dup-race@example.com")
+    user = await User.get(email="dup-race@example.com")
+    # Stored by another request after this one missed the recent-scan cache
+    existing = await Coupon.create(id=uuid.uuid4(), barcode="dup-race", user=user, scanned_at=datetime.utcnow())
+
+    response = await client.post("/api/coupons/", json={"barcode": "dup-race"}, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["X-Duplicate"] == "true"
+    assert response.json()["id"] == str(existing.id)
+    assert await Coupon.filter(user=user, barcode="dup-race").count() == 1
+
+
+async def test_repeat_scan_is_answered_from_the_cache(client):
+    headers = await signup_and_signin(client, "dup-cache@example.com")
+    first = await client.post("/api/coupons/", json={"barcode": "dup-cached"}, headers=headers)
+    # Gone from the database, but a scan moments later never gets that far
+    await Coupon.filter(id=first.json()["id"]).delete()
+
+    second = await client.post("/api/coupons/", json={"barcode": "dup-cached"}, headers=headers)
+    assert second.headers["X-Duplicate"] == "true"
+    assert second.json()["id"] == first.json()["id"]
+
+
+async def test_cache_is_per_user(client):
+    first_headers = await signup_and_signin(client, "dup-user-a@example.com")
+    second_headers = await signup_and_signin(client, "dup-user-b@example.com")
+    first = await client.post("/api/coupons/", json={"barcode": "dup-shared"}, headers=first_headers)
+    second = await client.post("/api/coupons/", json={"barcode": "dup-shared"}, headers=second_headers)
+    assert "X-Duplicate" not in second.headers
+    assert second.json()["id"] != first.json()["id"]
+
+
+async def test_redeeming_refreshes_the_cached_scan(client):
+    headers = await signup_and_signin(client, "dup-redeem@example.com")
+    coupon = (await client.post("/api/coupons/", json={"barcode": "dup-redeem"}, headers=headers)).json()
+    await client.put(f"/api/coupons/{coupon['id']}/mark-used", headers=headers)
+
+    response = await client.post("/api/coupons/", json={"barcode": "dup-redeem"}, headers=headers)
+    assert response.headers["X-Duplicate"] == "true"
+    assert response.json()["is_used"] is True
@@ -0,0 +1,124 @@
+import asyncio
+import smtplib
+
+import pytest
+
+from app.config import settings
+from app.utils import email
+from app.utils.email import EmailOutbox, email_outbox
+from app.utils.profiling import sign_admin_token
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeSMTP:
+    """Stands in for smtplib.SMTP; sendmail fails while `failures` is positive."""
+
+    connections = []
+    failures = 0
+
+    def __init__(self, host, port, timeout=None):
+        self.sent = []
+        self.closed = False
+        FakeSMTP.connections.append(self)
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def noop(self):
+        return (250, b"OK")
+
+    def sendmail(self, from_email, to_email, message):
+        if FakeSMTP.failures > 0:
+            FakeSMTP.failures -= 1
+            raise smtplib.SMTPDataError(451, b"Try again later")
+        self.sent.append(to_email)
+
+    def quit(self):
+        self.closed = True
+
+
+@pytest.fixture
+async def outbox(monkeypatch):
+    monkeypatch.setattr(email.smtplib, "SMTP", FakeSMTP)
+    FakeSMTP.connections = []
+    FakeSMTP.failures = 0
+    outbox = EmailOutbox()
+    outbox.workers = 1
+    outbox.retry_backoff = 0.01
+    outbox.start()
+    yield outbox
+    await outbox.stop(drain_timeout=1)
+
+
+async def wait_for_status(outbox: EmailOutbox, message_id: str, expected: str) -> dict:
+    for _ in range(200):
+        status = outbox.status(message_id)
+        if status["status"] == expected:
+            return status
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"message {message_id} is {status['status']}, not {expected}")
+
+
+async def test_connection_is_reused_across_messages(outbox):
+    ids = [outbox.enqueue(f"user{i}@example.com", "Subject", "Body") for i in range(3)]
+    for message_id in ids:
+        await wait_for_status(outbox, message_id, "sent")
+    assert len(FakeSMTP.connections) == 1
+    assert FakeSMTP.connections[0].sent == [f"user{i}@example.com" for i in range(3)]
+    assert outbox.stats()["sent"] == 3
+
+
+async def test_failed_message_is_retried_with_backoff(outbox):
+    FakeSMTP.failures = 2
+    message_id = outbox.enqueue("user@example.com", "Subject", "Body")
+    status = await wait_for_status(outbox, message_id, "sent")
+    assert status["attempts"] == 3
+    assert status["last_error"] is None
+    assert outbox.stats()["retries"] == 2
+    # A failed send drops the connection so the retry starts on a fresh one
+    assert len(FakeSMTP.connections) == 3
+    assert all(connection.closed for connection in FakeSMTP.connections[:2])
+
+
+async def test_message_fails_after_max_attempts(outbox):
+    FakeSMTP.failures = outbox.max_attempts
+    message_id = outbox.enqueue("user@example.com", "Subject", "Body")
+    status = await wait_for_status(outbox, message_id, "failed")
+    assert status["attempts"] == outbox.max_attempts
+    assert "Try again later" in status["last_error"]
+    assert outbox.stats()["failed"] == 1
+
+
+async def test_stop_retries_backed_off_mail_once(monkeypatch):
+    monkeypatch.setattr(email.smtplib, "SMTP", FakeSMTP)
+    FakeSMTP.connections = []
+    FakeSMTP.failures = 1
+    outbox = EmailOutbox()
+    outbox.workers = 1
+    outbox.retry_backoff = 60
+    outbox.start()
+    message_id = outbox.enqueue("user@example.com", "Subject", "Body")
+    await wait_for_status(outbox, message_id, "retrying")
+    await outbox.stop(drain_timeout=1)
+    assert outbox.status(message_id)["status"] == "sent"
+
+
+async def test_admin_can_look_up_delivery_state(client, monkeypatch):
+    monkeypatch.setattr(settings, "PROFILE_ADMIN_KEY", "test-admin-key")
+    headers = {"X-Admin-Signature": sign_admin_token(60)}
+    message_id = email_outbox.enqueue("lookup@example.com", "Subject", "Body")
+
+    response = await client.get(f"/api/admin/emails/{message_id}", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["id"] == message_id
+    assert response.json()["to"] == "lookup@example.com"
+
+    response = await client.get("/api/admin/emails", params={"limit": 1}, headers=headers)
+    assert [message["id"] for message in response.json()] == [message_id]
+
+    assert (await client.get("/api/admin/emails/unknown", headers=headers)).status_code == 404
+    assert (await client.get(f"/api/admin/emails/{message_id}")).status_code == 403
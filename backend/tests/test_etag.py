@@ -0,0 +1,97 @@
+from datetime import timedelta
+
+import pytest
+
+from app.config import settings
+from app.utils.archive import archive_used_coupons
+from tests.conftest import signup_and_signin
+
+pytestmark = pytest.mark.anyio
+
+
+async def _etag(client, headers) -> str:
+    response = await client.get("/api/coupons/", headers=headers)
+    assert response.status_code == 200
+    return response.headers["ETag"]
+
+
+async def _assert_unchanged(client, headers, etag: str):
+    response = await client.get("/api/coupons/", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.headers["Vary"] == "Accept-Encoding, Authorization"
+    assert response.content == b""
+
+
+async def test_unchanged_list_is_not_modified(client):
+    headers = await signup_and_signin(client, "etag-304@example.com")
+    etag = await _etag(client, headers)
+    await _assert_unchanged(client, headers, etag)
+    # Weak and strong forms of the tag, among others
+    response = await client.get("/api/coupons/", headers={**headers, "If-None-Match": f'"other", {etag[2:]}'})
+    assert response.status_code == 304
+
+    # Other query parameters are another representation
+    response = await client.get("/api/coupons/", params={"used": "true"}, headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+
+
+async def test_every_coupon_write_changes_the_etag(client):
+    headers = await signup_and_signin(client, "etag-writes@example.com")
+    etags = [await _etag(client, headers)]
+
+    async def changed():
+        etag = await _etag(client, headers)
+        assert etag not in etags
+        etags.append(etag)
+
+    first = (await client.post("/api/coupons/", json={"barcode": "etag-1"}, headers=headers)).json()
+    await changed()
+
+    # A duplicate scan writes nothing
+    await client.post("/api/coupons/", json={"barcode": "etag-1"}, headers=headers)
+    await _assert_unchanged(client, headers, etags[-1])
+
+    batch = (await client.post(
+        "/api/coupons/batch", json=[{"barcode": f"etag-batch-{i}"} for i in range(4)], headers=headers
+    )).json()
+    batch_ids = [item["coupon"]["id"] for item in batch["items"]]
+    await changed()
+
+    await client.put(f"/api/coupons/{first['id']}/mark-used", headers=headers)
+    await changed()
+
+    await client.post("/api/coupons/mark-used", json={"ids": batch_ids[:2]}, headers=headers)
+    await changed()
+
+    assert await archive_used_coupons(timedelta(0), batch_size=100) >= 3
+    await changed()
+
+    await client.delete(f"/api/coupons/{batch_ids[2]}", headers=headers)
+    await changed()
+
+    await client.post("/api/coupons/delete", json={"ids": [batch_ids[3], first["id"]]}, headers=headers)
+    await changed()
+
+
+async def test_large_lists_are_compressed(client):
+    headers = await signup_and_signin(client, "etag-gzip@example.com")
+    await client.post("/api/coupons/", json={"barcode": "gzip-small"}, headers=headers)
+    response = await client.get("/api/coupons/", headers={**headers, "Accept-Encoding": "gzip"})
+    assert len(response.content) < settings.COMPRESS_MIN_SIZE
+    assert "Content-Encoding" not in response.headers
+    assert response.headers["Vary"] == "Accept-Encoding, Authorization"
+
+    await client.post("/api/coupons/batch", json=[{"barcode": f"gzip-{i:03d}"} for i in range(20)], headers=headers)
+    response = await client.get("/api/coupons/", headers={**headers, "Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding, Authorization"
+    assert len(response.json()) == 21
+    assert response.num_bytes_downloaded < len(response.content)
+
+    # Not for clients that don't ask for it
+    response = await client.get("/api/coupons/", headers={**headers, "Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in response.headers
+    assert len(response.content) >= settings.COMPRESS_MIN_SIZE
+    response = await client.get("/api/coupons/", headers={**headers, "Accept-Encoding": "gzip;q=0"})
+    assert "Content-Encoding" not in response.headers
@@ -0,0 +1,161 @@
+import asyncio
+
+import orjson
+import pytest
+
+from app.models import User
+from app.utils.events import CLOSE, CouponEventBus, coupon_events
+from app.utils.versions import get_coupon_version
+from tests.conftest import signup_and_signin
+
+pytestmark = pytest.mark.anyio
+
+
+class EventStream:
+    """
+    GET /api/coupons/events driven straight on the ASGI app, since httpx's
+    ASGITransport waits for the whole body and this one never ends. Leaving
+    the block disconnects the client.
+    """
+
+    def __init__(self, app, headers: dict):
+        self.app = app
+        self.token = headers["Authorization"].split(" ", 1)[1]
+        self._body = asyncio.Queue()
+        self._buffer = b""
+        self._requested = False
+        self._disconnected = asyncio.Event()
+
+    async def __aenter__(self):
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": "/api/coupons/events",
+            "raw_path": b"/api/coupons/events",
+            "root_path": "",
+            "query_string": b"token=" + self.token.encode(),
+            "headers": [(b"host", b"test")],
+            "client": ("192.0.2.1", 1234),
+            "server": ("test", 80),
+        }
+        self.task = asyncio.create_task(self.app(scope, self._receive, self._send))
+        event, self.ready = await self.event()
+        assert event == "ready"
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._disconnected.set()
+        await asyncio.wait_for(self.task, 5)
+
+    async def _receive(self):
+        if not self._requested:
+            self._requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await self._disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def _send(self, message):
+        if message["type"] == "http.response.start":
+            assert message["status"] == 200
+        elif message["type"] == "http.response.body":
+            await self._body.put(message.get("body", b""))
+
+    async def event(self):
+        """The next (event, data), skipping the retry hint and heartbeats."""
+        while True:
+            while b"\n\n" not in self._buffer:
+                self._buffer += await asyncio.wait_for(self._body.get(), 5)
+            frame, self._buffer = self._buffer.split(b"\n\n", 1)
+            fields = dict(line.split(b": ", 1) for line in frame.split(b"\n") if b": " in line)
+            if b"event" in fields:
+                return fields[b"event"].decode(), orjson.loads(fields[b"data"])
+
+
+def _streams(user_id) -> int:
+    return len(coupon_events._streams.get(str(user_id), ()))
+
+
+async def test_stream_receives_the_users_coupon_changes(client, started_app):
+    headers = await signup_and_signin(client, "events@example.com")
+    other = await signup_and_signin(client, "events-other@example.com")
+    user = await User.get(email="events@example.com")
+
+    async with EventStream(started_app, headers) as stream:
+        assert stream.ready == {"version": await get_coupon_version(user.id)}
+        assert _streams(user.id) == 1
+
+        # Another user's writes don't reach this stream
+        await client.post("/api/coupons/", json={"barcode": "events-not-mine"}, headers=other)
+
+        coupon = (await client.post("/api/coupons/", json={"barcode": "events-1"}, headers=headers)).json()
+        event, data = await stream.event()
+        assert event == "created"
+        assert [(item["id"], item["barcode"], item["is_used"]) for item in data["coupons"]] == [
+            (coupon["id"], "events-1", False)
+        ]
+
+        await client.post("/api/coupons/batch", json=[{"barcode": "events-2"}, {"barcode": "events-3"}], headers=headers)
+        event, data = await stream.event()
+        assert event == "created"
+        assert [item["barcode"] for item in data["coupons"]] == ["events-2", "events-3"]
+
+        await client.put(f"/api/coupons/{coupon['id']}/mark-used", headers=headers)
+        event, data = await stream.event()
+        assert event == "used"
+        assert [(item["id"], item["is_used"]) for item in data["coupons"]] == [(coupon["id"], True)]
+
+        await client.delete(f"/api/coupons/{coupon['id']}", headers=headers)
+        assert await stream.event() == ("deleted", {"ids": [coupon["id"]]})
+
+    assert _streams(user.id) == 0
+
+
+async def test_every_stream_of_a_user_gets_the_event(client, started_app):
+    headers = await signup_and_signin(client, "events-devices@example.com")
+    user = await User.get(email="events-devices@example.com")
+    streams_before = coupon_events.stats()["streams"]
+
+    async with EventStream(started_app, headers) as phone, EventStream(started_app, headers) as laptop:
+        assert _streams(user.id) == 2
+        assert coupon_events.stats()["streams"] == streams_before + 2
+        await client.post("/api/coupons/", json={"barcode": "events-devices"}, headers=headers)
+        assert (await phone.event())[0] == "created"
+        assert (await laptop.event())[0] == "created"
+
+    # Disconnecting drops the queue, and the user's entry with it
+    assert str(user.id) not in coupon_events._streams
+    assert coupon_events.stats()["streams"] == streams_before
+
+
+async def test_closing_streams_ends_them(client, started_app):
+    headers = await signup_and_signin(client, "events-close@example.com")
+    user = await User.get(email="events-close@example.com")
+
+    async with EventStream(started_app, headers) as stream:
+        coupon_events.close_streams()
+        await asyncio.wait_for(stream.task, 5)
+        assert _streams(user.id) == 0
+
+
+async def test_stream_needs_a_token(client):
+    response = await client.get("/api/coupons/events", params={"token": "not-a-token"})
+    assert response.status_code == 401
+
+
+async def test_slow_stream_gets_a_resync():
+    bus = CouponEventBus("test", queue_size=2, retry_seconds=1)
+    queue = bus.subscribe("user")
+    for i in range(3):
+        await bus.publish("user", "deleted", {"ids": [i]})
+
+    assert queue.get_nowait() == b'event: resync\ndata: {}\n\n'
+    assert queue.empty()
+    assert bus.stats()["resyncs"] == 1
+
+    bus.close_streams()
+    assert queue.get_nowait() is CLOSE
+    bus.unsubscribe("user", queue)
+    assert bus.stats()["streams"] == 0
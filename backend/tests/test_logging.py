@@ -0,0 +1,50 @@
+import logging
+
+import pytest
+
+from app.models import OtpCode
+from app.utils.logger import MaskedEmail, logger
+
+pytestmark = pytest.mark.anyio
+
+
+class CaptureHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+@pytest.fixture
+def log_messages():
+    handler = CaptureHandler()
+    logger.addHandler(handler)
+    yield handler.messages
+    logger.removeHandler(handler)
+
+
+def test_masked_email():
+    assert str(MaskedEmail("jane.doe@example.com")) == "j***@example.com"
+    assert str(MaskedEmail("not-an-email")) == "***"
+    assert str(MaskedEmail("")) == "***"
+
+
+async def test_auth_logs_carry_no_secrets(client, log_messages):
+    email, password = "log-secrets@example.com", "hunter2-secret"
+    await client.post("/api/auth/signup", json={"email": email, "password": password})
+    code = (await OtpCode.get(email=email)).code
+    wrong = "000000" if code != "000000" else "111111"
+    await client.post("/api/auth/verify-otp", json={"email": email, "otp": wrong})
+    await client.post("/api/auth/signin", json={"email": email, "password": "wrong-password"})
+    await client.post("/api/auth/verify-otp", json={"email": email, "otp": code})
+    response = await client.post("/api/auth/signin", json={"email": email, "password": password})
+    token = response.json()["access_token"]
+    await client.get("/api/coupons/", headers={"Authorization": "Bearer " + token})
+    await client.get("/api/auth/me", headers={"Authorization": "Bearer " + token[:-4] + "AAAA"})
+
+    assert log_messages
+    for message in log_messages:
+        for secret in (email, code, wrong, password, "wrong-password", token[:20]):
+            assert secret not in message, message
@@ -0,0 +1,181 @@
+import asyncio
+import re
+import uuid
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from tortoise.backends.base.client import Capabilities
+
+from app.models import User
+from app.utils.mutations import delete_coupons, mark_coupons_used
+from app.utils.versions import get_coupon_version
+from tests.conftest import signup_and_signin
+
+pytestmark = pytest.mark.anyio
+
+
+async def _create(client, headers, barcode: str, value: float = 0.25) -> dict:
+    response = await client.post("/api/coupons/", json={"barcode": barcode, "value": value}, headers=headers)
+    assert response.status_code == 200
+    return response.json()
+
+
+async def _summary(client, headers) -> dict:
+    response = await client.get("/api/coupons/summary", headers=headers)
+    (row,) = response.json()["currencies"]
+    return row
+
+
+async def _version(email: str) -> int:
+    return await get_coupon_version((await User.get(email=email)).id)
+
+
+async def test_coupon_is_redeemed_once(client):
+    headers = await signup_and_signin(client, "redeem-once@example.com")
+    coupon = await _create(client, headers, "redeem-once")
+    version = await _version("redeem-once@example.com")
+
+    response = await client.put(f"/api/coupons/{coupon['id']}/mark-used", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["is_used"] is True
+    used_at = response.json()["used_at"]
+    assert await _version("redeem-once@example.com") == version + 1
+
+    response = await client.put(f"/api/coupons/{coupon['id']}/mark-used", headers=headers)
+    assert response.status_code == 409
+    # Nothing written the second time
+    assert await _version("redeem-once@example.com") == version + 1
+    response = await client.get(f"/api/coupons/{coupon['id']}", headers=headers)
+    assert response.json()["used_at"] == used_at
+
+    summary = await _summary(client, headers)
+    assert (summary["total_count"], summary["used_count"]) == (1, 1)
+    assert Decimal(str(summary["unused_value"])) == 0
+
+
+async def test_concurrent_redeems_only_one_wins(client):
+    headers = await signup_and_signin(client, "redeem-race@example.com")
+    coupon = await _create(client, headers, "redeem-race")
+    responses = await asyncio.gather(*(
+        client.put(f"/api/coupons/{coupon['id']}/mark-used", headers=headers) for _ in range(3)
+    ))
+    assert sorted(response.status_code for response in responses) == [200, 409, 409]
+    assert (await _summary(client, headers))["used_count"] == 1
+
+
+async def test_other_users_coupons_are_not_found(client):
+    owner = await signup_and_signin(client, "mutations-owner@example.com")
+    other = await signup_and_signin(client, "mutations-other@example.com")
+    coupon = await _create(client, owner, "owned")
+    version = await _version("mutations-owner@example.com")
+
+    assert (await client.put(f"/api/coupons/{coupon['id']}/mark-used", headers=other)).status_code == 404
+    assert (await client.delete(f"/api/coupons/{coupon['id']}", headers=other)).status_code == 404
+    response = await client.post("/api/coupons/mark-used", json={"ids": [coupon["id"]]}, headers=other)
+    assert response.json() == {"updated": [], "skipped": [coupon["id"]]}
+    response = await client.post("/api/coupons/delete", json={"ids": [coupon["id"]]}, headers=other)
+    assert response.json() == {"deleted": [], "skipped": [coupon["id"]]}
+
+    response = await client.get(f"/api/coupons/{coupon['id']}", headers=owner)
+    assert response.json()["is_used"] is False
+    assert await _version("mutations-owner@example.com") == version
+    assert (await client.put(f"/api/coupons/{uuid.uuid4()}/mark-used", headers=owner)).status_code == 404
+
+
+async def test_delete_updates_summary_and_version(client):
+    headers = await signup_and_signin(client, "delete-summary@example.com")
+    used = await _create(client, headers, "delete-used", 0.25)
+    unused = await _create(client, headers, "delete-unused", 0.5)
+    await client.put(f"/api/coupons/{used['id']}/mark-used", headers=headers)
+    version = await _version("delete-summary@example.com")
+
+    assert (await client.delete(f"/api/coupons/{unused['id']}", headers=headers)).status_code == 204
+    assert (await client.delete(f"/api/coupons/{unused['id']}", headers=headers)).status_code == 404
+    assert await _version("delete-summary@example.com") == version + 1
+    summary = await _summary(client, headers)
+    assert (summary["total_count"], summary["used_count"]) == (1, 1)
+    assert Decimal(str(summary["total_value"])) == Decimal("0.25")
+    assert Decimal(str(summary["unused_value"])) == 0
+
+
+async def test_bulk_mark_used_skips_redeemed_and_unknown(client):
+    headers = await signup_and_signin(client, "bulk-redeem@example.com")
+    coupons = [await _create(client, headers, f"bulk-redeem-{i}") for i in range(3)]
+    await client.put(f"/api/coupons/{coupons[0]['id']}/mark-used", headers=headers)
+    unknown = str(uuid.uuid4())
+
+    ids = [coupon["id"] for coupon in coupons] + [unknown, coupons[1]["id"]]
+    response = await client.post("/api/coupons/mark-used", json={"ids": ids}, headers=headers)
+    result = response.json()
+    assert sorted(coupon["id"] for coupon in result["updated"]) == sorted([coupons[1]["id"], coupons[2]["id"]])
+    assert result["skipped"] == [coupons[0]["id"], unknown]
+    summary = await _summary(client, headers)
+    assert (summary["total_count"], summary["used_count"]) == (3, 3)
+
+
+class RecordingConnection:
+    """Stands in for a Tortoise client of the given dialect and records the SQL it is sent."""
+
+    def __init__(self, dialect: str, rows=()):
+        self.capabilities = Capabilities(dialect)
+        self.rows = list(rows)
+        self.queries = []
+
+    async def execute_query(self, query, values=None):
+        self.queries.append((query, values))
+        return len(self.rows), self.rows
+
+
+def _assert_placeholders_match(dialect: str, query: str, values: list):
+    if dialect == "postgres":
+        assert "?" not in query
+        assert {int(n) for n in re.findall(r"\$(\d+)", query)} == set(range(1, len(values) + 1))
+    else:
+        assert "$" not in query
+        assert query.count("?") == len(values)
+
+
+@pytest.mark.parametrize("dialect", ["postgres", "sqlite"])
+async def test_mark_used_statement(started_app, dialect):
+    user_id, ids, now = uuid.uuid4(), [uuid.uuid4(), uuid.uuid4()], datetime.utcnow()
+    row = (ids[0], "123", Decimal("0.25"), "EUR", True, now, now, user_id)
+    connection = RecordingConnection(dialect, [row])
+
+    rows = await mark_coupons_used(connection, user_id, ids, now)
+    assert [(row.id, row.is_used, row.value, row.user_id) for row in rows] == [(ids[0], True, Decimal("0.25"), user_id)]
+    ((query, values),) = connection.queries
+    _assert_placeholders_match(dialect, query, values)
+    assert 'NOT "is_used"' in query and "RETURNING" in query
+    if dialect == "postgres":
+        # Native types, and the id list as one uuid[] parameter
+        assert values == [now, user_id, ids]
+        assert '"id" = ANY($3::uuid[])' in query
+    else:
+        assert values == [now.isoformat(" "), str(user_id)] + [str(coupon_id) for coupon_id in ids]
+
+
+@pytest.mark.parametrize("dialect", ["postgres", "sqlite"])
+async def test_delete_statements(started_app, dialect):
+    user_id, ids = uuid.uuid4(), [uuid.uuid4(), uuid.uuid4()]
+    connection = RecordingConnection(dialect)
+
+    assert await delete_coupons(connection, user_id, ids) == []
+    # Nothing in coupon, so the archive is tried for the same ids
+    assert [re.search(r'DELETE FROM "(\w+)"', query).group(1) for query, _ in connection.queries] == [
+        "coupon", "coupon_archive",
+    ]
+    for query, values in connection.queries:
+        _assert_placeholders_match(dialect, query, values)
+        assert "RETURNING" in query
+        if dialect == "postgres":
+            assert values == [user_id, ids]
+        else:
+            assert values == [str(user_id)] + [str(coupon_id) for coupon_id in ids]
+
+
+async def test_empty_id_list_runs_nothing(started_app):
+    connection = RecordingConnection("postgres")
+    assert await mark_coupons_used(connection, uuid.uuid4(), [], datetime.utcnow()) == []
+    assert await delete_coupons(connection, uuid.uuid4(), []) == []
+    assert connection.queries == []
@@ -0,0 +1,101 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.config import settings
+from app.models import OtpCode
+from app.utils.otp import (
+    OTP_EXPIRED, OTP_INVALID, OTP_LOCKED, OTP_MISSING, OTP_VALID, PURPOSE_RESET, PURPOSE_VERIFY,
+    check_otp, issue_otp, sweep_expired,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+def _wrong(code: str) -> str:
+    return "000000" if code != "000000" else "111111"
+
+
+async def test_right_code_is_consumed(started_app):
+    code = await issue_otp("otp-valid@example.com", PURPOSE_VERIFY)
+    assert await check_otp("otp-valid@example.com", PURPOSE_VERIFY, code) == OTP_VALID
+    assert await check_otp("otp-valid@example.com", PURPOSE_VERIFY, code) == OTP_MISSING
+
+
+async def test_wrong_code_counts_an_attempt(started_app):
+    code = await issue_otp("otp-wrong@example.com", PURPOSE_VERIFY)
+    assert await check_otp("otp-wrong@example.com", PURPOSE_VERIFY, _wrong(code)) == OTP_INVALID
+    assert await check_otp("otp-wrong@example.com", PURPOSE_VERIFY, "") == OTP_INVALID
+    assert (await OtpCode.get(email="otp-wrong@example.com")).attempts == 2
+    # Still usable below the limit
+    assert await check_otp("otp-wrong@example.com", PURPOSE_VERIFY, code) == OTP_VALID
+
+
+async def test_locked_after_max_attempts(started_app):
+    code = await issue_otp("otp-locked@example.com", PURPOSE_VERIFY)
+    for _ in range(settings.OTP_MAX_ATTEMPTS):
+        assert await check_otp("otp-locked@example.com", PURPOSE_VERIFY, _wrong(code)) == OTP_INVALID
+    assert await check_otp("otp-locked@example.com", PURPOSE_VERIFY, code) == OTP_LOCKED
+
+    # A new code starts over
+    code = await issue_otp("otp-locked@example.com", PURPOSE_VERIFY)
+    assert await check_otp("otp-locked@example.com", PURPOSE_VERIFY, code) == OTP_VALID
+
+
+async def test_expired_code(started_app):
+    code = await issue_otp("otp-expired@example.com", PURPOSE_VERIFY)
+    await OtpCode.filter(email="otp-expired@example.com").update(expires_at=datetime.utcnow() - timedelta(seconds=1))
+    assert await check_otp("otp-expired@example.com", PURPOSE_VERIFY, code) == OTP_EXPIRED
+    # Checking an expired code neither consumes it nor counts an attempt
+    row = await OtpCode.get(email="otp-expired@example.com")
+    assert row.attempts == 0
+
+    assert await sweep_expired(batch_size=10) >= 1
+    assert await check_otp("otp-expired@example.com", PURPOSE_VERIFY, code) == OTP_MISSING
+
+
+async def test_purposes_are_separate(started_app):
+    verify = await issue_otp("otp-purpose@example.com", PURPOSE_VERIFY)
+    reset = await issue_otp("otp-purpose@example.com", PURPOSE_RESET)
+    if verify != reset:
+        assert await check_otp("otp-purpose@example.com", PURPOSE_RESET, verify) == OTP_INVALID
+    assert await check_otp("otp-purpose@example.com", PURPOSE_VERIFY, verify) == OTP_VALID
+    assert await check_otp("otp-purpose@example.com", PURPOSE_RESET, reset) == OTP_VALID
+
+
+async def test_code_is_consumed_once_by_concurrent_checks(started_app, monkeypatch):
+    code = await issue_otp("otp-race@example.com", PURPOSE_VERIFY)
+    # Both requests read the row before either deletes it
+    get_or_none = OtpCode.get_or_none
+    fetched = 0
+    both_fetched = asyncio.Event()
+
+    async def get_or_none_together(*args, **kwargs):
+        nonlocal fetched
+        row = await get_or_none(*args, **kwargs)
+        fetched += 1
+        if fetched == 2:
+            both_fetched.set()
+        await both_fetched.wait()
+        return row
+
+    monkeypatch.setattr(OtpCode, "get_or_none", get_or_none_together)
+    results = await asyncio.gather(
+        check_otp("otp-race@example.com", PURPOSE_VERIFY, code),
+        check_otp("otp-race@example.com", PURPOSE_VERIFY, code),
+    )
+    assert sorted(results) == sorted([OTP_VALID, OTP_INVALID])
+
+
+async def test_verify_endpoint(client):
+    await client.post("/api/auth/signup", json={"email": "otp-route@example.com", "password": "password"})
+    code = (await OtpCode.get(email="otp-route@example.com", purpose=PURPOSE_VERIFY)).code
+
+    response = await client.post("/api/auth/verify-otp", json={"email": "otp-route@example.com", "otp": _wrong(code)})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid OTP."
+    response = await client.post("/api/auth/verify-otp", json={"email": "otp-route@example.com", "otp": code})
+    assert response.status_code == 200
+    response = await client.post("/api/auth/signin", json={"email": "otp-route@example.com", "password": "password"})
+    assert response.status_code == 200
@@ -0,0 +1,89 @@
+import base64
+from datetime import timedelta
+
+import pytest
+
+from app.utils.archive import archive_used_coupons
+from tests.conftest import signup_and_signin
+
+pytestmark = pytest.mark.anyio
+
+
+async def _all_pages(client, headers, limit: int, **params) -> list:
+    """Every page of GET /api/coupons, following X-Next-Cursor; one list of pages."""
+    pages = []
+    cursor = None
+    while True:
+        query = dict(params, limit=limit)
+        if cursor:
+            query["cursor"] = cursor
+        response = await client.get("/api/coupons/", params=query, headers=headers)
+        assert response.status_code == 200, response.text
+        pages.append(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return pages
+
+
+async def test_pages_through_rows_with_identical_scanned_at(client):
+    headers = await signup_and_signin(client, "pages-ties@example.com")
+    # One batch insert: every coupon gets the same scanned_at, so only the id orders them
+    response = await client.post(
+        "/api/coupons/batch", json=[{"barcode": f"tie-{i}"} for i in range(7)], headers=headers
+    )
+    assert response.json()["created"] == 7
+    everything = (await client.get("/api/coupons/", headers=headers)).json()
+    assert len({coupon["scanned_at"] for coupon in everything}) == 1
+
+    pages = await _all_pages(client, headers, limit=3)
+    assert [len(page) for page in pages] == [3, 3, 1]
+    ids = [coupon["id"] for page in pages for coupon in page]
+    assert ids == [coupon["id"] for coupon in everything]
+    assert ids == sorted(ids, reverse=True)
+
+
+async def test_last_full_page_has_no_cursor(client):
+    headers = await signup_and_signin(client, "pages-exact@example.com")
+    await client.post("/api/coupons/batch", json=[{"barcode": f"exact-{i}"} for i in range(4)], headers=headers)
+    pages = await _all_pages(client, headers, limit=2)
+    assert [len(page) for page in pages] == [2, 2]
+
+
+@pytest.mark.parametrize("cursor", [
+    "not-a-cursor",
+    base64.urlsafe_b64encode(b"2025-01-01T00:00:00|not-a-uuid").decode(),
+    base64.urlsafe_b64encode(b"yesterday|7f1d3a52-0d6b-4d7e-9a59-1a4f3a0e9b11").decode(),
+    base64.urlsafe_b64encode(b"2025-01-01|a|b").decode(),
+    base64.urlsafe_b64encode(b"\xff\xfe\xfd").decode(),
+])
+async def test_tampered_cursor_is_rejected(client, cursor):
+    headers = await signup_and_signin(client, f"pages-cursor-{abs(hash(cursor))}@example.com")
+    response = await client.get("/api/coupons/", params={"cursor": cursor}, headers=headers)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+async def test_include_archived_pages_through_both_tables(client):
+    headers = await signup_and_signin(client, "pages-archive@example.com")
+    created = []
+    for i in range(6):
+        response = await client.post("/api/coupons/", json={"barcode": f"archive-page-{i}"}, headers=headers)
+        created.append(response.json()["id"])
+    # Redeem and archive every other coupon
+    for coupon_id in created[::2]:
+        await client.put(f"/api/coupons/{coupon_id}/mark-used", headers=headers)
+    await archive_used_coupons(timedelta(0), batch_size=100)
+    newest_first = created[::-1]
+
+    pages = await _all_pages(client, headers, limit=2)
+    assert [coupon["id"] for page in pages for coupon in page] == created[1::2][::-1]
+
+    pages = await _all_pages(client, headers, limit=2, include_archived="true")
+    assert [coupon["id"] for page in pages for coupon in page] == newest_first
+
+    # Archived coupons are all redeemed, so they never show up among unused ones
+    pages = await _all_pages(client, headers, limit=2, include_archived="true", used="false")
+    assert [coupon["id"] for page in pages for coupon in page] == created[1::2][::-1]
+
+    pages = await _all_pages(client, headers, limit=2, include_archived="true", used="true")
+    assert [coupon["id"] for page in pages for coupon in page] == created[::2][::-1]
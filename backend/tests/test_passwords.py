@@ -0,0 +1,38 @@
+from passlib.hash import bcrypt
+import pytest
+
+from app.utils.passwords import PasswordHasher
+
+pytestmark = pytest.mark.anyio
+
+
+def _hasher(rounds: int) -> PasswordHasher:
+    hasher = PasswordHasher()
+    hasher.rounds = rounds
+    return hasher
+
+
+def test_rehashes_weaker_hashes():
+    assert _hasher(6).needs_rehash(bcrypt.using(rounds=4).hash("secret"))
+
+
+def test_keeps_hashes_at_the_configured_cost():
+    assert not _hasher(5).needs_rehash(bcrypt.using(rounds=5).hash("secret"))
+
+
+def test_never_downgrades_stronger_hashes():
+    assert not _hasher(4).needs_rehash(bcrypt.using(rounds=12).hash("secret"))
+
+
+def test_ignores_malformed_hashes():
+    assert not _hasher(4).needs_rehash("not-a-bcrypt-hash")
+
+
+async def test_verify_and_update_keeps_stronger_hash():
+    hasher = _hasher(4)
+    try:
+        valid, new_hash = await hasher.verify_and_update("secret", bcrypt.using(rounds=6).hash("secret"))
+    finally:
+        hasher.shutdown()
+    assert valid
+    assert new_hash is None
@@ -0,0 +1,48 @@
+import httpx
+import pytest
+from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
+
+from app.config import settings
+from app.server import gunicorn_options
+from app.utils.ratelimit import auth_rate_limiter
+
+pytestmark = pytest.mark.anyio
+
+# The default FORWARDED_ALLOW_IPS: nginx on the same host
+PROXY = "127.0.0.1"
+
+
+def proxied_client(app, client_host: str) -> httpx.AsyncClient:
+    # The proxy-header handling uvicorn puts in front of the app when served
+    app = ProxyHeadersMiddleware(app, trusted_hosts=settings.FORWARDED_ALLOW_IPS)
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app, client=(client_host, 1234)), base_url="http://test")
+
+
+async def _signin(client, forwarded_for: str, attempt: int) -> int:
+    response = await client.post(
+        "/api/auth/signin",
+        json={"email": f"nobody{attempt}@example.com", "password": "wrong"},
+        headers={"X-Forwarded-For": forwarded_for},
+    )
+    return response.status_code
+
+
+def test_server_trusts_configured_proxies():
+    assert gunicorn_options(1, "127.0.0.1:8000")["forwarded_allow_ips"] == settings.FORWARDED_ALLOW_IPS
+
+
+async def test_limits_are_per_client_behind_proxy(started_app):
+    capacity = int(auth_rate_limiter.rules["signin"]["ip"][0])
+    async with proxied_client(started_app, PROXY) as client:
+        statuses = [await _signin(client, "198.51.100.1", attempt) for attempt in range(capacity + 1)]
+        assert statuses[:-1] == [401] * capacity
+        assert statuses[-1] == 429
+        # Another client behind the same proxy is not affected
+        assert await _signin(client, "198.51.100.2", capacity + 1) == 401
+
+
+async def test_forwarded_for_is_ignored_from_untrusted_peers(started_app):
+    capacity = int(auth_rate_limiter.rules["signin"]["ip"][0])
+    async with proxied_client(started_app, "203.0.113.9") as client:
+        statuses = [await _signin(client, f"198.51.100.{10 + attempt}", attempt) for attempt in range(capacity + 1)]
+    assert statuses[-1] == 429
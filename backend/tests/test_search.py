@@ -0,0 +1,91 @@
+import re
+import uuid
+
+import pytest
+from tortoise.backends.base.client import Capabilities
+
+from app.utils.search import _escape_like, _prefix_upper_bound, search_coupons
+from tests.conftest import signup_and_signin
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.parametrize("value, escaped", [
+    ("abc", "abc"),
+    ("50%", "50\\%"),
+    ("a_b", "a\\_b"),
+    ("back\\slash", "back\\\\slash"),
+    # The escape character is escaped first, so it never doubles up with the others
+    ("\\%_", "\\\\\\%\\_"),
+])
+def test_escape_like(value, escaped):
+    assert _escape_like(value) == escaped
+
+
+@pytest.mark.parametrize("q, upper", [
+    ("400", "401"),
+    ("40z", "40{"),
+    ("a\ud7ff", "a\ue000"),  # skips the surrogates
+    ("a\U0010ffff", "b"),
+    ("\U0010ffff", None),
+])
+def test_prefix_upper_bound(q, upper):
+    assert _prefix_upper_bound(q) == upper
+
+
+async def test_search_ranks_exact_prefix_then_substring(client):
+    headers = await signup_and_signin(client, "search-rank@example.com")
+    for barcode in ("x40123", "40123", "401239", "402", "4012"):
+        await client.post("/api/coupons/", json={"barcode": barcode}, headers=headers)
+
+    response = await client.get("/api/coupons/search", params={"q": "4012"}, headers=headers)
+    # Within a rank, newest first
+    assert [coupon["barcode"] for coupon in response.json()] == ["4012", "401239", "40123", "x40123"]
+
+    # Too short for a substring search: prefixes only
+    response = await client.get("/api/coupons/search", params={"q": "40"}, headers=headers)
+    assert [coupon["barcode"] for coupon in response.json()] == ["4012", "402", "401239", "40123"]
+
+
+async def test_search_treats_wildcards_literally(client):
+    headers = await signup_and_signin(client, "search-wildcards@example.com")
+    for barcode in ("ab%cd", "abXcd", "a_c", "abc", "a\\c"):
+        await client.post("/api/coupons/", json={"barcode": barcode}, headers=headers)
+
+    async def search(q):
+        response = await client.get("/api/coupons/search", params={"q": q}, headers=headers)
+        return sorted(coupon["barcode"] for coupon in response.json())
+
+    assert await search("b%c") == ["ab%cd"]
+    assert await search("a_") == ["a_c"]
+    assert await search("a\\") == ["a\\c"]
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.capabilities = Capabilities("postgres")
+        self.queries = []
+
+    async def execute_query(self, query, values=None):
+        self.queries.append((query, values))
+        return 0, []
+
+
+async def test_postgres_prefix_search_is_an_index_range(started_app):
+    connection = RecordingConnection()
+    user_id = uuid.uuid4()
+    await search_coupons(connection, user_id, "40", limit=10)
+    ((query, values),) = connection.queries
+
+    where = query.split("WHERE", 1)[1]
+    assert "LIKE" not in where.split("ORDER BY")[0]
+    lower, upper = (int(n) for n in re.search(r'"barcode" ~>=~ \$(\d+) AND "barcode" ~<~ \$(\d+)', where).groups())
+    assert (values[lower - 1], values[upper - 1]) == ("40", "41")
+    assert {int(n) for n in re.findall(r"\$(\d+)", query)} == set(range(1, len(values) + 1))
+
+
+async def test_postgres_substring_search_escapes_the_pattern(started_app):
+    connection = RecordingConnection()
+    await search_coupons(connection, uuid.uuid4(), "5%_off", limit=10)
+    ((query, values),) = connection.queries
+    assert "%5\\%\\_off%" in values
@@ -99,7 +99,7 @@ function ScanCoupon() {
       // Extract barcode data
       const barcodeData = {
         barcode: decodedText,
-        // You can add value parsing logic here if the barcode contains value information
+        // The server validates the check digit and fills in the value encoded in the barcode
       };
       
       try {